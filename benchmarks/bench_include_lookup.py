@@ -0,0 +1,91 @@
+# benchmarks/bench_include_lookup.py
+#
+# Include-list selection on a synthetic menu: the old full scan with per-item
+# include/exclude checks vs. MenuIndex lookups of just the whitelisted IDs.
+#
+#   python benchmarks/bench_include_lookup.py --items 50000 --included 20
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cloud_function"))
+
+from menu_index import MenuIndex, select_restock_items  # noqa: E402
+
+
+def synthetic_items(n_items, seed=7):
+    rng = random.Random(seed)
+    modes = ["NOT_TRACKED", "FORCED_IN_STOCK", "FORCED_OUT_OF_STOCK"]
+    return [
+        {
+            "inventory_mode": rng.choice(modes),
+            "availability": rng.choice(["AVAILABLE", "SOLD_OUT"]),
+            "price": rng.randint(500, 50000),
+            "product": {"gtin": str(7000000000000 + i), "sku": f"sku-{i}"},
+        }
+        for i in range(n_items)
+    ]
+
+
+def full_scan(items, excluded_gtins, excluded_skus, included_gtins, included_skus):
+    """The pre-index get_sold_out_items loop, kept here as the baseline."""
+    excluded_gtins = set(excluded_gtins)
+    excluded_skus = set(excluded_skus)
+    included_gtins = set(included_gtins)
+    included_skus = set(included_skus)
+    sold_out = []
+    for item in items:
+        product = item.get("product", {})
+        gtin = product.get("gtin")
+        sku = product.get("sku")
+        if item.get("inventory_mode") != "FORCED_OUT_OF_STOCK":
+            continue
+        if gtin in excluded_gtins or sku in excluded_skus:
+            continue
+        if included_gtins or included_skus:
+            if gtin and gtin not in included_gtins and not (sku and sku in included_skus):
+                continue
+            if sku and sku not in included_skus and not (gtin and gtin in included_gtins):
+                continue
+        if gtin:
+            sold_out.append({"type": "gtin", "id": gtin})
+        elif sku:
+            sold_out.append({"type": "sku", "id": sku})
+    return sold_out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--included", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    items = synthetic_items(args.items)
+    rng = random.Random(1)
+    picks = rng.sample(range(args.items), args.included)
+    included_gtins = [items[i]["product"]["gtin"] for i in picks[: args.included // 2]]
+    included_skus = [items[i]["product"]["sku"] for i in picks[args.included // 2:]]
+    excluded_skus = [f"sku-{i}" for i in range(0, args.items, 97)]
+    filters = ([], excluded_skus, included_gtins, included_skus)
+
+    def per_call(fn):
+        return min(timeit.repeat(fn, number=1, repeat=args.repeat)) * 1000
+
+    index = MenuIndex.from_items(items, "bench")
+    scan_ms = per_call(lambda: full_scan(items, *filters))
+    build_ms = per_call(lambda: MenuIndex.from_items(items, "bench"))
+    lookup_ms = per_call(lambda: select_restock_items(index, *filters))
+
+    print(f"Menu: {args.items} items, include list: {args.included} IDs")
+    print(f"  full scan           : {scan_ms:8.3f} ms/call")
+    print(f"  index build (once)  : {build_ms:8.3f} ms")
+    print(f"  indexed lookup      : {lookup_ms:8.3f} ms/call ({scan_ms / lookup_ms:,.0f}x faster than the scan)")
+
+
+if __name__ == "__main__":
+    main()
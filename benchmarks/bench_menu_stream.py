@@ -0,0 +1,100 @@
+# benchmarks/bench_menu_stream.py
+#
+# Peak RSS per venue: full json parse + indented snapshot (old fetch_menu path)
+# vs. the streaming parser with the snapshot tee'd from the same bytes.
+#
+#   python benchmarks/bench_menu_stream.py --items 50000
+#
+# Each mode runs in a fresh subprocess so peak RSS isn't shared between them.
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cloud_function"))
+
+
+def write_synthetic_menu(path, n_items):
+    rng = random.Random(42)
+    modes = ["NOT_TRACKED", "FORCED_IN_STOCK", "FORCED_OUT_OF_STOCK"]
+    with open(path, "w") as f:
+        f.write('{"status": "READY", "menu": {"items": [')
+        for i in range(n_items):
+            item = {
+                "id": f"item-{i}",
+                "name": f"Product {i}",
+                "description": "Lorem ipsum dolor sit amet " * 4,
+                "price": rng.randint(500, 50000),
+                "image_url": f"https://images.example.com/{i}.jpg",
+                "inventory_mode": rng.choice(modes),
+                "availability": rng.choice(["AVAILABLE", "SOLD_OUT"]),
+                "product": {"gtin": str(7000000000000 + i), "sku": f"sku-{i}", "vat_percentage": 15},
+                "options": [{"name": "size", "values": ["S", "M", "L"]}],
+            }
+            if i:
+                f.write(",")
+            json.dump(item, f)
+        f.write("]}}")
+
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_mode(mode, menu_path, snapshot_path):
+    from main import get_sold_out_items
+
+    baseline = peak_rss_kb()
+    if mode == "full":
+        with open(menu_path, "rb") as f:
+            menu_data = json.loads(f.read())
+        menu_data["venue_id"] = "bench"
+        with open(snapshot_path, "w") as f:
+            json.dump(menu_data, f, indent=2)
+    else:
+        from menu_stream import parse_menu_stream
+        with open(menu_path, "rb") as source, open(snapshot_path, "wb") as sink:
+            menu_data = parse_menu_stream(source, sink=sink)
+        menu_data["venue_id"] = "bench"
+    sold_out = get_sold_out_items(menu_data)
+    print(json.dumps({"mode": mode, "baseline_kb": baseline, "peak_kb": peak_rss_kb(), "sold_out": len(sold_out)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--mode", choices=["full", "stream"])
+    parser.add_argument("--menu")
+    args = parser.parse_args()
+
+    if args.mode:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_mode(args.mode, args.menu, os.path.join(tmp, "snapshot.json"))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        menu_path = os.path.join(tmp, "menu.json")
+        write_synthetic_menu(menu_path, args.items)
+        size_mb = os.path.getsize(menu_path) / 1e6
+        print(f"Synthetic menu: {args.items} items, {size_mb:.1f} MB")
+        for mode in ("full", "stream"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--menu", menu_path],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(out)
+            delta_mb = (result["peak_kb"] - result["baseline_kb"]) / 1024
+            print(f"{mode:>6}: peak RSS {result['peak_kb'] / 1024:7.1f} MB "
+                  f"(+{delta_mb:.1f} MB for parsing), sold-out items: {result['sold_out']}")
+
+
+if __name__ == "__main__":
+    main()
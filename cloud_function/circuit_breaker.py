@@ -0,0 +1,72 @@
+# cloud_function/circuit_breaker.py
+#
+# Circuit breaker per venue ("circuit" section of the venue's state). Failures
+# are classified (auth, rate_limit, server_error, network, export_timeout,
+# error); after CIRCUIT_THRESHOLD in a row the circuit opens and the venue is
+# skipped until its cooldown ends. The next run then probes it (half-open): a
+# restock that goes through closes the circuit, another failure reopens it with
+# twice the cooldown.
+
+import os
+import time
+
+from state_store import get_venue_state, update_venue_state
+
+# Consecutive failures before a venue is skipped, and for how long
+CIRCUIT_THRESHOLD = int(os.environ.get("CIRCUIT_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN_MIN", "60")) * 60
+CIRCUIT_MAX_COOLDOWN = 24 * 3600
+# Failures that won't fix themselves (a rotated password) open the circuit at once
+IMMEDIATE_OPEN = {"auth"}
+
+
+def classify_status(status):
+    if status in (401, 403):
+        return "auth"
+    if status == 429:
+        return "rate_limit"
+    if status is None:
+        return "network"
+    if status >= 500:
+        return "server_error"
+    return "client_error"
+
+
+def circuit_check(venue_id):
+    """None if the venue may run now, otherwise why it's skipped."""
+    circuit = get_venue_state(venue_id, "circuit")
+    if not circuit or circuit.get("state") != "open":
+        return None
+    remaining = circuit["opened_at"] + circuit["cooldown"] - time.time()
+    if remaining > 0:
+        return (f"⛔ Skipped: circuit open after {circuit['failures']} failure(s), last {circuit['kind']} "
+                f"({circuit['detail']}); next try in {remaining / 60:.0f} min")
+    update_venue_state(venue_id, "circuit", lambda c: {**c, "state": "half_open"})
+    print(f"[{venue_id}] 🔌 Circuit half-open, probing")
+    return None
+
+
+def record_circuit_failure(venue_id, kind, detail=""):
+    now = time.time()
+
+    def update(circuit):
+        circuit = circuit or {"state": "closed", "failures": 0}
+        failures = circuit["failures"] + 1
+        if circuit["state"] == "half_open":
+            cooldown = min(CIRCUIT_MAX_COOLDOWN, circuit["cooldown"] * 2)
+        elif circuit["state"] == "open" or failures >= (1 if kind in IMMEDIATE_OPEN else CIRCUIT_THRESHOLD):
+            cooldown = circuit.get("cooldown", CIRCUIT_COOLDOWN)
+        else:
+            return {"state": "closed", "failures": failures, "kind": kind, "detail": detail}
+        return {"state": "open", "failures": failures, "kind": kind, "detail": detail,
+                "opened_at": now, "cooldown": cooldown}
+
+    circuit = update_venue_state(venue_id, "circuit", update)
+    if circuit["state"] == "open":
+        print(f"[{venue_id}] ⛔ Circuit open ({kind}: {detail}) for {circuit['cooldown'] / 60:.0f} min")
+
+
+def record_circuit_success(venue_id):
+    if get_venue_state(venue_id, "circuit"):
+        update_venue_state(venue_id, "circuit", lambda _: None)
+        print(f"[{venue_id}] 🔌 Circuit closed")
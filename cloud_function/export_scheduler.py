@@ -0,0 +1,74 @@
+# cloud_function/export_scheduler.py
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExportScheduler:
+    """
+    Timer-heap scheduler for pending menu exports.
+
+    Jobs sit on a heap ordered by their next poll time. When a job is due it is
+    handed to the worker pool; the poll callback returns the number of seconds
+    until the job should be polled again, or None once the job is finished.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+
+    def schedule(self, delay, job):
+        with self._cond:
+            self._push(delay, job)
+            self._cond.notify()
+
+    def run(self, poll, deadline=None):
+        """
+        Block until every scheduled job has finished. With a deadline (a
+        time.monotonic() value), stop once no job is due before it and nothing
+        is in flight; the jobs left on the heap are returned.
+        """
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap and self._in_flight == 0:
+                        return []
+                    if deadline is not None and self._heap and self._heap[0][0] >= deadline:
+                        if self._in_flight == 0:
+                            return self._drain()
+                        self._cond.wait()
+                    elif self._heap:
+                        remaining = self._heap[0][0] - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                self._in_flight += 1
+            self._pool.submit(self._run_job, poll, job)
+
+    def _run_job(self, poll, job):
+        try:
+            delay = poll(job)
+        except Exception as e:
+            print(f"🚨 Export poll crashed: {e}")
+            delay = None
+        with self._cond:
+            self._in_flight -= 1
+            if delay is not None:
+                self._push(delay, job)
+            self._cond.notify()
+
+    def _drain(self):
+        jobs = [job for _, _, job in sorted(self._heap)]
+        self._heap = []
+        return jobs
+
+    def _push(self, delay, job):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
@@ -0,0 +1,250 @@
+# cloud_function/filter_rules.py
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9: windows use the process's local time
+    ZoneInfo = None
+
+# Venue config keys a rule set is built from. Exact IDs, ID prefixes and
+# shell-style name/category patterns (case-insensitive), each as an
+# excluded_* and included_* list.
+FILTER_KEYS = tuple(
+    f"{side}_{kind}"
+    for side in ("excluded", "included")
+    for kind in ("gtins", "skus", "gtin_prefixes", "sku_prefixes", "name_patterns", "category_patterns")
+)
+# "scheduled_rules": [{"from", "until", "days", "hours", <filter keys>}]
+SCHEDULE_KEY = "scheduled_rules"
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# Time zone for scheduled rules (e.g. Europe/Oslo); unset = the process's local time
+RULES_TIMEZONE = os.environ.get("RULES_TIMEZONE", "")
+# Compiled venue rule sets kept between warm invocations
+CACHE_SIZE = int(os.environ.get("RULES_CACHE_SIZE", "256"))
+
+_END = None
+
+
+class PrefixTrie:
+    """Character trie; match() is true when any stored prefix starts value."""
+
+    def __init__(self, prefixes):
+        self.root = {}
+        for prefix in prefixes:
+            node = self.root
+            for char in str(prefix):
+                node = node.setdefault(char, {})
+            node[_END] = True
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def match(self, value):
+        if not value:
+            return False
+        node = self.root
+        for char in str(value):
+            node = node.get(char)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+def compile_patterns(patterns):
+    """One case-insensitive regex for a list of shell-style patterns, or None."""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns), re.IGNORECASE)
+
+
+def _matches_any(regex, values):
+    return any(regex.match(value) for value in values or ())
+
+
+class Matcher:
+    """The exclude (or include) side of a rule set, called once per item."""
+
+    def __init__(self, gtins=(), skus=(), gtin_prefixes=(), sku_prefixes=(),
+                 name_patterns=(), category_patterns=()):
+        self.gtins = frozenset(gtins)
+        self.skus = frozenset(skus)
+        self.gtin_prefixes = PrefixTrie(p for p in gtin_prefixes if p)
+        self.sku_prefixes = PrefixTrie(p for p in sku_prefixes if p)
+        self.name_re = compile_patterns(name_patterns)
+        self.category_re = compile_patterns(category_patterns)
+
+    def __bool__(self):
+        return bool(self.gtins or self.skus or self.gtin_prefixes or self.sku_prefixes
+                    or self.name_re or self.category_re)
+
+    def __call__(self, gtin, sku, names, categories):
+        return (
+            gtin in self.gtins
+            or sku in self.skus
+            or (bool(self.gtin_prefixes) and self.gtin_prefixes.match(gtin))
+            or (bool(self.sku_prefixes) and self.sku_prefixes.match(sku))
+            or (self.name_re is not None and _matches_any(self.name_re, names))
+            or (self.category_re is not None and _matches_any(self.category_re, categories))
+        )
+
+
+class RuleSet:
+    """
+    The filters in force at one moment, in the shape select_restock_items
+    expects: exact included IDs (resolved by lookup), plus an include predicate
+    for included prefixes/patterns and an exclude predicate, or None when unused.
+    """
+
+    def __init__(self, filters, fingerprint):
+        self.fingerprint = fingerprint
+        self.included_gtins = frozenset(filters["included_gtins"])
+        self.included_skus = frozenset(filters["included_skus"])
+        include = Matcher(gtin_prefixes=filters["included_gtin_prefixes"],
+                          sku_prefixes=filters["included_sku_prefixes"],
+                          name_patterns=filters["included_name_patterns"],
+                          category_patterns=filters["included_category_patterns"])
+        exclude = Matcher(filters["excluded_gtins"], filters["excluded_skus"],
+                          filters["excluded_gtin_prefixes"], filters["excluded_sku_prefixes"],
+                          filters["excluded_name_patterns"], filters["excluded_category_patterns"])
+        self.include = include or None
+        self.exclude = exclude or None
+
+
+# ─────────────────────────────────────────────────────
+# Scheduled rules: extra filters that only apply within a date range, on
+# certain weekdays and/or between certain hours
+def _parse_moment(value):
+    return datetime.fromisoformat(value) if "T" in value or " " in value else date.fromisoformat(value)
+
+
+def _minutes(hhmm):
+    hours, _, minutes = hhmm.strip().partition(":")
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def _parse_hours(value):
+    """"HH:MM-HH:MM" as minutes since midnight; the range may wrap past midnight."""
+    start, end = value.split("-")
+    return _minutes(start), _minutes(end)
+
+
+class Window:
+    def __init__(self, rule):
+        self.start = _parse_moment(rule["from"]) if rule.get("from") else None
+        self.until = _parse_moment(rule["until"]) if rule.get("until") else None
+        self.days = set()
+        for day in rule.get("days", []):
+            if day.lower()[:3] not in WEEKDAYS:
+                raise ValueError(f"unknown weekday {day!r}")
+            self.days.add(WEEKDAYS.index(day.lower()[:3]))
+        self.hours = _parse_hours(rule["hours"]) if rule.get("hours") else None
+
+    @staticmethod
+    def _as_of(bound, now):
+        # Date-only bounds compare against today's date (and "until" is inclusive)
+        return now if isinstance(bound, datetime) else now.date()
+
+    def active(self, now):
+        if self.start is not None and self._as_of(self.start, now) < self.start:
+            return False
+        if self.until is not None and self._as_of(self.until, now) > self.until:
+            return False
+        weekday = now.weekday()
+        if self.hours is not None:
+            minute = now.hour * 60 + now.minute
+            start, end = self.hours
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+                # After midnight, a wrapped range still belongs to the day it started on
+                if minute < end:
+                    weekday = (weekday - 1) % 7
+            if not inside:
+                return False
+        return not self.days or weekday in self.days
+
+
+def _filters(config):
+    return {key: [str(value) for value in config.get(key, [])] for key in FILTER_KEYS}
+
+
+def _now():
+    if RULES_TIMEZONE and ZoneInfo is not None:
+        return datetime.now(ZoneInfo(RULES_TIMEZONE)).replace(tzinfo=None)
+    return datetime.now()
+
+
+class VenueRules:
+    """
+    A venue's compiled filters. at(now) merges in the scheduled rules active at
+    that moment; the merged RuleSet is built once per combination of active
+    rules and reused.
+    """
+
+    def __init__(self, venue, fingerprint):
+        venue_id = venue.get("venue_id", "unknown")
+        self.fingerprint = fingerprint
+        self.base = _filters(venue)
+        self.scheduled = []
+        for n, rule in enumerate(venue.get(SCHEDULE_KEY, []), 1):
+            if not isinstance(rule, dict):
+                print(f"[{venue_id}] ⚠️ Ignoring scheduled rule #{n}: not an object")
+                continue
+            try:
+                self.scheduled.append((Window(rule), _filters(rule)))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                print(f"[{venue_id}] ⚠️ Ignoring scheduled rule #{n}: {e}")
+        self._rule_sets = {}
+        self._lock = threading.Lock()
+
+    def at(self, now=None):
+        now = now or _now()
+        active = tuple(n for n, (window, _) in enumerate(self.scheduled) if window.active(now))
+        with self._lock:
+            rule_set = self._rule_sets.get(active)
+            if rule_set is None:
+                merged = {key: list(values) for key, values in self.base.items()}
+                for n in active:
+                    for key, values in self.scheduled[n][1].items():
+                        merged[key].extend(values)
+                fingerprint = self.fingerprint if not active else f"{self.fingerprint}+{','.join(map(str, active))}"
+                rule_set = self._rule_sets[active] = RuleSet(merged, fingerprint)
+        return rule_set
+
+
+# ─────────────────────────────────────────────────────
+# Cache of compiled rules, keyed by a hash of the venue's filter config
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def rules_fingerprint(venue):
+    config = {key: venue.get(key, []) for key in FILTER_KEYS + (SCHEDULE_KEY,) if venue.get(key)}
+    raw = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_venue_rules(venue):
+    fingerprint = rules_fingerprint(venue)
+    with _cache_lock:
+        rules = _cache.get(fingerprint)
+        if rules is not None:
+            _cache.move_to_end(fingerprint)
+            return rules
+    rules = VenueRules(venue, fingerprint)
+    with _cache_lock:
+        _cache[fingerprint] = rules
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return rules
@@ -0,0 +1,192 @@
+# cloud_function/job_queue.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "/tmp/wolt_jobs.sqlite3")
+# Retry policy, named after Cloud Tasks' RetryConfig
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+MIN_BACKOFF = float(os.environ.get("JOB_MIN_BACKOFF_SEC", "300"))
+MAX_BACKOFF = float(os.environ.get("JOB_MAX_BACKOFF_SEC", "3600"))
+# Finished jobs are kept this long (for stats and name dedupe), then deleted
+DONE_RETENTION = 86400
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"
+
+
+def retry_delay(attempts, min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF):
+    """Seconds before retrying a job that has failed `attempts` times: doubles from min_backoff."""
+    return min(max_backoff, min_backoff * 2 ** max(0, attempts - 1))
+
+
+class Task:
+    __slots__ = ("name", "payload", "attempts", "lease_id", "last_error")
+
+    def __init__(self, name, payload, attempts=0, lease_id=None, last_error=None):
+        self.name = name
+        self.payload = payload
+        self.attempts = attempts
+        self.lease_id = lease_id
+        self.last_error = last_error
+
+
+class JobQueue:
+    """
+    Pull queue in the shape of Cloud Tasks' pull API: create_task, lease_tasks,
+    acknowledge_task, cancel_lease, plus fail_task for a failed attempt. A task
+    is leased for a visibility timeout; if it's neither acknowledged, failed
+    nor cancelled by then (the worker died), it becomes leasable again and the
+    lost lease counts as a failed attempt.
+    """
+
+    def create_task(self, name, payload, schedule_time=None):
+        """Adds a task unless one with this name is still pending or leased. Returns True if added."""
+        raise NotImplementedError
+
+    def lease_tasks(self, max_tasks, lease_duration):
+        """Up to max_tasks due tasks, leased for lease_duration seconds."""
+        raise NotImplementedError
+
+    def acknowledge_task(self, task):
+        raise NotImplementedError
+
+    def cancel_lease(self, task):
+        """Hands the task back untouched (not attempted); it's leasable again right away."""
+        raise NotImplementedError
+
+    def fail_task(self, task, error=None, retry=True):
+        """Failed attempt: retry after backoff, or dead-letter after MAX_ATTEMPTS (or right away without retry)."""
+        raise NotImplementedError
+
+    def stats(self):
+        """{status: count}"""
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, path=JOB_QUEUE_PATH, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "name TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, "
+                "lease_id TEXT, last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, available_at)")
+
+    def _connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create_task(self, name, payload, schedule_time=None):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE name = ?", (name,)).fetchone()
+            if row and row[0] in (PENDING, LEASED):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (name, payload, status, attempts, available_at, "
+                "lease_id, last_error, created_at, updated_at) VALUES (?, ?, ?, 0, ?, NULL, NULL, ?, ?)",
+                (name, json.dumps(payload), PENDING, schedule_time or now, now, now),
+            )
+        return True
+
+    def lease_tasks(self, max_tasks, lease_duration):
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        with self._lock, self._connect() as conn:
+            # Leases that ran out were lost with their worker: that was an attempt too
+            expired = conn.execute(
+                "SELECT name, attempts FROM jobs WHERE status = ? AND available_at <= ?", (LEASED, now)
+            ).fetchall()
+            for name, attempts in expired:
+                self._fail(conn, name, attempts, "lease expired", now)
+            conn.execute("DELETE FROM jobs WHERE status = ? AND updated_at < ?", (DONE, now - DONE_RETENTION))
+            rows = conn.execute(
+                "SELECT name, payload, attempts, last_error FROM jobs "
+                "WHERE status = ? AND available_at <= ? ORDER BY available_at LIMIT ?",
+                (PENDING, now, max_tasks),
+            ).fetchall()
+            for name, _, _, _ in rows:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, lease_id = ?, available_at = ?, updated_at = ? WHERE name = ?",
+                    (LEASED, lease_id, now + lease_duration, now, name),
+                )
+        return [Task(name, json.loads(payload), attempts, lease_id, last_error)
+                for name, payload, attempts, last_error in rows]
+
+    def acknowledge_task(self, task):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_id = NULL, updated_at = ? WHERE name = ? AND lease_id = ?",
+                (DONE, time.time(), task.name, task.lease_id),
+            )
+
+    def cancel_lease(self, task):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_id = NULL, updated_at = ? "
+                "WHERE name = ? AND lease_id = ?",
+                (PENDING, now, now, task.name, task.lease_id),
+            )
+
+    def fail_task(self, task, error=None, retry=True):
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE name = ? AND lease_id = ?", (task.name, task.lease_id)
+            ).fetchone()
+            if row:
+                return self._fail(conn, task.name, row[0], error, time.time(), retry)
+        return None
+
+    def _fail(self, conn, name, attempts, error, now, retry=True):
+        attempts += 1
+        if attempts >= self.max_attempts or not retry:
+            status, available_at = DEAD, now
+            print(f"☠️ Job {name} dead-lettered after {attempts} attempts: {error}")
+        else:
+            status, available_at = PENDING, now + retry_delay(attempts)
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = ?, available_at = ?, lease_id = NULL, "
+            "last_error = ?, updated_at = ? WHERE name = ?",
+            (status, attempts, available_at, error, now, name),
+        )
+        return status
+
+    def dead_letters(self):
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name, payload, attempts, last_error FROM jobs WHERE status = ? ORDER BY updated_at",
+                (DEAD,),
+            ).fetchall()
+        return [Task(name, json.loads(payload), attempts, None, last_error)
+                for name, payload, attempts, last_error in rows]
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = SQLiteJobQueue()
+        return _queue
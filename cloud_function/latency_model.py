@@ -0,0 +1,85 @@
+# cloud_function/latency_model.py
+
+import random
+
+# How many READY latencies to remember per venue
+WINDOW = 20
+# First poll lands at this percentile of the venue's observed latency
+FIRST_POLL_PERCENTILE = 0.9
+MIN_FIRST_POLL = 3
+MAX_FIRST_POLL = 120
+MIN_BACKOFF = 2
+MAX_BACKOFF = 20
+# An export that never became READY was slower than the time we gave it;
+# record it as this multiple of the elapsed time
+TIMEOUT_PENALTY = 1.5
+
+
+def new_record():
+    return {"samples": [], "timeouts": 0}
+
+
+def coerce_record(value):
+    """
+    Accepts a stored record or a legacy flat wait time (old retry config format).
+    """
+    if isinstance(value, dict):
+        record = new_record()
+        record.update(value)
+        return record
+    if isinstance(value, (int, float)):
+        return {"samples": [float(value)], "timeouts": 0}
+    return new_record()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _add_sample(record, seconds):
+    record["samples"] = (record.get("samples", []) + [round(seconds, 2)])[-WINDOW:]
+
+
+def record_ready(record, lower, upper):
+    """
+    The export became READY somewhere between the previous poll (lower, seconds
+    after the export request) and the poll that saw it READY (upper). Storing the
+    midpoint lets the estimate drift down while we keep hitting READY on the first
+    poll, and settle once polls start landing just before the export is done.
+    """
+    _add_sample(record, lower + (upper - lower) / 2)
+    record["timeouts"] = 0
+    return record
+
+
+def record_timeout(record, elapsed):
+    _add_sample(record, elapsed * TIMEOUT_PENALTY)
+    record["timeouts"] = record.get("timeouts", 0) + 1
+    return record
+
+
+def first_poll_delay(record, default):
+    estimate = percentile(record.get("samples", []), FIRST_POLL_PERCENTILE)
+    if estimate is None:
+        return default
+    return round(min(MAX_FIRST_POLL, max(MIN_FIRST_POLL, estimate)), 1)
+
+
+def next_poll_delay(record, attempt):
+    """
+    Backoff after a not-READY poll. The base step is the spread of the venue's
+    latency history (how far past the first poll READY usually lands), doubled
+    per attempt, with equal jitter so concurrent venues don't poll in lockstep.
+    """
+    samples = record.get("samples", [])
+    spread = 0
+    if len(samples) >= 2:
+        spread = percentile(samples, 0.95) - percentile(samples, FIRST_POLL_PERCENTILE)
+    delay = min(MAX_BACKOFF, max(MIN_BACKOFF, spread) * (2 ** attempt))
+    return round(delay / 2 + random.uniform(0, delay / 2), 1)
@@ -1,167 +1,314 @@
 import requests
+import glob
 import json
 import time
 import os
-from datetime import datetime
-import flask
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import latency_model
+import menu_diff
+import metrics
+import profiling
+from circuit_breaker import circuit_check, classify_status, record_circuit_failure, record_circuit_success
+from export_scheduler import ExportScheduler
+from filter_rules import get_venue_rules
+from job_queue import get_job_queue, retry_delay
+from menu_index import MenuIndex, select_restock_items
+from menu_stream import parse_menu_stream
+from runs import (FUNCTION_TIMEOUT, async_run_id, checkpoint_venue, discard_run, load_run, mark_run, prune_runs,
+                  restock_succeeded, run_status, start_async_run, stream_run, venue_failed)
+from sharding import MAX_SHARDS, dispatch, get_dispatcher, hash_shard, partition
+from snapshot_store import get_snapshot_store
+from state_store import get_state_store, get_venue_state, update_venue_state
+from venue_config import load_venue_config
+from wolt_client import (
+    BISECT_STATUSES, connection_stats, get_client, log_connection_stats, poison_keys, prune_quarantine,
+    send_item_batches, summarize_batches
+)
 
 DEFAULT_WAIT = 30
-RETRY_CONFIG_PATH = "/tmp/retry_delay_config.json"
+DEFAULT_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+MAX_WORKERS_LIMIT = 32
+MAX_POLL_ATTEMPTS = 8
+INCREMENTAL_MENUS = os.environ.get("INCREMENTAL_MENUS", "0") == "1"
+QUARANTINE_TTL = float(os.environ.get("QUARANTINE_TTL_DAYS", "14")) * 86400
+# Predicted per-item cost (parsing + restock) used to balance shards
+SHARD_ITEM_COST = float(os.environ.get("SHARD_ITEM_COST_MS", "0.2")) / 1000
+# A run stops this many seconds short of the function timeout and can be resumed
+DEADLINE_MARGIN = float(os.environ.get("DEADLINE_MARGIN_SEC", "30"))
+# Weight of the newest sample in a venue's average run time
+TIMING_ALPHA = 0.3
+# A prefetched export (?prefetch=1) older than this is not used
+PREFETCH_MAX_AGE = float(os.environ.get("PREFETCH_MAX_AGE_MIN", "30")) * 60
+# Jobs leased per ?drain=1 round
+DRAIN_BATCH = int(os.environ.get("JOB_DRAIN_BATCH", "50"))
 
 # ─────────────────────────────────────────────────────
-# Load venue config from JSON
+# Load venue config from JSON (validated and compiled once per file version,
+# cached on warm instances, see venue_config.py)
 def load_venues(config_name="venues.json"):
     try:
-        with open(config_name, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return list(load_venue_config(config_name))
     except Exception as e:
         print(f"❌ Failed to load venues config '{config_name}': {e}")
         return []
 
+# ?config= takes one file, a comma-separated list and/or globs
+# (e.g. venues_*.json); several configs run as one fleet
+def is_multi_config(config_spec):
+    return "," in config_spec or glob.has_magic(config_spec)
+
+def resolve_config_names(config_spec):
+    names = []
+    for part in config_spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if glob.has_magic(part):
+            matches = sorted(glob.glob(part))
+            if not matches:
+                print(f"⚠️ No config files match '{part}'")
+            names.extend(matches)
+        else:
+            names.append(part)
+    return list(dict.fromkeys(names))
+
+def load_venue_groups(config_names):
+    """
+    ({config: [venue]}, {venue_id: config}). A venue listed in several configs
+    runs once, under the first config; the second dict maps the venue_ids
+    skipped in later configs to that first config.
+    """
+    groups = {}
+    owner = {}
+    duplicates = {}
+    for config_name in config_names:
+        groups[config_name] = []
+        for venue in load_venues(config_name):
+            venue_id = venue["venue_id"]
+            if venue_id in owner:
+                print(f"[{venue_id}] ♻️ Also in {config_name}, runs once with {owner[venue_id]}")
+                duplicates.setdefault(config_name, {})[venue_id] = owner[venue_id]
+                continue
+            owner[venue_id] = config_name
+            groups[config_name].append(venue)
+    return groups, duplicates
+
+def group_results(groups, duplicates, results):
+    grouped = {}
+    for config_name, venues in groups.items():
+        grouped[config_name] = {venue["venue_id"]: results.get(venue["venue_id"]) for venue in venues}
+        for venue_id, first in duplicates.get(config_name, {}).items():
+            grouped[config_name][venue_id] = venue_result(f"Processed with {first}")
+    return grouped
+
 # ─────────────────────────────────────────────────────
-# Retry delay utils
-def load_retry_config():
-    if os.path.exists(RETRY_CONFIG_PATH):
-        try:
-            with open(RETRY_CONFIG_PATH, "r") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+# Retry delay utils: per-venue READY latency history drives the poll schedule
+def get_latency_record(venue_id):
+    return latency_model.coerce_record(get_venue_state(venue_id, "latency"))
 
-def save_retry_config(config):
-    try:
-        with open(RETRY_CONFIG_PATH, "w") as f:
-            json.dump(config, f, indent=2)
-    except Exception as e:
-        print(f"⚠️ Could not save retry config: {e}")
+def update_latency_record(venue_id, update):
+    update_venue_state(venue_id, "latency", lambda r: update(latency_model.coerce_record(r)))
 
+# Seconds to wait after the export request before the first poll
 def get_wait_time(venue_id):
-    config = load_retry_config()
-    return config.get(venue_id, DEFAULT_WAIT)
+    return latency_model.first_poll_delay(get_latency_record(venue_id), DEFAULT_WAIT)
 
-def increase_wait_time(venue_id):
-    config = load_retry_config()
-    config[venue_id] = config.get(venue_id, DEFAULT_WAIT) + 5
-    save_retry_config(config)
+# Seconds to wait after a not-READY poll
+def get_poll_delay(venue_id, attempt):
+    return latency_model.next_poll_delay(get_latency_record(venue_id), attempt)
 
-def reset_wait_time(venue_id):
-    config = load_retry_config()
-    if venue_id in config:
-        del config[venue_id]
-        save_retry_config(config)
+def record_export_ready(venue_id, lower, upper):
+    update_latency_record(venue_id, lambda r: latency_model.record_ready(r, lower, upper))
+
+def record_export_timeout(venue_id, elapsed):
+    update_latency_record(venue_id, lambda r: latency_model.record_timeout(r, elapsed))
+
+# Seconds from export request to restocked, averaged over past runs
+def record_venue_timing(venue_id, elapsed):
+    def update(timing):
+        previous = (timing or {}).get("elapsed")
+        average = elapsed if previous is None else previous + TIMING_ALPHA * (elapsed - previous)
+        return {"elapsed": round(average, 2)}
+    update_venue_state(venue_id, "timing", update)
 
 # ─────────────────────────────────────────────────────
-# Fetch Wolt menu and save to /tmp
-def fetch_menu(venue):
+# Quarantine: items Wolt rejected on their own ("gtin:<id>" / "sku:<id>"),
+# skipped on later runs until QUARANTINE_TTL_DAYS pass
+def get_quarantined(venue_id):
+    return set(prune_quarantine(get_venue_state(venue_id, "quarantine"), QUARANTINE_TTL))
+
+def quarantine_items(venue_id, keys):
+    now = time.time()
+    update_venue_state(
+        venue_id, "quarantine",
+        lambda entries: {**prune_quarantine(entries, QUARANTINE_TTL), **{key: now for key in keys}}
+    )
+
+# ─────────────────────────────────────────────────────
+# Wolt menu export: request → poll resource_url → save to /tmp
+def request_menu_export(venue):
     venue_id = venue["venue_id"]
-    username = venue["api_username"]
-    password = venue["api_password"]
-    menu_url = f"https://pos-integration-service.wolt.com/v2/venues/{venue_id}/menu"
+    client = get_client(venue["api_username"], venue["api_password"])
 
-    print(f"[{venue_id}] 📥 Fetching menu...")
-    response = requests.get(menu_url, auth=(username, password))
+    print(f"[{venue_id}] 📥 Requesting menu export...")
+    try:
+        with metrics.span("export_request", venue_id) as span:
+            response = client.get(f"/v2/venues/{venue_id}/menu")
+            span.update(status=response.status_code, bytes=len(response.content))
+    except requests.RequestException as e:
+        print(f"[{venue_id}] ❌ Initial request error: {e}")
+        record_circuit_failure(venue_id, "network", str(e)[:200])
+        return None
     if response.status_code != 202:
         print(f"[{venue_id}] ❌ Initial request failed: {response.status_code}")
-        increase_wait_time(venue_id)
+        record_circuit_failure(venue_id, classify_status(response.status_code), f"HTTP {response.status_code}")
         return None
 
     resource_url = response.json().get("resource_url")
     if not resource_url:
         print(f"[{venue_id}] ❌ No resource URL.")
-        increase_wait_time(venue_id)
         return None
 
-    wait_time = get_wait_time(venue_id)
-    print(f"[{venue_id}] ⏳ Waiting {wait_time} seconds...")
-    time.sleep(wait_time)
+    return resource_url
 
-    for attempt in range(8):
-        menu_response = requests.get(resource_url)
+# poll_menu_export's answer when the resource_url itself is no good (expired or
+# unknown export): polling it again won't help
+EXPORT_GONE = object()
+
+def poll_menu_export(venue_id, resource_url, attempt, keep_snapshot=True):
+    """
+    Returns the menu once READY, EXPORT_GONE on a 4xx other than 429, otherwise
+    None. The body is streamed: only the
+    item fields the extractor needs are kept (menu_stream.SLIM_FIELDS) while the
+    raw bytes are compressed into the snapshot store (unless keep_snapshot is off).
+    """
+    try:
+        with metrics.span("poll", venue_id, attempt=attempt + 1) as span:
+            menu_response = get_client().get(resource_url, stream=True)
+            span["status"] = menu_response.status_code
+    except requests.RequestException as e:
+        print(f"[{venue_id}] ❌ Menu poll error (attempt {attempt + 1}): {e}")
+        metrics.count("polls", venue=venue_id, outcome="error")
+        return None
+
+    with menu_response:
         if menu_response.status_code != 200:
             print(f"[{venue_id}] ❌ Failed to fetch menu (attempt {attempt + 1}): {menu_response.status_code}")
-            time.sleep(6)
-            continue
+            metrics.count("polls", venue=venue_id, outcome="error")
+            if 400 <= menu_response.status_code < 500 and menu_response.status_code != 429:
+                return EXPORT_GONE
+            return None
 
+        menu_response.raw.decode_content = True
+        snapshot = get_snapshot_store().open_writer(venue_id) if keep_snapshot else None
         try:
-            menu_data = menu_response.json()
+            # Parsing and the snapshot write share one pass over the body
+            with metrics.span("parse", venue_id, snapshot=bool(snapshot)) as span:
+                menu_data = parse_menu_stream(menu_response.raw, sink=snapshot)
+                span.update(bytes=menu_data["size_bytes"], ready=menu_data.get("status") == "READY")
         except Exception as e:
             print(f"[{venue_id}] ❌ Failed to parse menu JSON (attempt {attempt + 1}): {e}")
-            time.sleep(6)
-            continue
+            metrics.count("polls", venue=venue_id, outcome="error")
+            if snapshot:
+                snapshot.discard()
+            return None
 
-        if menu_data.get("status") == "READY":
-            menu_data["venue_id"] = venue_id  # ✅ Inject venue ID here
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-            output_dir = "/tmp/menu_snapshots"
-            os.makedirs(output_dir, exist_ok=True)
-            filepath = os.path.join(output_dir, f"menu_{venue_id}_{timestamp}.json")
-            with open(filepath, "w") as f:
-                json.dump(menu_data, f, indent=2)
+    if menu_data.get("status") != "READY":
+        print(f"[{venue_id}] ⏳ Menu not READY yet (attempt {attempt + 1})...")
+        metrics.count("polls", venue=venue_id, outcome="not_ready")
+        if snapshot:
+            snapshot.discard()
+        return None
 
-            print(f"[{venue_id}] 💾 Menu saved to {filepath}")
-            reset_wait_time(venue_id)
-            return menu_data
+    metrics.count("polls", venue=venue_id, outcome="ready")
+    menu_data["venue_id"] = venue_id  # ✅ Inject venue ID here
+    summary = f"{menu_data['size_bytes']} bytes, {len(menu_data['menu']['items'])} items"
+    if snapshot:
+        with metrics.span("snapshot_commit", venue_id):
+            path = snapshot.commit()
+        print(f"[{venue_id}] 💾 Menu saved to {path} ({summary})")
+    else:
+        print(f"[{venue_id}] 📄 Menu READY ({summary})")
+    return menu_data
 
-        print(f"[{venue_id}] ⏳ Menu not READY yet (attempt {attempt + 1})...")
-        time.sleep(6)
+# ─────────────────────────────────────────────────────
+# Prefetch: ?prefetch=1 (scheduled a few minutes before the main run) only
+# requests the exports and stores their resource_urls. The main run polls
+# those like its own exports (first poll counted from the prefetch) and
+# requests a fresh export only when the prefetched one is missing, stale,
+# rejected with a 4xx or still not READY after MAX_POLL_ATTEMPTS.
+def prefetch_exports(venues, workers):
+    def prefetch(venue):
+        venue_id = venue["venue_id"]
+        skipped = circuit_check(venue_id)
+        if skipped:
+            return venue_id, venue_result(skipped)
+        resource_url, _ = safe_request_export(venue)
+        if not resource_url:
+            return venue_id, venue_result("❌ Export request failed")
+        update_venue_state(venue_id, "prefetch",
+                           lambda _: {"resource_url": resource_url, "requested_at": time.time()})
+        print(f"[{venue_id}] 🛫 Export prefetched")
+        return venue_id, venue_result("Export prefetched.")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(prefetch, venues))
+
+def take_prefetched_export(venue_id):
+    """(resource_url, age in seconds) of a fresh prefetched export, used at most once."""
+    prefetched = get_venue_state(venue_id, "prefetch")
+    if not prefetched:
+        return None
+    update_venue_state(venue_id, "prefetch", lambda _: None)
+    age = time.time() - prefetched["requested_at"]
+    if age > PREFETCH_MAX_AGE:
+        print(f"[{venue_id}] 🕰️ Prefetched export is stale ({age / 60:.0f} min old)")
+        return None
+    return prefetched["resource_url"], age
 
-    print(f"[{venue_id}] ❌ Menu still not READY after 8 attempts.")
-    increase_wait_time(venue_id)
-    return None
+def export_not_ready(venue_id, elapsed):
+    print(f"[{venue_id}] ❌ Menu still not READY after {MAX_POLL_ATTEMPTS} attempts ({elapsed:.0f}s).")
+    record_export_timeout(venue_id, elapsed)
+    record_circuit_failure(venue_id, "export_timeout", f"not READY after {elapsed:.0f}s")
 
 # ─────────────────────────────────────────────────────
 # Extract sold-out items, respecting exclusion/inclusion lists
 def get_sold_out_items(menu_data, excluded_gtins=None, excluded_skus=None,
-                       included_gtins=None, included_skus=None):
-    items = menu_data.get("menu", {}).get("items", [])
-    sold_out = []
-    venue_id = menu_data.get("venue_id", "unknown")
-
-    excluded_gtins = set(excluded_gtins or [])
-    excluded_skus = set(excluded_skus or [])
-    included_gtins = set(included_gtins or [])
-    included_skus = set(included_skus or [])
-
-    for item in items:
-        inventory_mode = item.get("inventory_mode")
-        product = item.get("product", {})
-        gtin = product.get("gtin")
-        sku = product.get("sku")
-
-        if inventory_mode != "FORCED_OUT_OF_STOCK":
-            continue
-
-        if gtin in excluded_gtins or sku in excluded_skus:
-            continue
-
-        if included_gtins or included_skus:
-            if gtin and gtin not in included_gtins and not (sku and sku in included_skus):
-                continue
-            if sku and sku not in included_skus and not (gtin and gtin in included_gtins):
-                continue
-
-        if gtin:
-            sold_out.append({"type": "gtin", "id": gtin})
-        elif sku:
-            sold_out.append({"type": "sku", "id": sku})
-        else:
-            print(f"[{venue_id}] ⚠️ Skipping item with no GTIN/SKU")
+                       included_gtins=None, included_skus=None, quarantined=None, rules=None):
+    """
+    menu_data is a menu export dict or a MenuIndex. The include/exclude
+    precedence lives in menu_index.select_restock_items (shared with local_tests);
+    include lists are resolved by lookup instead of scanning the menu. rules, a
+    compiled filter_rules.RuleSet, takes the place of the four lists.
+    """
+    index = menu_data if isinstance(menu_data, MenuIndex) else MenuIndex.from_menu(menu_data)
+    return select_restock_items(
+        index,
+        excluded_gtins=excluded_gtins,
+        excluded_skus=excluded_skus,
+        included_gtins=included_gtins,
+        included_skus=included_skus,
+        quarantined=quarantined,
+        rules=rules,
+    )
 
-    return sold_out
+# ─────────────────────────────────────────────────────
+# Per-venue entry in the response JSON
+def venue_result(message, **details):
+    return {"result": message, **details}
 
 # ─────────────────────────────────────────────────────
-# Update items to in-stock via Wolt API
+# Update items to in-stock via Wolt API (chunked PATCHes, see wolt_client.py)
 def restock(venue, sold_out_items):
     venue_id = venue["venue_id"]
-    username = venue["api_username"]
-    password = venue["api_password"]
-    update_url = f"https://pos-integration-service.wolt.com/venues/{venue_id}/items"
+    client = get_client(venue["api_username"], venue["api_password"])
 
     if not sold_out_items:
         print(f"[{venue_id}] ✅ No sold-out items.")
-        return "No updates needed."
+        record_circuit_success(venue_id)
+        return venue_result("No updates needed.")
 
     seen = set()
     unique_items = []
@@ -171,64 +318,606 @@ def restock(venue, sold_out_items):
             seen.add(key)
             unique_items.append(item)
 
-    payload = {
-        "data": [
-            {item["type"]: item["id"], "in_stock": True}
-            for item in unique_items
-        ]
-    }
+    data = [{item["type"]: item["id"], "in_stock": True} for item in unique_items]
 
     item_list = ", ".join([item["id"] for item in unique_items])
     print(f"[{venue_id}] 🔁 Restocking {len(unique_items)} items: {item_list}")
 
-    response = requests.patch(
-        update_url,
-        auth=(username, password),
-        headers={"Content-Type": "application/json"},
-        json=payload
-    )
-
-    if response.status_code == 202:
-        print(f"[{venue_id}] ✅ Items successfully marked as in stock.")
-        return f"Restocked {len(unique_items)} items."
+    with metrics.span("restock", venue_id, items=len(data),
+                      bytes=len(json.dumps({"data": data}).encode("utf-8"))) as span:
+        chunks = send_item_batches(client, venue_id, data)
+        span.update(chunks=len(chunks), statuses=[chunk["status"] for chunk in chunks])
+    for chunk in chunks:
+        metrics.count("http_responses", phase="restock", venue=venue_id, code=str(chunk["status"]))
+    sent, total, failed = summarize_batches(chunks)
+    poison = poison_keys(chunks)
+    if poison:
+        print(f"[{venue_id}] 🚧 Quarantining rejected items: {', '.join(poison)}")
+        quarantine_items(venue_id, poison)
+
+    # The circuit only closes once a restock goes through. Rejected items are
+    # quarantined instead; only API-level failures count against the venue.
+    api_failures = [chunk for chunk in failed
+                    if chunk["status"] not in BISECT_STATUSES or chunk.get("venue_rejected")]
+    if api_failures:
+        status = api_failures[0]["status"]
+        record_circuit_failure(venue_id, classify_status(status), f"restock HTTP {status or 'network error'}")
     else:
-        print(f"[{venue_id}] ❌ Failed to update: {response.status_code} - {response.text}")
-        return f"Update failed: {response.status_code}"
+        record_circuit_success(venue_id)
+
+    if not failed:
+        print(f"[{venue_id}] ✅ Items successfully marked as in stock ({len(chunks)} chunk(s)).")
+        return venue_result(f"Restocked {total} items.", chunks=chunks)
+    for chunk in failed:
+        print(f"[{venue_id}] ❌ Chunk {chunk['chunk']} failed: {chunk['status']} - {chunk.get('error', '')}")
+    details = {"chunks": chunks}
+    if poison:
+        details["quarantined"] = poison
+    if sent:
+        return venue_result(f"Restocked {sent} of {total} items "
+                            f"({len(failed)} chunk(s) incomplete, {len(poison)} item(s) quarantined).", **details)
+    return venue_result(f"Update failed: {failed[0]['status'] or 'network error'}", **details)
 
 # ─────────────────────────────────────────────────────
-# MAIN Cloud Function entry
-def reset_sold_out_items(request):
-    config_name = request.args.get("config", "venues.json")
-    venues = load_venues(config_name)
-    if not venues:
-        return f"No venues found in config: {config_name}", 500
-
-    results = {}
-
-    for venue in venues:
-        venue_id = venue.get("venue_id", "unknown")
-        excluded_gtins = venue.get("excluded_gtins", [])
-        excluded_skus = venue.get("excluded_skus", [])
-        included_gtins = venue.get("included_gtins", [])
-        included_skus = venue.get("included_skus", [])
-
-        menu = fetch_menu(venue)
-        if not menu:
-            results[venue_id] = "❌ Failed to fetch menu"
-            continue
-
+# Extract + restock once a venue's menu is READY
+def finish_venue(venue, menu):
+    index = index_menu(menu)
+    if is_incremental(venue):
+        return finish_venue_incremental(venue, menu)
+    return restock(venue, extract_sold_out(venue, index))
+
+# Build the venue's MenuIndex once per fetched menu and keep it for warm
+# invocations and the price updater (MENU_INDEX_DIR)
+def index_menu(menu):
+    with metrics.span("index", menu.get("venue_id", "unknown")) as span:
+        index = MenuIndex.from_menu(menu)
+        span["items"] = len(index)
+    try:
+        index.save()
+    except Exception as e:
+        print(f"[{index.venue_id}] ⚠️ Could not save menu index: {e}")
+    update_venue_state(index.venue_id, "menu", lambda _: {"items": len(index)})
+    return index
+
+# Venues from load_venues carry their compiled rules; plain dicts are compiled (and cached) here
+def venue_rules(venue):
+    return getattr(venue, "rules", None) or get_venue_rules(venue)
+
+def extract_sold_out(venue, menu):
+    """menu is a menu dict or a MenuIndex."""
+    venue_id = venue.get("venue_id", "unknown")
+    with metrics.span("get_sold_out_items", venue_id) as span:
         sold_out_items = get_sold_out_items(
             menu,
-            excluded_gtins=excluded_gtins,
-            excluded_skus=excluded_skus,
-            included_gtins=included_gtins,
-            included_skus=included_skus
+            quarantined=get_quarantined(venue_id),
+            rules=venue_rules(venue).at(),
         )
-        print(f"[{venue_id}] 🛒 Sold-out items: {len(sold_out_items)}")
+        span["items"] = len(sold_out_items)
+    print(f"[{venue_id}] 🛒 Sold-out items: {len(sold_out_items)}")
+    return sold_out_items
 
-        result = restock(venue, sold_out_items)
+# ─────────────────────────────────────────────────────
+# Incremental mode: diff against the previous run's item state and only look
+# at items whose stock state changed. Full passes run on keyframes, after a
+# config change and after any restock that didn't fully go through.
+def is_incremental(venue):
+    return bool(venue.get("incremental", INCREMENTAL_MENUS))
+
+# Changes when the venue's filters change, including a scheduled rule starting or ending
+def filter_fingerprint(venue):
+    return venue_rules(venue).at().fingerprint
+
+def keep_raw_snapshot(venue):
+    return not is_incremental(venue) or menu_diff.keyframe_due(get_snapshot_store(), venue["venue_id"])
+
+def finish_venue_incremental(venue, menu):
+    venue_id = venue["venue_id"]
+    store = get_snapshot_store()
+    items = menu.get("menu", {}).get("items", [])
+    flags = get_venue_state(venue_id, "incremental") or {}
+    fingerprint = filter_fingerprint(venue)
+
+    previous = menu_diff.load_state(store, venue_id)
+    current = menu_diff.index_items(items)
+    full = (previous is None or flags.get("force_full") or flags.get("fingerprint") != fingerprint
+            or menu_diff.keyframe_due(store, venue_id))
+
+    diff_summary = {"mode": "full" if full else "incremental"}
+    if previous is not None:
+        delta = menu_diff.diff_states(previous, current)
+        diff_summary.update(menu_diff.summarize(delta))
+        if not full:
+            items = menu_diff.changed_items(items, delta)
+            print(f"[{venue_id}] 🔍 {len(items)} item(s) changed since the previous run")
+
+    sold_out_items = extract_sold_out(venue, {"venue_id": venue_id, "menu": {"items": items}})
+    result = restock(venue, sold_out_items)
+
+    succeeded = restock_succeeded(result)
+    if succeeded:
+        current = menu_diff.mark_restocked(current, [f"{i['type']}:{i['id']}" for i in sold_out_items])
+    try:
+        diff_summary["stored"] = menu_diff.save_state(store, venue_id, previous, current)
+    except Exception as e:
+        print(f"[{venue_id}] ⚠️ Could not store menu state: {e}")
+        succeeded = False
+    update_venue_state(venue_id, "incremental",
+                       lambda _: {"fingerprint": fingerprint, "force_full": not succeeded})
+
+    result["menu_diff"] = diff_summary
+    return result
+
+# ─────────────────────────────────────────────────────
+# Pipelined run: fire every export up front, then poll them all from one
+# timer heap and restock each venue as soon as its menu is READY
+def get_worker_count(request):
+    raw = request.args.get("workers")
+    try:
+        workers = int(raw) if raw else DEFAULT_WORKERS
+    except ValueError:
+        print(f"⚠️ Invalid workers value '{raw}', using {DEFAULT_WORKERS}")
+        workers = DEFAULT_WORKERS
+    return max(1, min(workers, MAX_WORKERS_LIMIT))
+
+def safe_request_export(venue):
+    requested_at = time.monotonic()
+    try:
+        return request_menu_export(venue), requested_at
+    except Exception as e:
+        print(f"[{venue.get('venue_id', 'unknown')}] 🚨 Export request error: {e}")
+        return None, requested_at
+
+def poll_venue_job(job, record):
+    venue = job["venue"]
+    venue_id = venue["venue_id"]
+    attempt = job["attempt"]
+    try:
+        polled_at = time.monotonic() - job["requested_at"]
+        if attempt == 0 and not job.get("prefetched"):
+            metrics.observe("wait", venue_id, polled_at)
+        menu = poll_menu_export(venue_id, job["resource_url"], attempt, job["keep_snapshot"])
+        if menu is EXPORT_GONE:
+            if job.get("prefetched"):
+                return refetch_venue_job(job, record, "rejected")
+            menu = None
+        if menu:
+            # A prefetched export's age says nothing about this venue's latency
+            if not job.get("prefetched"):
+                record_export_ready(venue_id, job["last_poll"], polled_at)
+                metrics.observe("fetch_menu", venue_id, time.monotonic() - job["requested_at"],
+                                polls=attempt + 1, ready=True)
+            processing_started = time.monotonic()
+            result = finish_venue(venue, menu)
+            finished = time.monotonic()
+            result["timings"] = {
+                "export": round(polled_at, 3),
+                "polls": attempt + 1,
+                "process": round(finished - processing_started, 3),
+                "total": round(finished - job["requested_at"], 3),
+            }
+            record(venue_id, result)
+            if not job.get("prefetched"):
+                record_venue_timing(venue_id, finished - job["requested_at"])
+            return None
+    except Exception as e:
+        print(f"[{venue_id}] 🚨 Unexpected error: {e}")
+        record_circuit_failure(venue_id, "error", str(e)[:200])
+        record(venue_id, venue_result(f"❌ Error: {e}"))
+        return None
+
+    job["attempt"] += 1
+    job["last_poll"] = polled_at
+    if job["attempt"] >= MAX_POLL_ATTEMPTS:
+        if job.get("prefetched"):
+            return refetch_venue_job(job, record, f"not READY after {MAX_POLL_ATTEMPTS} polls")
+        elapsed = time.monotonic() - job["requested_at"]
+        export_not_ready(venue_id, elapsed)
+        metrics.observe("fetch_menu", venue_id, elapsed, polls=job["attempt"], ready=False)
+        record(venue_id, venue_result("❌ Failed to fetch menu"))
+        return None
+    return get_poll_delay(venue_id, attempt)
+
+# The prefetched export's URL was rejected or it never became READY: start over with a fresh one
+def refetch_venue_job(job, record, reason):
+    venue_id = job["venue"]["venue_id"]
+    print(f"[{venue_id}] 🔁 Prefetched export {reason}, requesting a fresh one")
+    resource_url, requested_at = safe_request_export(job["venue"])
+    if not resource_url:
+        record(venue_id, venue_result("❌ Failed to fetch menu"))
+        return None
+    job.update(resource_url=resource_url, requested_at=requested_at, last_poll=0, attempt=0, prefetched=False)
+    return get_wait_time(venue_id)
+
+def run_venues(venues, workers=DEFAULT_WORKERS, deadline=None, on_result=None):
+    """
+    Returns {venue_id: result}. With a deadline (time.monotonic() value) no
+    export is requested whose first poll (get_wait_time) would land past it,
+    and none is polled past it; those venues are left as None.
+    on_result(venue_id, result) is called as each venue finishes.
+    """
+    results = {venue.get("venue_id", "unknown"): None for venue in venues}
+    print(f"🧵 Processing {len(venues)} venues with {workers} workers")
+
+    def record(venue_id, result):
         results[venue_id] = result
+        if on_result:
+            on_result(venue_id, result)
+
+    def request_export(venue):
+        # An export whose first poll would land past the deadline stays pending for the next run
+        if deadline is not None and time.monotonic() + get_wait_time(venue["venue_id"]) > deadline:
+            return None, None, False
+        skipped = circuit_check(venue["venue_id"])
+        if skipped:
+            print(f"[{venue['venue_id']}] {skipped}")
+            record(venue["venue_id"], venue_result(skipped))
+            return None, None, False
+        prefetched = take_prefetched_export(venue["venue_id"])
+        if prefetched:
+            resource_url, age = prefetched
+            return resource_url, time.monotonic() - age, True
+        return safe_request_export(venue) + (False,)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Phase one: start every export so Wolt builds them in parallel
+        exports = list(pool.map(request_export, venues))
+
+        # Phase two: poll all pending exports from a single scheduler
+        scheduler = ExportScheduler(pool)
+        for venue, (resource_url, requested_at, prefetched) in zip(venues, exports):
+            venue_id = venue.get("venue_id", "unknown")
+            if requested_at is None:
+                continue
+            if not resource_url:
+                record(venue_id, venue_result("❌ Failed to fetch menu"))
+                continue
+            # A prefetched export has been building since requested_at too
+            wait_time = max(0, get_wait_time(venue_id) - (time.monotonic() - requested_at))
+            print(f"[{venue_id}] ⏳ First poll in {wait_time:.0f} seconds..."
+                  + (" (prefetched export)" if prefetched else ""))
+            job = {
+                "venue": venue,
+                "resource_url": resource_url,
+                "requested_at": requested_at,
+                "last_poll": 0,
+                "attempt": 0,
+                "keep_snapshot": keep_raw_snapshot(venue),
+                "prefetched": prefetched,
+            }
+            scheduler.schedule(wait_time, job)
+
+        unfinished = scheduler.run(lambda job: poll_venue_job(job, record), deadline)
+
+    for job in unfinished:
+        print(f"[{job['venue']['venue_id']}] ⏸️ Out of time before the export was READY")
+    return results
+
+# ─────────────────────────────────────────────────────
+# Sharding: ?shards=N makes this invocation a coordinator that splits the
+# venues into N shards by predicted cost and sends each to a worker call
+# (?shard=i&of=N, venue_ids in the body), see sharding.py
+def get_shard(request):
+    """(index, count) when this invocation is a shard worker, otherwise None."""
+    raw_shard, raw_of = request.args.get("shard"), request.args.get("of")
+    if raw_shard is None or raw_of is None:
+        return None
+    try:
+        index, count = int(raw_shard), int(raw_of)
+    except ValueError:
+        raise ValueError(f"Invalid shard '{raw_shard}' of '{raw_of}'")
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{raw_shard}' of '{raw_of}'")
+    return index, count
+
+def get_shard_count(request):
+    raw = request.args.get("shards")
+    try:
+        shards = int(raw) if raw else 1
+    except ValueError:
+        print(f"⚠️ Invalid shards value '{raw}', running unsharded")
+        shards = 1
+    return max(1, min(shards, MAX_SHARDS))
+
+def select_shard(venues, shard, body):
+    """The coordinator names the shard's venues; a bare ?shard=i&of=N call hashes venue_ids."""
+    venue_ids = (body or {}).get("venue_ids")
+    if venue_ids is not None:
+        wanted = set(venue_ids)
+        return [venue for venue in venues if venue["venue_id"] in wanted]
+    index, count = shard
+    return [venue for venue in venues if hash_shard(venue["venue_id"], count) == index]
+
+# Expected seconds for a venue: its average run time, or before it has one,
+# learned READY latency plus its last menu size
+def predicted_cost(venue):
+    venue_id = venue["venue_id"]
+    elapsed = (get_venue_state(venue_id, "timing") or {}).get("elapsed")
+    if elapsed is not None:
+        return elapsed
+    items = (get_venue_state(venue_id, "menu") or {}).get("items", 0)
+    return get_wait_time(venue_id) + items * SHARD_ITEM_COST
+
+def run_shards(config_spec, venues, shard_count, workers=None):
+    costs = {venue["venue_id"]: predicted_cost(venue) for venue in venues}
+    shards = [shard for shard in partition(costs, shard_count) if shard]
+    print(f"🧩 Coordinating {len(venues)} venues over {len(shards)} shards")
+
+    jobs = []
+    for i, venue_ids in enumerate(shards):
+        args = {"config": config_spec, "shard": str(i), "of": str(len(shards))}
+        if workers:
+            args["workers"] = str(workers)
+        print(f"🧩 Shard {i}: {len(venue_ids)} venues, predicted {sum(costs[v] for v in venue_ids):.0f}s")
+        jobs.append((args, {"venue_ids": venue_ids}))
+
+    results = {venue["venue_id"]: None for venue in venues}
+    for i, (venue_ids, (shard_results, error)) in enumerate(zip(shards, dispatch(get_dispatcher(reset_sold_out_items), jobs))):
+        if error:
+            print(f"🚨 Shard {i} failed: {error}")
+        for venue_id in venue_ids:
+            if shard_results and shard_results.get(venue_id) is not None:
+                results[venue_id] = shard_results[venue_id]
+            else:
+                results[venue_id] = venue_result(f"❌ Shard {i} failed: {error or 'no result'}")
+    return results
+
+# ─────────────────────────────────────────────────────
+# Deadline + checkpoints: venues run longest-expected-first and each finished
+# venue is checkpointed under the run's ID. A run about to hit the function
+# timeout stops with status "resumable"; calling again with ?run_id=<id> runs
+# only the venues that didn't finish.
+def get_deadline(request, started):
+    raw = request.args.get("deadline")
+    budget = FUNCTION_TIMEOUT - DEADLINE_MARGIN
+    try:
+        budget = float(raw) if raw else budget
+    except ValueError:
+        print(f"⚠️ Invalid deadline value '{raw}', using {budget:.0f}s")
+    return started + budget
+
+def run_resumable(run_id, config_spec, venues, workers, deadline, on_result=None):
+    """
+    ({venue_id: result}, [venue_ids not reached]). Results checkpointed by
+    earlier invocations of the same run are reused, not run again.
+    """
+    completed = load_run(run_id).get("completed", {})
+    if completed:
+        print(f"▶️ Resuming run {run_id}: {len(completed)} venues already done")
+    todo = sorted((venue for venue in venues if venue["venue_id"] not in completed),
+                  key=predicted_cost, reverse=True)
+    def finished(venue_id, result):
+        checkpoint_venue(run_id, config_spec, venue_id, result)
+        if on_result:
+            on_result(venue_id, result)
+
+    results = run_venues(todo, workers, deadline, on_result=finished)
+
+    merged = {}
+    pending = []
+    for venue in venues:
+        venue_id = venue["venue_id"]
+        result = completed.get(venue_id) or results.get(venue_id)
+        if result is None:
+            pending.append(venue_id)
+            result = venue_result(f"⏸️ Deferred: out of time, resume with ?run_id={run_id}")
+        merged[venue_id] = result
+    status = "resumable" if pending else "complete"
+    mark_run(run_id, config=config_spec, status=status)
+    return merged, pending
+
+# ─────────────────────────────────────────────────────
+# Job queue (job_queue.py): a venue that fails is queued as a restock job and
+# retried with backoff by ?drain=1 calls (e.g. Cloud Scheduler every 5
+# minutes). ?queue=1 queues every venue of the config and drains right away.
+RESTOCK_ACTION = "restock"
+
+def enqueue_venue(venue_id, config_name, delay=0, action=RESTOCK_ACTION):
+    return get_job_queue().create_task(
+        f"{action}:{venue_id}",
+        {"action": action, "venue_id": venue_id, "config": config_name},
+        schedule_time=time.time() + delay,
+    )
 
-        time.sleep(10)
+def queue_failed_venues(groups, results):
+    delay = retry_delay(1)
+    for config_name, venues in groups.items():
+        for venue in venues:
+            result = results.get(venue["venue_id"])
+            if result is not None and venue_failed(result) and enqueue_venue(venue["venue_id"], config_name, delay):
+                print(f"[{venue['venue_id']}] 📬 Queued for a retry in {delay / 60:.0f} min")
 
+def find_venue(config_name, venue_id):
+    return next((venue for venue in load_venues(config_name) if venue["venue_id"] == venue_id), None)
+
+def drain_queue(workers, deadline):
+    """Runs due jobs until the queue has none left or time runs out. Returns {venue_id: result}."""
+    queue = get_job_queue()
+    results = {}
+    while time.monotonic() < deadline:
+        # The lease outlives this invocation, so a killed worker's jobs come back
+        tasks = queue.lease_tasks(DRAIN_BATCH, deadline - time.monotonic() + DEADLINE_MARGIN)
+        if not tasks:
+            break
+        venues, tasks_by_venue = [], {}
+        for task in tasks:
+            venue_id = task.payload.get("venue_id")
+            if task.payload.get("action") != RESTOCK_ACTION:
+                queue.fail_task(task, f"unknown action {task.payload.get('action')!r}", retry=False)
+                continue
+            venue = find_venue(task.payload.get("config", "venues.json"), venue_id)
+            if venue is None:
+                print(f"[{venue_id}] ⚠️ No longer in {task.payload.get('config')}, dropping job")
+                queue.acknowledge_task(task)
+                continue
+            if venue_id in tasks_by_venue:
+                queue.cancel_lease(task)
+                continue
+            print(f"[{venue_id}] 📬 Running queued job (attempt {task.attempts + 1})")
+            venues.append(venue)
+            tasks_by_venue[venue_id] = task
+
+        batch = run_venues(venues, workers, deadline)
+        for venue_id, task in tasks_by_venue.items():
+            result = batch.get(venue_id)
+            if result is None:
+                queue.cancel_lease(task)
+            elif venue_failed(result):
+                queue.fail_task(task, result["result"])
+            else:
+                queue.acknowledge_task(task)
+            results[venue_id] = result or venue_result("⏸️ Deferred: out of time, left in the queue")
+        # Nothing fit before the deadline: the same jobs would just be leased again
+        if not any(batch.values()):
+            break
+    return results
+
+def drain_response(workers, deadline):
+    http_before = connection_stats()
+    try:
+        results = drain_queue(workers, deadline)
+    finally:
+        get_state_store().flush()
+        log_connection_stats(http_before)
+    return json.dumps({"drained": len(results), "results": results, "queue": get_job_queue().stats()}, indent=2), 200
+
+# ─────────────────────────────────────────────────────
+# One run over the loaded venues: sharded, or directly with checkpoints
+def execute_run(run_id, keep_run, config_spec, groups, duplicates, venues, shard_count, workers, deadline,
+                grouped=True, on_result=None):
+    """
+    (results, pending venue_ids). Multi-config results are grouped by config
+    unless grouped is off (shard workers answer the coordinator flat).
+    keep_run keeps the run's checkpoint after a complete run. on_result is
+    called as each venue finishes (not for sharded runs).
+    """
+    pending = []
+    http_before = connection_stats()
+    try:
+        if shard_count > 1:
+            results = run_shards(config_spec, venues, shard_count, workers)
+        else:
+            results, pending = run_resumable(run_id, config_spec, venues, workers, deadline, on_result)
+            queue_failed_venues(groups, results)
+            if pending:
+                print(f"⏸️ Stopping before the deadline with {len(pending)} venues left; "
+                      f"resume with ?run_id={run_id}")
+            elif not keep_run:
+                # Nobody can resume a run they never got the ID of
+                discard_run(run_id)
+    finally:
+        get_state_store().flush()
+        log_connection_stats(http_before)
+        metrics.write_metrics_file()
+
+    if grouped and is_multi_config(config_spec):
+        results = group_results(groups, duplicates, results)
+    return results, pending
+
+# ─────────────────────────────────────────────────────
+# Profiling: ?profile=1 (or PROFILE=1 for every invocation) runs the
+# invocation under profiling.profile_call. The report is saved to the
+# snapshot store (kind "profile"); ?profile=1 also returns it next to the
+# response. Async and streamed runs are only profiled up to the response.
+def save_profile(report):
+    try:
+        path = get_snapshot_store().save_json("reset_sold_out_items", report, kind="profile")
+        print(f"🔬 Profile saved to {path}")
+        return path
+    except Exception as e:
+        print(f"⚠️ Could not save profile: {e}")
+        return None
+
+def profiled(request, handler):
+    response, report = profiling.profile_call(handler, request)
+    if report is None:
+        print("⚠️ Another invocation is being profiled; this one isn't")
+        return response
+    profiling.log_report(report, "reset_sold_out_items")
+    path = save_profile(report)
+    # Only plain (body, code) answers get the report; streams and metrics pass through
+    plain = isinstance(response, tuple) and len(response) == 2 and isinstance(response[0], str)
+    if request.args.get("profile") != "1" or not plain:
+        return response
+    body, code = response
+    try:
+        body = json.loads(body)
+    except ValueError:
+        pass
+    return json.dumps({"response": body, "profile": report, "profile_snapshot": path},
+                      indent=2, ensure_ascii=False), code
+
+# ─────────────────────────────────────────────────────
+# MAIN Cloud Function entry
+def reset_sold_out_items(request):
+    if profiling.profiling_requested(request):
+        return profiled(request, handle_request)
+    return handle_request(request)
+
+def handle_request(request):
+    started = time.monotonic()
+    if request.args.get("metrics") == "1":
+        # This instance's phase histograms and counters since it started
+        return metrics.render_openmetrics(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+    if request.args.get("status"):
+        return run_status(request.args.get("status"))
+    if request.args.get("drain") == "1":
+        return drain_response(get_worker_count(request), get_deadline(request, started))
+
+    run_id = request.args.get("run_id")
+    resumed = bool(run_id)
+    run_id = run_id or uuid.uuid4().hex
+    config_spec = request.args.get("config") or (load_run(run_id).get("config") if resumed else None) or "venues.json"
+    groups, duplicates = load_venue_groups(resolve_config_names(config_spec))
+    venues = [venue for group in groups.values() for venue in group]
+    if not venues:
+        return f"No venues found in config: {config_spec}", 500
+
+    if request.args.get("prefetch") == "1":
+        try:
+            results = prefetch_exports(venues, get_worker_count(request))
+        finally:
+            get_state_store().flush()
+        return json.dumps(results, indent=2), 200
+
+    if request.args.get("queue") == "1":
+        queued = sum(enqueue_venue(venue["venue_id"], config_name)
+                     for config_name, group in groups.items() for venue in group)
+        print(f"📬 Queued {queued} venues")
+        return drain_response(get_worker_count(request), get_deadline(request, started))
+
+    try:
+        shard = get_shard(request)
+    except ValueError as e:
+        return str(e), 400
+    shard_count = 1 if shard else get_shard_count(request)
+    if shard:
+        venues = select_shard(venues, shard, request.get_json(silent=True))
+
+    workers = get_worker_count(request)
+    deadline = get_deadline(request, started)
+    if not shard:
+        prune_runs()
+
+    if request.args.get("async") == "1" and not shard:
+        run_id = async_run_id(request, config_spec)
+        return start_async_run(run_id, config_spec, venues, lambda: execute_run(
+            run_id, True, config_spec, groups, duplicates, venues, shard_count, workers, deadline,
+            grouped=False))
+
+    if request.args.get("stream") == "1" and not shard:
+        return stream_run(run_id, lambda on_result: execute_run(
+            run_id, resumed, config_spec, groups, duplicates, venues, shard_count, workers, deadline,
+            grouped=False, on_result=on_result))
+
+    results, pending = execute_run(run_id, resumed, config_spec, groups, duplicates, venues,
+                                   shard_count, workers, deadline, grouped=not shard)
+    if shard:
+        return json.dumps(results, indent=2), 200
+    if resumed or pending:
+        results = {
+            "run_id": run_id,
+            "status": "resumable" if pending else "complete",
+            "pending": pending,
+            "results": results,
+        }
     return json.dumps(results, indent=2), 200
@@ -0,0 +1,124 @@
+# cloud_function/menu_diff.py
+
+import os
+
+# Item fields compared between runs
+TRACKED_FIELDS = ("inventory_mode", "availability", "price")
+# A full state keyframe is stored every N runs; the runs in between store deltas
+KEYFRAME_EVERY = int(os.environ.get("MENU_KEYFRAME_EVERY", "7"))
+STATE_KIND = "menu_state"
+DELTA_KIND = "menu_delta"
+# Recorded for items we restocked, so a later FORCED_OUT_OF_STOCK shows up as a change
+RESTOCKED = "RESTOCKED"
+
+
+def item_key(item):
+    product = item.get("product", {})
+    if product.get("gtin"):
+        return f"gtin:{product['gtin']}"
+    if product.get("sku"):
+        return f"sku:{product['sku']}"
+    return None
+
+
+def index_items(items):
+    """{item_key: {tracked field: value}} for every item with a GTIN or SKU."""
+    state = {}
+    for item in items:
+        key = item_key(item)
+        if key:
+            state[key] = {field: item.get(field) for field in TRACKED_FIELDS}
+    return state
+
+
+def diff_states(previous, current):
+    """Structural diff; "changed" holds the new values of the fields that changed."""
+    added = {key: value for key, value in current.items() if key not in previous}
+    removed = [key for key in previous if key not in current]
+    changed = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if old is None:
+            continue
+        fields = {field: value.get(field) for field in TRACKED_FIELDS if old.get(field) != value.get(field)}
+        if fields:
+            changed[key] = fields
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def apply_delta(state, delta):
+    state = dict(state)
+    for key in delta.get("removed", []):
+        state.pop(key, None)
+    state.update(delta.get("added", {}))
+    for key, fields in delta.get("changed", {}).items():
+        state[key] = {**state.get(key, {}), **fields}
+    return state
+
+
+def summarize(delta):
+    changed = delta["changed"].values()
+    return {
+        "added": len(delta["added"]),
+        "removed": len(delta["removed"]),
+        "inventory_mode_changed": sum(1 for f in changed if "inventory_mode" in f),
+        "availability_changed": sum(1 for f in changed if "availability" in f),
+        "price_changed": sum(1 for f in changed if "price" in f),
+    }
+
+
+def changed_items(items, delta):
+    """Items that were added or whose stock state changed since the previous run."""
+    keys = set(delta["added"])
+    keys.update(
+        key for key, fields in delta["changed"].items()
+        if "inventory_mode" in fields or "availability" in fields
+    )
+    return [item for item in items if item_key(item) in keys]
+
+
+def mark_restocked(state, keys):
+    state = dict(state)
+    for key in keys:
+        if key in state:
+            state[key] = {**state[key], "inventory_mode": RESTOCKED}
+    return state
+
+
+# ─────────────────────────────────────────────────────
+# Keyframe + delta chain in the snapshot store
+def _chain(store, venue_id):
+    keyframe = store.latest(venue_id, STATE_KIND)
+    if keyframe is None:
+        return None, []
+    deltas = [e for e in store.entries(venue_id, DELTA_KIND) if e["created"] > keyframe["created"]]
+    return keyframe, sorted(deltas, key=lambda e: e["created"])
+
+
+def keyframe_due(store, venue_id):
+    keyframe, deltas = _chain(store, venue_id)
+    return keyframe is None or len(deltas) + 1 >= KEYFRAME_EVERY
+
+
+def load_state(store, venue_id):
+    """Rebuild the last stored item state: latest keyframe plus the deltas after it."""
+    keyframe, deltas = _chain(store, venue_id)
+    if keyframe is None:
+        return None
+    try:
+        state = store.load(keyframe)
+        for entry in deltas:
+            state = apply_delta(state, store.load(entry))
+    except Exception as e:
+        print(f"[{venue_id}] ⚠️ Could not rebuild menu state, starting over: {e}")
+        return None
+    return state
+
+
+def save_state(store, venue_id, previous, state):
+    """Store a keyframe when due (or without a previous state), otherwise just the delta."""
+    if previous is None or keyframe_due(store, venue_id):
+        store.save_json(venue_id, state, kind=STATE_KIND)
+        return "keyframe"
+    store.save_json(venue_id, diff_states(previous, state), kind=DELTA_KIND)
+    return "delta"
@@ -0,0 +1,272 @@
+# menu_index.py
+# Per-venue menu index shared by the restock function, local_tests (imported
+# from here) and the price updater (copied by price_update_tests/sync_shared.py).
+
+import marshal
+import os
+import sys
+import time
+
+MENU_INDEX_DIR = os.environ.get("MENU_INDEX_DIR", "/tmp/menu_index")
+FORMAT_VERSION = 3
+FORCED_OUT_OF_STOCK = "FORCED_OUT_OF_STOCK"
+SOLD_OUT = "SOLD_OUT"
+
+
+class MenuRecord:
+    __slots__ = ("gtin", "sku", "inventory_mode", "availability", "price", "names", "categories")
+
+    def __init__(self, gtin, sku, inventory_mode, availability, price, names=None, categories=None):
+        self.gtin = gtin
+        self.sku = sku
+        self.inventory_mode = inventory_mode
+        self.availability = availability
+        self.price = price
+        self.names = names
+        self.categories = categories
+
+    def as_item(self):
+        """Same shape as a menu export item, for code that expects one."""
+        product = {}
+        if self.gtin:
+            product["gtin"] = self.gtin
+        if self.sku:
+            product["sku"] = self.sku
+        item = {
+            "inventory_mode": self.inventory_mode,
+            "availability": self.availability,
+            "price": self.price,
+            "product": product,
+        }
+        if self.names:
+            item["name"] = list(self.names)
+        if self.categories:
+            item["category"] = list(self.categories)
+        return item
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def text_values(value):
+    """A name/category as a list of strings (plain string or translation list)."""
+    if isinstance(value, str):
+        return [value]
+    values = []
+    for entry in value if isinstance(value, list) else ():
+        if isinstance(entry, dict):
+            entry = entry.get("value")
+        if isinstance(entry, str):
+            values.append(entry)
+    return values
+
+
+def _texts(value):
+    values = text_values(value)
+    return tuple(values) if values else None
+
+
+class MenuIndex:
+    """
+    Column-backed index over a venue's menu: one list per field, hash lookups by
+    GTIN and SKU, and the positions of FORCED_OUT_OF_STOCK / SOLD_OUT items
+    precomputed. Serializes to a compact marshal blob.
+    """
+
+    def __init__(self, venue_id, gtins, skus, modes, availability, prices, names=None, categories=None):
+        self.venue_id = venue_id
+        self.gtins = gtins
+        self.skus = skus
+        self.modes = modes
+        self.availability = availability
+        self.prices = prices
+        self.names = names if names is not None else [None] * len(gtins)
+        self.categories = categories if categories is not None else [None] * len(gtins)
+        # time.time() of the save this index was loaded from; None for a freshly built one
+        self.saved_at = None
+        self.by_gtin = {gtin: i for i, gtin in enumerate(gtins) if gtin}
+        self.by_sku = {sku: i for i, sku in enumerate(skus) if sku}
+        self.forced_out = [i for i, mode in enumerate(modes) if mode == FORCED_OUT_OF_STOCK]
+        self.sold_out = [i for i, value in enumerate(availability) if value == SOLD_OUT]
+
+    @classmethod
+    def from_items(cls, items, venue_id=None):
+        gtins, skus, modes, availability, prices, names, categories = [], [], [], [], [], [], []
+        for item in items:
+            product = item.get("product") or {}
+            gtins.append(product.get("gtin"))
+            skus.append(product.get("sku"))
+            modes.append(_intern(item.get("inventory_mode")))
+            availability.append(_intern(item.get("availability")))
+            prices.append(item.get("price"))
+            names.append(_texts(item.get("name")))
+            categories.append(_texts(item.get("category")))
+        return cls(venue_id, gtins, skus, modes, availability, prices, names, categories)
+
+    @classmethod
+    def from_menu(cls, menu_data):
+        return cls.from_items(menu_data.get("menu", {}).get("items", []), menu_data.get("venue_id"))
+
+    def __len__(self):
+        return len(self.gtins)
+
+    def record(self, i):
+        return MenuRecord(self.gtins[i], self.skus[i], self.modes[i], self.availability[i], self.prices[i],
+                          self.names[i], self.categories[i])
+
+    def lookup_gtin(self, gtin):
+        i = self.by_gtin.get(gtin)
+        return None if i is None else self.record(i)
+
+    def lookup_sku(self, sku):
+        i = self.by_sku.get(sku)
+        return None if i is None else self.record(i)
+
+    def contains(self, identifier):
+        return identifier in self.by_gtin or identifier in self.by_sku
+
+    def forced_out_records(self):
+        return [self.record(i) for i in self.forced_out]
+
+    def sold_out_records(self):
+        """Items that are FORCED_OUT_OF_STOCK or have availability SOLD_OUT."""
+        return [self.record(i) for i in sorted(set(self.forced_out).union(self.sold_out))]
+
+    # ── serialization ──
+    def dumps(self, saved_at=None):
+        saved_at = time.time() if saved_at is None else saved_at
+        return marshal.dumps((FORMAT_VERSION, saved_at, self.venue_id, self.gtins, self.skus, self.modes,
+                              self.availability, self.prices, self.names, self.categories))
+
+    @classmethod
+    def loads(cls, data):
+        version, *fields = marshal.loads(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported menu index format {version}")
+        saved_at, venue_id, *columns = fields
+        index = cls(venue_id, *columns)
+        index.saved_at = saved_at
+        return index
+
+    def age(self):
+        """Seconds since the index was saved, None if it never was."""
+        return None if self.saved_at is None else time.time() - self.saved_at
+
+    def save(self, directory=MENU_INDEX_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = index_path(self.venue_id, directory)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+        return path
+
+
+def select_restock_items(index, excluded_gtins=(), excluded_skus=(), included_gtins=(),
+                         included_skus=(), quarantined=(), rules=None):
+    """
+    Picks the items to restock. The one precedence used everywhere:
+
+    - With an include list, only whitelisted GTINs/SKUs are candidates and they
+      are resolved by direct lookup, O(k) in the size of the list. The include
+      list wins over exclusions, and a whitelisted item qualifies when it is
+      FORCED_OUT_OF_STOCK or its availability is SOLD_OUT. It is reported by the
+      identifier it was whitelisted under.
+    - Without an include list, every FORCED_OUT_OF_STOCK item qualifies unless
+      its GTIN or SKU is excluded, reported by GTIN or else SKU.
+    - Quarantined "gtin:<id>" / "sku:<id>" entries are always skipped.
+
+    rules (a compiled rule set, see cloud_function/filter_rules.py) replaces the
+    four lists: its exact included_gtins/included_skus are looked up as above,
+    and its include/exclude predicates, called as fn(gtin, sku, names,
+    categories), cover prefixes and patterns. Only exact IDs win over
+    exclusions: an item matched by an include prefix or pattern is still
+    skipped when an exclusion matches it ("include 70* except 7012...").
+
+    Returns [{"type": "gtin" | "sku", "id": ...}].
+    """
+    venue_id = index.venue_id or "unknown"
+    quarantined = set(quarantined or ())
+    selected = []
+    seen = set()
+
+    if rules is not None:
+        included_gtins, included_skus = rules.included_gtins, rules.included_skus
+        includes, excludes = rules.include, rules.exclude
+    else:
+        excluded_gtins = set(excluded_gtins or ())
+        excluded_skus = set(excluded_skus or ())
+        includes = None
+        excludes = None
+        if excluded_gtins or excluded_skus:
+            def excludes(gtin, sku, names, categories):
+                return gtin in excluded_gtins or sku in excluded_skus
+
+    def add(i, id_type, identifier):
+        if i in seen:
+            return
+        seen.add(i)
+        if f"{id_type}:{identifier}" in quarantined:
+            print(f"[{venue_id}] 🚧 Skipping quarantined {id_type} {identifier}")
+            return
+        selected.append({"type": id_type, "id": identifier})
+
+    def add_record(i):
+        gtin, sku = index.gtins[i], index.skus[i]
+        if gtin:
+            add(i, "gtin", gtin)
+        elif sku:
+            add(i, "sku", sku)
+        else:
+            print(f"[{venue_id}] ⚠️ Skipping item with no GTIN/SKU")
+
+    if included_gtins or included_skus or includes:
+        for id_type, identifiers, lookup in (("gtin", included_gtins, index.by_gtin),
+                                             ("sku", included_skus, index.by_sku)):
+            for identifier in identifiers or ():
+                i = lookup.get(identifier)
+                if i is not None and (index.modes[i] == FORCED_OUT_OF_STOCK
+                                      or index.availability[i] == SOLD_OUT):
+                    add(i, id_type, identifier)
+        if includes:
+            for i in sorted(set(index.forced_out).union(index.sold_out)):
+                if i in seen:
+                    continue
+                fields = (index.gtins[i], index.skus[i], index.names[i], index.categories[i])
+                if includes(*fields) and not (excludes and excludes(*fields)):
+                    add_record(i)
+        return selected
+
+    for i in index.forced_out:
+        if excludes and excludes(index.gtins[i], index.skus[i], index.names[i], index.categories[i]):
+            continue
+        add_record(i)
+    return selected
+
+
+def index_path(venue_id, directory=MENU_INDEX_DIR):
+    return os.path.join(directory, f"{venue_id}.idx")
+
+
+def load_menu_index(venue_id, directory=MENU_INDEX_DIR, max_age=None):
+    """
+    The venue's last saved index, or None if there isn't a usable one. With
+    max_age (seconds) an index saved longer ago, or for another venue, is
+    not usable either.
+    """
+    try:
+        with open(index_path(venue_id, directory), "rb") as f:
+            index = MenuIndex.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[{venue_id}] ⚠️ Could not load menu index: {e}")
+        return None
+    if index.venue_id != venue_id:
+        print(f"[{venue_id}] ⚠️ Menu index belongs to venue {index.venue_id}, ignoring it")
+        return None
+    if max_age is not None and index.age() > max_age:
+        print(f"[{venue_id}] 🕰️ Menu index is {index.age() / 3600:.1f} h old, ignoring it")
+        return None
+    return index
@@ -0,0 +1,132 @@
+# cloud_function/menu_stream.py
+
+import json
+
+from menu_index import text_values
+
+try:
+    import ijson
+except ImportError:  # Fall back to a full json parse if ijson isn't installed
+    ijson = None
+
+ITEM_PREFIX = "menu.items.item"
+# Item fields the restock pipeline needs, by ijson prefix below ITEM_PREFIX
+SLIM_FIELDS = {
+    "inventory_mode": ("inventory_mode",),
+    "availability": ("availability",),
+    "price": ("price",),
+    "product.gtin": ("product", "gtin"),
+    "product.sku": ("product", "sku"),
+}
+# Free-text fields kept for name/category rules (filter_rules.py). Plain strings
+# and translation lists ([{"lang", "value"}]) both end up as a list of strings.
+TEXT_FIELDS = {
+    "name": "name",
+    "name.item": "name",
+    "name.item.value": "name",
+    "category": "category",
+    "category.item": "category",
+    "category.item.value": "category",
+}
+SCALARS = (str, int, float, bool)
+READ_SIZE = 64 * 1024
+
+
+class TeeReader:
+    """File-like wrapper that copies every byte read from source into sink."""
+
+    def __init__(self, source, sink=None):
+        self.source = source
+        self.sink = sink
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.bytes_read += len(data)
+            if self.sink is not None:
+                self.sink.write(data)
+        return data
+
+
+def new_slim_item():
+    return {"product": {}}
+
+
+def set_slim_field(item, path, value):
+    target = item
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
+
+
+def slim_item(item):
+    slim = new_slim_item()
+    for path in SLIM_FIELDS.values():
+        value = item
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        # Only what the streaming parser keeps too: scalars, not nested objects
+        if isinstance(value, SCALARS):
+            set_slim_field(slim, path, value)
+    for field in set(TEXT_FIELDS.values()):
+        values = text_values(item.get(field))
+        if values:
+            slim[field] = values
+    return slim
+
+
+def _parse_with_ijson(reader):
+    status = None
+    items = []
+    current = None
+    item_field_prefix = ITEM_PREFIX + "."
+    # Non-integer numbers as floats, as json.loads gives them; Decimals don't
+    # survive marshal/json.dumps in MenuIndex.save and menu_diff
+    for prefix, event, value in ijson.parse(reader, buf_size=READ_SIZE, use_float=True):
+        if prefix == "status" and event == "string":
+            status = value
+        elif prefix == ITEM_PREFIX:
+            if event == "start_map":
+                current = new_slim_item()
+            elif event == "end_map":
+                items.append(current)
+                current = None
+        elif current is not None and prefix.startswith(item_field_prefix):
+            field = prefix[len(item_field_prefix):]
+            path = SLIM_FIELDS.get(field)
+            if path and event in ("string", "number", "boolean"):
+                set_slim_field(current, path, value)
+            elif field in TEXT_FIELDS and event == "string":
+                current.setdefault(TEXT_FIELDS[field], []).append(value)
+    return status, items
+
+
+def _parse_full(reader):
+    chunks = []
+    while True:
+        data = reader.read(READ_SIZE)
+        if not data:
+            break
+        chunks.append(data)
+    menu_data = json.loads(b"".join(chunks))
+    items = [slim_item(item) for item in menu_data.get("menu", {}).get("items", []) if isinstance(item, dict)]
+    return menu_data.get("status"), items
+
+
+def parse_menu_stream(stream, sink=None):
+    """
+    Walk a menu export response as a byte stream, keeping only the item fields in
+    SLIM_FIELDS and TEXT_FIELDS. Everything read is copied into sink (e.g. the snapshot file).
+    Returns a menu dict with the same shape as the export ({"status", "menu":
+    {"items"}}) so the extractor can't tell the difference.
+    """
+    reader = TeeReader(stream, sink)
+    if ijson is not None:
+        status, items = _parse_with_ijson(reader)
+    else:
+        status, items = _parse_full(reader)
+    # Drain anything the parser didn't need so the snapshot is complete
+    while reader.read(READ_SIZE):
+        pass
+    return {"status": status, "menu": {"items": items}, "size_bytes": reader.bytes_read}
@@ -0,0 +1,227 @@
+# profiling.py
+# Opt-in profiling of one function invocation: cProfile for CPU time per
+# function, a wall-clock sampler (sleeps, network waits and lock waits show
+# up here, not in cProfile) and tracemalloc for peak memory. Also used by the
+# price updater (price_update_tests/sync_shared.py copies it there).
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Profile every invocation (instead of only ?profile=1 requests)
+PROFILE_ALL = os.environ.get("PROFILE", "0") == "1"
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "25"))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_MS", "5")) / 1000
+# Frames kept per allocation; more frames = better attribution, more overhead
+TRACE_FRAMES = int(os.environ.get("PROFILE_TRACE_FRAMES", "1"))
+# An allocation snapshot is taken each time traced memory grows this much past the last one
+SNAPSHOT_GROWTH = 1.2
+MIN_SNAPSHOT_BYTES = 1024 * 1024
+
+_lock = threading.Lock()
+_active = threading.Lock()
+
+
+def profiling_requested(request):
+    return PROFILE_ALL or request.args.get("profile") == "1"
+
+
+def _location(filename, lineno, function):
+    return f"{os.path.basename(filename)}:{lineno}({function})"
+
+
+class WallSampler(threading.Thread):
+    """
+    Samples every other thread's stack each SAMPLE_INTERVAL. The innermost
+    Python frame (with its line, so a time.sleep or a blocking read shows as
+    the line that called it) counts as self time; every function on the stack
+    counts towards its inclusive time. Also snapshots tracemalloc allocations
+    as traced memory climbs, so the top allocations near the peak survive.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.leaf = Counter()
+        self.inclusive = Counter()
+        self.peak_snapshot = None
+        self._snapshot_at = MIN_SNAPSHOT_BYTES
+        self._done = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._done.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self.samples += 1
+                code = frame.f_code
+                self.leaf[_location(code.co_filename, frame.f_lineno, code.co_name)] += 1
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    key = _location(code.co_filename, code.co_firstlineno, code.co_name)
+                    if key not in seen:
+                        seen.add(key)
+                        self.inclusive[key] += 1
+                    frame = frame.f_back
+            if tracemalloc.is_tracing():
+                current, _ = tracemalloc.get_traced_memory()
+                if current >= self._snapshot_at:
+                    self.peak_snapshot = tracemalloc.take_snapshot()
+                    self._snapshot_at = current * SNAPSHOT_GROWTH
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class ThreadProfilers:
+    """
+    cProfile only sees the thread that enabled it before Python 3.12, so
+    threads started during the call (the venue pool, batch PATCHes) get their
+    own profiler through threading.setprofile, merged at the end. From 3.12 a
+    single profiler sees every thread.
+
+    A profiler can only be disabled from its own thread, so each one is
+    disabled when its thread's target returns. Threads without a target
+    (threading.Timer, the sampler) could outlive the call unnoticed and are
+    not profiled. The report holds what was collected up to stop().
+    """
+
+    def __init__(self):
+        self.profilers = []
+        self.per_thread = sys.version_info < (3, 12)
+        self.stopped = False
+        self._stats = None
+
+    def _start_thread(self, frame, event, arg):
+        # Called on the first event in a new thread: Thread.run, before it reads _target
+        thread = threading.current_thread()
+        target = getattr(thread, "_target", None)
+        if target is None or self.stopped:
+            sys.setprofile(None)
+            return
+        profiler = cProfile.Profile()
+
+        def profiled_target(*args, **kwargs):
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profiler.disable()
+        thread._target = profiled_target
+        with _lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        main = cProfile.Profile()
+        self.profilers.append(main)
+        if self.per_thread:
+            threading.setprofile(self._start_thread)
+        main.enable()
+
+    def stop(self):
+        self.stopped = True
+        self.profilers[0].disable()
+        if self.per_thread:
+            threading.setprofile(None)
+        with _lock:
+            profilers = list(self.profilers)
+        # Snapshot now: threads still running keep profiling until they end
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            try:
+                stats.add(profiler)
+            except TypeError:  # a thread that never ran a profiled call
+                continue
+        self._stats = stats
+
+    def stats(self):
+        return self._stats
+
+
+def cpu_top(stats, top):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [
+        {"function": _location(*func), "calls": calls, "self_s": round(tottime, 4), "cumulative_s": round(cumtime, 4)}
+        for func, (_, calls, tottime, cumtime, _) in rows
+    ]
+
+
+def wall_top(counter, interval, top):
+    return [{"location": location, "samples": samples, "seconds": round(samples * interval, 3)}
+            for location, samples in counter.most_common(top)]
+
+
+def allocation_top(snapshot, top):
+    if snapshot is None:
+        return []
+    return [
+        {"location": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+         "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:top]
+    ]
+
+
+def profile_call(fn, *args, top=PROFILE_TOP, **kwargs):
+    """
+    Runs fn(*args, **kwargs) under the profilers. Returns (fn's result, report).
+    Only one invocation per process is profiled at a time; a concurrent one
+    runs unprofiled with report None.
+    """
+    if not _active.acquire(blocking=False):
+        return fn(*args, **kwargs), None
+    try:
+        return _profile_call(fn, args, kwargs, top)
+    finally:
+        _active.release()
+
+
+def _profile_call(fn, args, kwargs, top):
+    tracemalloc.start(TRACE_FRAMES)
+    sampler = WallSampler()
+    profilers = ThreadProfilers()
+    started, cpu_started = time.monotonic(), time.process_time()
+    sampler.start()
+    profilers.start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profilers.stop()
+        sampler.stop()
+        wall_s, cpu_s = time.monotonic() - started, time.process_time() - cpu_started
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot() if sampler.peak_snapshot is None else sampler.peak_snapshot
+        tracemalloc.stop()
+
+    report = {
+        "wall_s": round(wall_s, 3),
+        "cpu_s": round(cpu_s, 3),
+        "cpu_top": cpu_top(profilers.stats(), top),
+        "wall_samples": sampler.samples,
+        "wall_top_self": wall_top(sampler.leaf, sampler.interval, top),
+        "wall_top_inclusive": wall_top(sampler.inclusive, sampler.interval, top),
+        "memory": {
+            "peak_mb": round(peak / 1e6, 2),
+            "end_mb": round(current / 1e6, 2),
+            "top_allocations": allocation_top(snapshot, top),
+        },
+    }
+    return result, report
+
+
+def log_report(report, label):
+    """Short summary of a report for the logs."""
+    print(f"🔬 Profile of {label}: {report['wall_s']}s wall, {report['cpu_s']}s CPU, "
+          f"peak {report['memory']['peak_mb']} MB")
+    for row in report["wall_top_self"][:5]:
+        print(f"   ⏱️ {row['seconds']:>8.2f}s  {row['location']}")
+    for row in report["cpu_top"][:5]:
+        print(f"   🔥 {row['self_s']:>8.2f}s  {row['function']}")
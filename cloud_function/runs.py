@@ -0,0 +1,243 @@
+# cloud_function/runs.py
+#
+# Run lifecycle around run_venues: per-venue checkpoints under "run:<run_id>"
+# in the state store (so a run cut short by the function timeout can be
+# resumed), async runs with a status endpoint, and NDJSON streaming of venue
+# results as they finish.
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import flask
+
+from state_store import get_state_store
+from wolt_client import summarize_batches
+
+# The function's timeout; a "running" run older than this died with its invocation
+FUNCTION_TIMEOUT = float(os.environ.get("FUNCTION_TIMEOUT_SEC", "540"))
+# Run documents untouched for this long are deleted when the next run starts
+RUN_TTL = float(os.environ.get("RUN_TTL_HOURS", "48")) * 3600
+# Index of run documents: {run_id: last update time}
+RUNS_KEY = "runs"
+
+
+# ─────────────────────────────────────────────────────
+# Per-venue results
+def restock_succeeded(result):
+    return all(chunk["ok"] for chunk in result.get("chunks", []))
+
+
+def venue_failed(result):
+    return result["result"].startswith("❌") or not restock_succeeded(result)
+
+
+def venue_status(result):
+    message = result["result"]
+    if message.startswith("⛔"):
+        return "skipped"
+    if message.startswith("⏸️"):
+        return "deferred"
+    return "failed" if venue_failed(result) else "ok"
+
+
+def venue_line(venue_id, result):
+    line = {"venue_id": venue_id, "status": venue_status(result), "result": result["result"]}
+    chunks = result.get("chunks")
+    if chunks:
+        sent, total, failed = summarize_batches(chunks)
+        line.update(restocked=sent, items=total, chunks=len(chunks), failed_chunks=len(failed))
+    if result.get("quarantined"):
+        line["quarantined"] = len(result["quarantined"])
+    if result.get("timings"):
+        line["timings"] = result["timings"]
+    return line
+
+
+# ─────────────────────────────────────────────────────
+# Checkpoints. Every write stamps the run's updated_at and its entry in the
+# RUNS_KEY index; prune_runs deletes runs nobody touched for RUN_TTL (async
+# runs, runs left resumable and never resumed).
+def run_key(run_id):
+    return f"run:{run_id}"
+
+
+def load_run(run_id):
+    return get_state_store().get(run_key(run_id)) or {}
+
+
+def update_run(run_id, update, depth=1, sync=False):
+    now = time.time()
+
+    def apply(run):
+        run = update(run)
+        run["updated_at"] = now
+        return run
+    run = get_state_store().update(run_key(run_id), apply, depth, sync)
+    get_state_store().update(RUNS_KEY, lambda runs: {**runs, run_id: now})
+    return run
+
+
+def checkpoint_venue(run_id, config_spec, venue_id, result):
+    def apply(run):
+        run["config"] = config_spec
+        run.setdefault("completed", {})[venue_id] = result
+        return run
+    # Merged per venue: shard workers and resumed invocations checkpoint the same run
+    update_run(run_id, apply, depth=2)
+
+
+def mark_run(run_id, **fields):
+    update_run(run_id, lambda run: {**run, **fields})
+
+
+def discard_run(run_id):
+    get_state_store().delete(run_key(run_id))
+    get_state_store().update(RUNS_KEY, lambda runs: {key: value for key, value in runs.items() if key != run_id})
+
+
+def prune_runs(now=None):
+    now = now or time.time()
+    expired = [run_id for run_id, updated_at in (get_state_store().get(RUNS_KEY) or {}).items()
+               if now - updated_at > RUN_TTL]
+    if not expired:
+        return 0
+    for run_id in expired:
+        get_state_store().delete(run_key(run_id))
+    # A run touched again since it was read stays
+    get_state_store().update(RUNS_KEY, lambda runs: {run_id: updated_at for run_id, updated_at in runs.items()
+                                                     if run_id not in expired or now - updated_at <= RUN_TTL})
+    print(f"🧹 Pruned {len(expired)} run(s) older than {RUN_TTL / 3600:.0f}h")
+    return len(expired)
+
+
+# ─────────────────────────────────────────────────────
+# Async runs: ?async=1 answers 202 with a run_id at once and runs in a
+# background thread; ?status=<run_id> reports progress and, once finished,
+# the results. A trigger repeated with the same run_id (or a Cloud Scheduler
+# retry of the same tick) doesn't start a second run. Needs CPU to stay
+# allocated after the response (Cloud Functions gen2 / Cloud Run setting).
+def async_run_id(request, config_spec):
+    run_id = request.args.get("run_id")
+    if run_id:
+        return run_id
+    schedule_time = getattr(request, "headers", {}).get("X-CloudScheduler-ScheduleTime")
+    if schedule_time:
+        return hashlib.sha1(f"{config_spec}|{schedule_time}".encode("utf-8")).hexdigest()[:32]
+    return uuid.uuid4().hex
+
+
+def run_in_progress(run):
+    """A "running" run whose invocation has outlived the function timeout died with it."""
+    return run.get("status") == "running" and time.time() - run.get("started_at", 0) < FUNCTION_TIMEOUT
+
+
+def start_async_run(run_id, config_spec, venues, execute):
+    # Check and claim in one backend transaction, so two triggers of the same
+    # run (even on different instances) can't both start it
+    claimed = {}
+
+    def claim(run):
+        claimed["ok"] = not (run_in_progress(run) or run.get("status") == "complete")
+        if claimed["ok"]:
+            run.update(config=config_spec, status="running", started_at=time.time(), finished_at=None,
+                       venue_ids=[venue["venue_id"] for venue in venues])
+        return run
+    run = update_run(run_id, claim, sync=True)
+    if not claimed["ok"]:
+        print(f"♻️ Run {run_id} is already {run['status']}, not starting it again")
+        return run_status(run_id)
+
+    def background():
+        try:
+            results, pending = execute()
+            final = {"status": "resumable" if pending else "complete", "results": results}
+        except Exception as e:
+            print(f"🚨 Run {run_id} failed: {e}")
+            final = {"status": "failed", "error": str(e), "results": {}}
+
+        def finish(run):
+            # Checkpointed venues are already under "completed"; only the rest
+            # (venues run by shard workers) is kept under "results"
+            completed = run.get("completed", {})
+            results = {venue_id: result for venue_id, result in final["results"].items() if venue_id not in completed}
+            return {**run, **final, "results": results, "finished_at": time.time()}
+        update_run(run_id, finish)
+        get_state_store().flush()
+
+    threading.Thread(target=background, name=f"run-{run_id}", daemon=True).start()
+    print(f"🚀 Run {run_id} started in the background")
+    return json.dumps({"run_id": run_id, "status": "running", "status_url": f"?status={run_id}"}, indent=2), 202
+
+
+def run_status(run_id):
+    run = load_run(run_id)
+    if not run:
+        return json.dumps({"run_id": run_id, "status": "unknown"}, indent=2), 404
+    completed = run.get("completed", {})
+    venue_ids = run.get("venue_ids") or list(completed)
+    status = run.get("status", "running")
+    if status == "running" and not run_in_progress(run):
+        status = "stalled"
+    body = {
+        "run_id": run_id,
+        "status": status,
+        "config": run.get("config"),
+        "started_at": run.get("started_at"),
+        "finished_at": run.get("finished_at"),
+        "total": len(venue_ids),
+        "done": len([venue_id for venue_id in venue_ids if venue_id in completed]),
+        "pending": [venue_id for venue_id in venue_ids if venue_id not in completed],
+        "results": {**completed, **run.get("results", {})},
+    }
+    if run.get("error"):
+        body["error"] = run["error"]
+    return json.dumps(body, indent=2), 200
+
+
+# ─────────────────────────────────────────────────────
+# Streaming: ?stream=1 answers with NDJSON, one line per venue as it finishes
+# and a summary line at the end, so curl and monitoring see progress and a
+# killed run still leaves partial output
+def stream_run(run_id, execute):
+    lines = queue.Queue()
+    emitted = set()
+
+    def on_result(venue_id, result):
+        lines.put((venue_id, result))
+
+    def worker():
+        try:
+            results, pending = execute(on_result)
+            for venue_id, result in results.items():
+                lines.put((venue_id, result))
+            counts = {}
+            for result in results.values():
+                counts[venue_status(result)] = counts.get(venue_status(result), 0) + 1
+            lines.put({"summary": True, "run_id": run_id, "status": "resumable" if pending else "complete",
+                       "pending": pending, "counts": counts})
+        except Exception as e:
+            print(f"🚨 Run {run_id} failed: {e}")
+            lines.put({"summary": True, "run_id": run_id, "status": "failed", "error": str(e)})
+        finally:
+            lines.put(None)
+
+    def generate():
+        while True:
+            item = lines.get()
+            if item is None:
+                return
+            if isinstance(item, tuple):
+                venue_id, result = item
+                if venue_id in emitted:
+                    continue
+                emitted.add(venue_id)
+                item = venue_line(venue_id, result)
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    threading.Thread(target=worker, name=f"stream-{run_id}", daemon=True).start()
+    return flask.Response(generate(), status=200, mimetype="application/x-ndjson")
@@ -0,0 +1,137 @@
+# cloud_function/sharding.py
+#
+# Coordinator/worker split for large fleets: the coordinator partitions venues
+# into shards by predicted cost and sends each shard to a worker invocation
+# (?shard=i&of=N). Workers can be other instances of this function (HTTP), or
+# for local testing the same process or a subprocess.
+
+import contextlib
+import heapq
+import json
+import os
+import subprocess
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# "http", "inprocess" or "subprocess"; default is http when WORKER_URL is set
+SHARD_DISPATCHER = os.environ.get("SHARD_DISPATCHER", "")
+# URL of the deployed function the coordinator calls for each shard
+WORKER_URL = os.environ.get("WORKER_URL", "")
+# Sent as a Bearer token to WORKER_URL (e.g. an identity token for a private function)
+WORKER_AUTH_TOKEN = os.environ.get("WORKER_AUTH_TOKEN", "")
+WORKER_TIMEOUT = float(os.environ.get("SHARD_WORKER_TIMEOUT", "540"))
+MAX_SHARDS = int(os.environ.get("MAX_SHARDS", "32"))
+
+
+def partition(costs, shard_count):
+    """
+    Longest-processing-time-first: venues in order of decreasing cost, each to
+    the shard with the smallest total so far. Returns [[venue_id]] per shard.
+    """
+    shards = [[] for _ in range(shard_count)]
+    loads = [(0.0, i) for i in range(shard_count)]
+    for venue_id in sorted(costs, key=lambda v: (-costs[v], v)):
+        load, i = heapq.heappop(loads)
+        shards[i].append(venue_id)
+        heapq.heappush(loads, (load + costs[venue_id], i))
+    return shards
+
+
+def hash_shard(venue_id, shard_count):
+    """Stable shard for a worker called without an explicit venue list."""
+    return zlib.crc32(venue_id.encode("utf-8")) % shard_count
+
+
+class ShardRequest:
+    """The parts of a flask request the function reads, for in-process calls."""
+
+    def __init__(self, args, body=None):
+        self.args = args
+        self._body = body
+
+    def get_json(self, silent=False):
+        return self._body
+
+
+# ─────────────────────────────────────────────────────
+# Dispatchers: run(args, body) -> (status code, response text)
+class HttpDispatcher:
+    def __init__(self, url=WORKER_URL, token=WORKER_AUTH_TOKEN):
+        self.url = url
+        self.token = token
+
+    def run(self, args, body):
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        response = requests.post(self.url, params=args, json=body, headers=headers, timeout=WORKER_TIMEOUT)
+        return response.status_code, response.text
+
+
+class InProcessDispatcher:
+    def __init__(self, handler):
+        self.handler = handler
+
+    def run(self, args, body):
+        response, code = self.handler(ShardRequest(args, body))
+        return code, response
+
+
+class SubprocessDispatcher:
+    """Runs this file as a worker: job JSON on stdin, "<code>\\n<response>" on stdout."""
+
+    def run(self, args, body):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__)],
+            input=json.dumps({"args": args, "body": body}),
+            capture_output=True, text=True, timeout=WORKER_TIMEOUT,
+        )
+        sys.stderr.write(proc.stderr)
+        if proc.returncode != 0:
+            raise RuntimeError(f"worker exited with status {proc.returncode}")
+        code, _, response = proc.stdout.partition("\n")
+        return int(code), response
+
+
+def get_dispatcher(handler):
+    kind = SHARD_DISPATCHER or ("http" if WORKER_URL else "inprocess")
+    if kind == "http":
+        if not WORKER_URL:
+            raise RuntimeError("SHARD_DISPATCHER=http needs WORKER_URL")
+        return HttpDispatcher()
+    if kind == "subprocess":
+        return SubprocessDispatcher()
+    return InProcessDispatcher(handler)
+
+
+def dispatch(dispatcher, jobs):
+    """
+    Runs [(args, body)] concurrently. Returns one (results dict, None) or
+    (None, error message) per job, in order.
+    """
+    def run(job):
+        args, body = job
+        try:
+            code, response = dispatcher.run(args, body)
+        except Exception as e:
+            return None, str(e)
+        if code != 200:
+            return None, f"HTTP {code}: {str(response)[:200]}"
+        try:
+            return json.loads(response), None
+        except ValueError as e:
+            return None, f"unreadable response: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as pool:
+        return list(pool.map(run, jobs))
+
+
+if __name__ == "__main__":
+    # SubprocessDispatcher worker. The function's logs go to stderr so stdout
+    # only carries the status code and response.
+    job = json.load(sys.stdin)
+    with contextlib.redirect_stdout(sys.stderr):
+        import main
+        response, code = main.reset_sold_out_items(ShardRequest(job["args"], job["body"]))
+    sys.stdout.write(f"{code}\n{response}")
@@ -0,0 +1,198 @@
+# cloud_function/snapshot_store.py
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from state_store import atomic_write
+
+try:
+    import zstandard
+except ImportError:  # gzip only
+    zstandard = None
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/tmp/menu_snapshots")
+# /tmp is memory-backed on Cloud Functions, so keep the store small
+SNAPSHOT_MAX_BYTES = int(float(os.environ.get("SNAPSHOT_MAX_MB", "64")) * 1024 * 1024)
+SNAPSHOT_MAX_AGE = float(os.environ.get("SNAPSHOT_MAX_AGE_HOURS", "72")) * 3600
+SNAPSHOT_COMPRESSION = os.environ.get("SNAPSHOT_COMPRESSION", "zstd" if zstandard else "gzip")
+INDEX_NAME = "index.json"
+EXTENSIONS = {"gzip": ".json.gz", "zstd": ".json.zst"}
+
+
+def open_compressed(path, mode):
+    """Open a .json.gz / .json.zst file for binary reading ("rb") or writing ("wb")."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is not installed, cannot open {path}")
+        raw = open(path, mode)
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+    return gzip.open(path, mode, compresslevel=6)
+
+
+class SnapshotWriter:
+    """Compressing file-like sink; nothing shows up in the store until commit()."""
+
+    def __init__(self, store, venue_id, kind, path):
+        self.store = store
+        self.venue_id = venue_id
+        self.kind = kind
+        self.path = path
+        self.partial_path = path + ".partial"
+        self._file = open_compressed(self.partial_path, "wb")
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+        self.store._register(self.venue_id, self.kind, self.path)
+        return self.path
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+
+class SnapshotStore:
+    """
+    Compressed per-venue snapshots with a total-size and age cap. Files are
+    tracked in index.json, so the latest snapshot for a venue is a lookup
+    rather than a directory glob; reads refresh an entry's last_used time and
+    the least recently used files are evicted first.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, max_bytes=SNAPSHOT_MAX_BYTES,
+                 max_age=SNAPSHOT_MAX_AGE, compression=SNAPSHOT_COMPRESSION):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression if compression in EXTENSIONS else "gzip"
+        self._lock = threading.Lock()
+        self._index = None
+
+    # ── index ──
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_NAME)
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self._index_path(), "r") as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = []
+            except Exception as e:
+                print(f"⚠️ Snapshot index unreadable, starting fresh: {e}")
+                self._index = []
+            self._index = [e for e in self._index if os.path.exists(e["path"])]
+        return self._index
+
+    def _save_index(self):
+        atomic_write(self._index_path(), json.dumps(self._index, separators=(",", ":")).encode("utf-8"))
+
+    def _register(self, venue_id, kind, path):
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            index.append({
+                "venue_id": venue_id, "kind": kind, "path": path,
+                "size": os.path.getsize(path), "created": now, "last_used": now,
+            })
+            self._enforce_retention(index, keep=path)
+            self._save_index()
+
+    def _enforce_retention(self, index, keep=None):
+        now = time.time()
+        expired = [e for e in index if now - e["created"] > self.max_age and e["path"] != keep]
+        live = [e for e in index if e not in expired]
+        total = sum(e["size"] for e in live)
+        for entry in sorted(live, key=lambda e: e["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if entry["path"] == keep:
+                continue
+            expired.append(entry)
+            total -= entry["size"]
+        for entry in expired:
+            try:
+                os.remove(entry["path"])
+            except FileNotFoundError:
+                pass
+            index.remove(entry)
+        if expired:
+            print(f"🧹 Evicted {len(expired)} snapshot(s); store now {total / 1e6:.1f} MB")
+
+    # ── writing ──
+    def open_writer(self, venue_id, kind="menu"):
+        os.makedirs(self.directory, exist_ok=True)
+        # Microseconds keep two snapshots of one venue in the same second apart
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = f"{kind}_{venue_id}_{timestamp}{EXTENSIONS[self.compression]}"
+        return SnapshotWriter(self, venue_id, kind, os.path.join(self.directory, filename))
+
+    def save_json(self, venue_id, obj, kind="menu"):
+        writer = self.open_writer(venue_id, kind)
+        try:
+            writer.write(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+        except Exception:
+            writer.discard()
+            raise
+        return writer.commit()
+
+    # ── reading ──
+    def entries(self, venue_id=None, kind=None):
+        """Index entries, newest first."""
+        with self._lock:
+            index = list(self._load_index())
+        return sorted(
+            (e for e in index
+             if (venue_id is None or e["venue_id"] == venue_id) and (kind is None or e["kind"] == kind)),
+            key=lambda e: e["created"], reverse=True,
+        )
+
+    def latest(self, venue_id, kind="menu"):
+        entries = self.entries(venue_id, kind)
+        return entries[0] if entries else None
+
+    def touch(self, path):
+        with self._lock:
+            for entry in self._load_index():
+                if entry["path"] == path:
+                    entry["last_used"] = time.time()
+                    self._save_index()
+                    break
+
+    def open(self, entry):
+        """Decompressed binary stream for an index entry (e.g. to feed menu_stream)."""
+        self.touch(entry["path"])
+        return open_compressed(entry["path"], "rb")
+
+    def load(self, entry):
+        with self.open(entry) as f:
+            return json.loads(f.read())
+
+    def load_latest(self, venue_id, kind="menu"):
+        entry = self.latest(venue_id, kind)
+        return self.load(entry) if entry else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+        return _store
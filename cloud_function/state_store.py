@@ -0,0 +1,496 @@
+# cloud_function/state_store.py
+
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")
+STATE_PATH = os.environ.get("STATE_PATH", "/tmp/wolt_state.sqlite3")
+FLUSH_DELAY = float(os.environ.get("STATE_FLUSH_DELAY", "2"))
+# Cached documents are re-read from the backend after this many seconds, so
+# other instances' writes show up
+CACHE_TTL = float(os.environ.get("STATE_CACHE_TTL", "5"))
+# Conditional bucket writes retried this often when another writer got there first
+MAX_WRITE_CONFLICTS = 10
+
+# Value of a deleted field in a change set
+DELETED = object()
+
+
+def atomic_write(path, data):
+    """Write bytes to path via a temp file + rename so readers never see half a file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock shared by every process using path (a lock file next to it)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ─────────────────────────────────────────────────────
+# Change sets: instead of whole documents, the store writes which fields
+# changed ({path tuple: value or DELETED}) and each backend merges them into
+# the stored document in one atomic step, so writers that touch different
+# sections of the same key (e.g. two instances, one updating a venue's latency
+# and one its circuit) don't overwrite each other.
+def diff_paths(old, new, depth, prefix=()):
+    """Changed paths from old to new, down to depth levels of nested dicts."""
+    old = old or {}
+    for key in list(old) + [key for key in new if key not in old]:
+        if key not in new:
+            yield prefix + (key,), DELETED
+        elif key not in old or old[key] != new[key]:
+            # A new nested dict is written field by field too, so it merges
+            # with the same section created by another writer
+            if depth > 1 and isinstance(old.get(key, {}), dict) and isinstance(new[key], dict):
+                yield from diff_paths(old.get(key), new[key], depth - 1, prefix + (key,))
+            else:
+                yield prefix + (key,), copy.deepcopy(new[key])
+
+
+def add_change(change, path, value):
+    """Records path = value in a pending change; it replaces pending changes at or below path."""
+    for existing in [p for p in change["changes"] if p[:len(path)] == path]:
+        del change["changes"][existing]
+    change["changes"][path] = value
+
+
+def apply_changes(doc, change):
+    """Applies a pending change ({"reset", "changes"}) to doc; returns the new document or None."""
+    doc = {} if change["reset"] or not isinstance(doc, dict) else doc
+    for path, value in change["changes"].items():
+        target = doc
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if value is DELETED:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = copy.deepcopy(value)
+    if change["reset"] and not doc:
+        return None
+    return doc
+
+
+# ─────────────────────────────────────────────────────
+# Backends: durable storage of JSON documents by key
+class StateBackend:
+    def read(self, key):
+        """Returns the stored document for key, or None."""
+        raise NotImplementedError
+
+    def apply_many(self, changes):
+        """
+        Merges {key: change} into the stored documents, each key atomically
+        against concurrent writers. Returns {key: merged document or None}.
+        """
+        raise NotImplementedError
+
+    def transact(self, key, fn):
+        """Stores fn(stored document or None) atomically against concurrent writers and returns it."""
+        raise NotImplementedError
+
+
+class JsonFileBackend(StateBackend):
+    """All keys in one JSON file, re-read and rewritten atomically under a file lock on every flush."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ Could not read state file '{self.path}': {e}")
+            return {}
+
+    def read(self, key):
+        return self._load().get(key)
+
+    def apply_many(self, changes):
+        merged = {}
+        with file_lock(self.path):
+            current = self._load()
+            for key, change in changes.items():
+                merged[key] = apply_changes(current.get(key), change)
+                if merged[key] is None:
+                    current.pop(key, None)
+                else:
+                    current[key] = merged[key]
+            atomic_write(self.path, json.dumps(current).encode("utf-8"))
+        return copy.deepcopy(merged)
+
+    def transact(self, key, fn):
+        with file_lock(self.path):
+            current = self._load()
+            doc = fn(current.get(key))
+            current[key] = doc
+            atomic_write(self.path, json.dumps(current).encode("utf-8"))
+        return copy.deepcopy(doc)
+
+
+class SQLiteBackend(StateBackend):
+    """One row per key; each flush is a single transaction."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def read(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def apply_many(self, changes):
+        now = time.time()
+        merged = {}
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            # Take the write lock before reading so the read-modify-write is atomic
+            conn.execute("BEGIN IMMEDIATE")
+            for key, change in changes.items():
+                row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                doc = merged[key] = apply_changes(json.loads(row[0]) if row else None, change)
+                if doc is None:
+                    conn.execute("DELETE FROM state WHERE key = ?", (key,))
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(doc), now),
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return merged
+
+    def transact(self, key, fn):
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+            doc = fn(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(doc), time.time()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return doc
+
+
+class PreconditionFailed(Exception):
+    """A conditional bucket write lost to another writer."""
+
+
+class ObjectStoreBackend(StateBackend):
+    """
+    One object per key in a bucket. The bucket needs get(name) -> (bytes or
+    None, generation), and put(name, data, if_generation) / delete(name,
+    if_generation) that raise PreconditionFailed when the object's generation
+    changed since it was read (GCS generation / S3 ETag preconditions), so a
+    GCS/S3 bucket wrapper can be dropped in later.
+    """
+
+    def __init__(self, bucket, prefix="state/"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _name(self, key):
+        return f"{self.prefix}{key.replace('/', '_')}.json"
+
+    def read(self, key):
+        data, _ = self.bucket.get(self._name(key))
+        return json.loads(data) if data else None
+
+    def apply_many(self, changes):
+        merged = {}
+        for key, change in changes.items():
+            name = self._name(key)
+            for _ in range(MAX_WRITE_CONFLICTS):
+                data, generation = self.bucket.get(name)
+                doc = apply_changes(json.loads(data) if data else None, change)
+                try:
+                    if doc is None:
+                        self.bucket.delete(name, if_generation=generation)
+                    else:
+                        self.bucket.put(name, json.dumps(doc).encode("utf-8"), if_generation=generation)
+                except PreconditionFailed:
+                    continue
+                merged[key] = doc
+                break
+            else:
+                raise PreconditionFailed(f"'{key}' kept changing under {MAX_WRITE_CONFLICTS} attempts")
+        return merged
+
+    def transact(self, key, fn):
+        name = self._name(key)
+        for _ in range(MAX_WRITE_CONFLICTS):
+            data, generation = self.bucket.get(name)
+            doc = fn(json.loads(data) if data else None)
+            try:
+                self.bucket.put(name, json.dumps(doc).encode("utf-8"), if_generation=generation)
+            except PreconditionFailed:
+                continue
+            return doc
+        raise PreconditionFailed(f"'{key}' kept changing under {MAX_WRITE_CONFLICTS} attempts")
+
+
+class LocalBucket:
+    """
+    Directory-backed bucket for ObjectStoreBackend (local runs and mounted
+    volumes). The generation is a hash of the content; conditional writes
+    hold a lock file in the directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    @staticmethod
+    def _generation(data):
+        return hashlib.sha1(data).hexdigest() if data is not None else None
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, name):
+        data = self._read(name)
+        return data, self._generation(data)
+
+    def _check(self, name, if_generation):
+        if self._generation(self._read(name)) != if_generation:
+            raise PreconditionFailed(name)
+
+    def put(self, name, data, if_generation=None):
+        with file_lock(os.path.join(self.root, ".bucket")):
+            self._check(name, if_generation)
+            atomic_write(self._path(name), data)
+
+    def delete(self, name, if_generation=None):
+        with file_lock(os.path.join(self.root, ".bucket")):
+            self._check(name, if_generation)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+# ─────────────────────────────────────────────────────
+# In-process cache with per-key locking and write-behind flushing. Cached
+# documents are re-read after CACHE_TTL with this instance's unflushed changes
+# laid over them; flushes merge change sets (see above), not whole documents.
+class StateStore:
+    def __init__(self, backend, flush_delay=FLUSH_DELAY, cache_ttl=CACHE_TTL):
+        self.backend = backend
+        self.flush_delay = flush_delay
+        self.cache_ttl = cache_ttl
+        self._cache = {}     # key -> (document, time read from the backend)
+        self._pending = {}   # key -> {"reset": bool, "changes": {path: value}} not flushed yet
+        self._flushing = {}  # changes being written right now
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _cached(self, key):
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+            return cached[0]
+        try:
+            doc = self.backend.read(key)
+        except Exception as e:
+            print(f"⚠️ Could not read state '{key}': {e}")
+            if cached is not None:
+                return cached[0]
+            doc = None
+        with self._lock:
+            unflushed = [self._flushing.get(key), self._pending.get(key)]
+        for change in unflushed:
+            if change:
+                doc = apply_changes(doc, change)
+        self._cache[key] = (doc, time.monotonic())
+        return doc
+
+    def _record(self, key, old, new, depth):
+        with self._lock:
+            entry = self._pending.setdefault(key, {"reset": False, "changes": {}})
+            for path, value in diff_paths(old, new, depth):
+                add_change(entry, path, value)
+
+    def get(self, key, default=None):
+        with self._key_lock(key):
+            doc = self._cached(key)
+            return copy.deepcopy(doc) if doc is not None else default
+
+    def update(self, key, fn, depth=1, sync=False):
+        """
+        Replace the document at key with fn(current or {}), atomically within
+        this instance. Only the fields fn changed are written back, merged
+        per top-level section (or depth levels of nested dicts), so other
+        writers' changes to other sections survive.
+
+        sync=True runs fn against the backend's current document inside the
+        backend's own transaction and writes at once: a compare-and-set across
+        instances (fn may run more than once on a conflict).
+        """
+        if sync:
+            self.flush()
+            with self._key_lock(key):
+                doc = self.backend.transact(key, lambda current: fn(copy.deepcopy(current) or {}))
+                self._cache[key] = (doc, time.monotonic())
+            return copy.deepcopy(doc)
+        with self._key_lock(key):
+            old = self._cached(key) or {}
+            doc = fn(copy.deepcopy(old))
+            self._cache[key] = (doc, self._cache[key][1])
+            self._record(key, old, doc, depth)
+        self._schedule_flush()
+        return copy.deepcopy(doc)
+
+    def delete(self, key):
+        with self._key_lock(key):
+            self._cache[key] = (None, time.monotonic())
+            with self._lock:
+                self._pending[key] = {"reset": True, "changes": {}}
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Merge every pending change into the backend. Safe to call at any time."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                changes, self._pending = self._pending, {}
+                self._flushing = changes
+            if not changes:
+                return
+            try:
+                merged = self.backend.apply_many(changes)
+            except Exception as e:
+                print(f"⚠️ Could not flush state ({len(changes)} keys): {e}")
+                with self._lock:
+                    # Changes made since go on top of the ones that failed
+                    for key, change in changes.items():
+                        newer = self._pending.get(key)
+                        if newer is None:
+                            self._pending[key] = change
+                        elif not newer["reset"]:
+                            for path, value in newer["changes"].items():
+                                add_change(change, path, value)
+                            self._pending[key] = change
+                    self._flushing = {}
+                return
+            now = time.monotonic()
+            for key, doc in merged.items():
+                with self._key_lock(key):
+                    with self._lock:
+                        pending = self._pending.get(key)
+                    self._cache[key] = (apply_changes(doc, pending) if pending else doc, now)
+            with self._lock:
+                self._flushing = {}
+
+
+def create_backend(kind=STATE_BACKEND, path=STATE_PATH):
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind == "file":
+        return JsonFileBackend(path)
+    if kind == "bucket":
+        return ObjectStoreBackend(LocalBucket(path))
+    raise ValueError(f"Unknown STATE_BACKEND '{kind}'")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Process-wide store, reused across warm invocations."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(create_backend())
+        return _store
+
+
+# ─────────────────────────────────────────────────────
+# Per-venue state: one "venue:<id>" document with a section per concern
+# (latency, quarantine, circuit, ...)
+def get_venue_state(venue_id, section):
+    return get_state_store().get(f"venue:{venue_id}", {}).get(section)
+
+
+def update_venue_state(venue_id, section, update):
+    def apply(doc):
+        doc[section] = update(doc.get(section))
+        return doc
+    return get_state_store().update(f"venue:{venue_id}", apply)[section]
@@ -0,0 +1,20 @@
+# cloud_function/tests/conftest.py
+# The function's modules import each other as top-level modules (they deploy
+# as one flat directory), so the tests put that directory on sys.path.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state_store  # noqa: E402
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    """A fresh process-wide state store (see state_store.get_state_store) per test."""
+    store = state_store.StateStore(state_store.SQLiteBackend(str(tmp_path / "state.sqlite3")), flush_delay=60)
+    monkeypatch.setattr(state_store, "_store", store)
+    return store
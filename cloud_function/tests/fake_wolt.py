@@ -0,0 +1,34 @@
+# cloud_function/tests/fake_wolt.py
+# Stand-in for WoltClient.patch: records every PATCH and answers 400 when the
+# body holds a bad GTIN (or always, for a venue that rejects everything).
+
+import threading
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeClient:
+    def __init__(self, bad=(), reject_all=False, statuses=()):
+        self.bad = set(bad)
+        self.reject_all = reject_all
+        # Answers used first, in order (e.g. a 503 before the usual handling)
+        self.statuses = list(statuses)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def patch(self, url, json=None):
+        with self._lock:
+            self.calls.append((url, json["data"]))
+            if self.statuses:
+                return FakeResponse(self.statuses.pop(0), "scripted")
+        if self.reject_all or any(item.get("gtin") in self.bad for item in json["data"]):
+            return FakeResponse(400, "invalid item")
+        return FakeResponse(202)
+
+
+def items(n, start=0):
+    return [{"gtin": str(7000000000000 + i), "in_stock": True} for i in range(start, start + n)]
@@ -0,0 +1,104 @@
+# cloud_function/tests/test_circuit_breaker.py
+
+import pytest
+
+import circuit_breaker
+import wolt_client
+from circuit_breaker import (CIRCUIT_COOLDOWN, CIRCUIT_THRESHOLD, circuit_check, classify_status,
+                             record_circuit_failure, record_circuit_success)
+from fake_wolt import FakeClient
+from state_store import get_venue_state
+
+pytestmark = pytest.mark.usefixtures("state")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(circuit_breaker.time, "time", lambda: now[0])
+    return now
+
+
+def test_statuses_are_classified():
+    assert [classify_status(s) for s in (401, 403, 429, None, 500, 503, 400)] == [
+        "auth", "auth", "rate_limit", "network", "server_error", "server_error", "client_error"]
+
+
+def test_circuit_opens_after_the_threshold(clock):
+    for _ in range(CIRCUIT_THRESHOLD - 1):
+        record_circuit_failure("v", "server_error", "HTTP 503")
+        assert circuit_check("v") is None
+    record_circuit_failure("v", "server_error", "HTTP 503")
+    assert circuit_check("v").startswith("⛔ Skipped: circuit open after 3 failure(s)")
+
+
+def test_auth_failure_opens_at_once(clock):
+    record_circuit_failure("v", "auth", "HTTP 401")
+    assert circuit_check("v") is not None
+
+
+def test_success_resets_the_count(clock):
+    for _ in range(CIRCUIT_THRESHOLD - 1):
+        record_circuit_failure("v", "server_error")
+    record_circuit_success("v")
+    record_circuit_failure("v", "server_error")
+    assert circuit_check("v") is None
+    assert get_venue_state("v", "circuit")["failures"] == 1
+
+
+def test_half_open_probe_failure_doubles_the_cooldown(clock):
+    record_circuit_failure("v", "auth")
+    clock[0] += CIRCUIT_COOLDOWN + 1
+    assert circuit_check("v") is None
+    assert get_venue_state("v", "circuit")["state"] == "half_open"
+    record_circuit_failure("v", "auth")
+    circuit = get_venue_state("v", "circuit")
+    assert circuit["state"] == "open" and circuit["cooldown"] == 2 * CIRCUIT_COOLDOWN
+
+
+def test_half_open_probe_success_closes(clock):
+    record_circuit_failure("v", "auth")
+    clock[0] += CIRCUIT_COOLDOWN + 1
+    circuit_check("v")
+    record_circuit_success("v")
+    assert get_venue_state("v", "circuit") is None
+
+
+# ─────────────────────────────────────────────────────
+# Restocks: the export being READY doesn't reset failing PATCHes
+@pytest.fixture
+def main(monkeypatch):
+    pytest.importorskip("flask")
+    import main
+    monkeypatch.setattr(wolt_client.time, "sleep", lambda seconds: None)
+    return main
+
+
+def restock_with(main, monkeypatch, client, gtins=("7000000000000",)):
+    monkeypatch.setattr(main, "get_client", lambda username, password: client)
+    venue = {"venue_id": "v", "api_username": "u", "api_password": "p"}
+    return main.restock(venue, [{"type": "gtin", "id": gtin} for gtin in gtins])
+
+
+def test_failing_restocks_open_the_circuit(main, monkeypatch, clock):
+    # READY exports every time, but every PATCH answers 503
+    monkeypatch.setattr(main, "poll_menu_export", lambda *args: {"venue_id": "v"})
+    monkeypatch.setattr(main, "finish_venue", lambda venue, menu: restock_with(
+        main, monkeypatch, FakeClient(statuses=[503] * 10)))
+    venue = {"venue_id": "v", "api_username": "u", "api_password": "p"}
+    results = {}
+    for _ in range(CIRCUIT_THRESHOLD):
+        assert circuit_check("v") is None
+        job = {"venue": venue, "attempt": 0, "requested_at": 0, "last_poll": 0, "prefetched": True,
+               "resource_url": "https://export", "keep_snapshot": False}
+        main.poll_venue_job(job, results.__setitem__)
+    assert results["v"]["result"].startswith("Update failed: 503")
+    assert circuit_check("v") is not None
+
+
+def test_rejected_items_do_not_count_against_the_venue(main, monkeypatch, clock):
+    record_circuit_failure("v", "server_error")
+    result = restock_with(main, monkeypatch, FakeClient(bad=["7000000000000"]),
+                          gtins=["7000000000000", "7000000000001"])
+    assert result["quarantined"] == ["gtin:7000000000000"]
+    assert get_venue_state("v", "circuit") is None
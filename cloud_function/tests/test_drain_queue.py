@@ -0,0 +1,71 @@
+# cloud_function/tests/test_drain_queue.py
+
+import time
+
+import pytest
+
+import job_queue
+from job_queue import DEAD, DONE, PENDING, SQLiteJobQueue
+
+pytest.importorskip("flask")
+
+import main  # noqa: E402
+
+OUTCOMES = {
+    "ok": {"result": "Restocked 3 items."},
+    "bad": {"result": "❌ Failed to fetch menu"},
+    "late": None,
+}
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch, state):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3)
+    monkeypatch.setattr(job_queue, "_queue", queue)
+    monkeypatch.setattr(main, "find_venue",
+                        lambda config_name, venue_id: None if venue_id == "gone" else {"venue_id": venue_id})
+    ran = []
+
+    def run_venues(venues, workers, deadline, on_result=None):
+        ran.append([venue["venue_id"] for venue in venues])
+        return {venue["venue_id"]: OUTCOMES[venue["venue_id"]] for venue in venues}
+    monkeypatch.setattr(main, "run_venues", run_venues)
+    queue.ran = ran
+    return queue
+
+
+def status_of(queue, name):
+    with queue._connect() as conn:
+        return conn.execute("SELECT status, attempts FROM jobs WHERE name = ?", (name,)).fetchone()
+
+
+def test_drain_acknowledges_retries_and_leaves_jobs_by_outcome(jobs):
+    for venue_id in ("ok", "bad", "late", "gone"):
+        main.enqueue_venue(venue_id, "venues.json")
+    jobs.create_task("resize:ok", {"action": "resize", "venue_id": "ok"})
+
+    results = main.drain_queue(1, time.monotonic() + 30)
+
+    assert status_of(jobs, "restock:ok") == (DONE, 0)
+    assert status_of(jobs, "restock:bad") == (PENDING, 1)
+    # Out of time: handed back without using up an attempt
+    assert status_of(jobs, "restock:late") == (PENDING, 0)
+    assert status_of(jobs, "restock:gone") == (DONE, 0)
+    assert status_of(jobs, "resize:ok")[0] == DEAD
+    assert results["ok"] == OUTCOMES["ok"]
+    assert results["late"]["result"].startswith("⏸️ Deferred")
+    # The deferred job alone came back in a second round, then draining stopped
+    assert jobs.ran == [["ok", "bad", "late"], ["late"]]
+
+
+def test_nothing_is_leased_past_the_deadline(jobs):
+    main.enqueue_venue("ok", "venues.json")
+    assert main.drain_queue(1, time.monotonic() - 1) == {}
+    assert status_of(jobs, "restock:ok") == (PENDING, 0)
+
+
+def test_failed_venues_are_queued_for_a_retry(jobs):
+    groups = {"venues.json": [{"venue_id": "ok"}, {"venue_id": "bad"}, {"venue_id": "late"}]}
+    main.queue_failed_venues(groups, {"ok": OUTCOMES["ok"], "bad": OUTCOMES["bad"], "late": None})
+    assert jobs.stats() == {PENDING: 1}
+    assert status_of(jobs, "restock:bad") == (PENDING, 0)
@@ -0,0 +1,89 @@
+# cloud_function/tests/test_export_scheduler.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from export_scheduler import ExportScheduler
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_jobs_are_polled_in_due_order_until_finished(pool):
+    scheduler = ExportScheduler(pool)
+    polls = []
+    lock = threading.Lock()
+    remaining = {"a": 3, "b": 1, "c": 2}
+
+    def poll(job):
+        with lock:
+            polls.append(job)
+            remaining[job] -= 1
+            return 0.01 if remaining[job] else None
+
+    for delay, job in ((0.02, "a"), (0.0, "b"), (0.01, "c")):
+        scheduler.schedule(delay, job)
+    assert scheduler.run(poll) == []
+    assert polls[0] == "b"
+    assert sorted(polls) == ["a", "a", "a", "b", "c", "c"]
+
+
+def test_independent_jobs_are_polled_concurrently(pool):
+    scheduler = ExportScheduler(pool)
+    started = time.monotonic()
+    for job in range(4):
+        scheduler.schedule(0, job)
+    scheduler.run(lambda job: time.sleep(0.1))
+    # Four 0.1 s polls on four workers, not one after the other
+    assert time.monotonic() - started < 0.3
+
+
+def test_deadline_returns_jobs_not_due_before_it(pool):
+    scheduler = ExportScheduler(pool)
+    scheduler.schedule(0, "now")
+    scheduler.schedule(10, "later")
+    polled = []
+    left = scheduler.run(lambda job: polled.append(job), deadline=time.monotonic() + 0.5)
+    assert polled == ["now"] and left == ["later"]
+
+
+def test_rescheduled_past_the_deadline_is_returned(pool):
+    scheduler = ExportScheduler(pool)
+    scheduler.schedule(0, "job")
+    left = scheduler.run(lambda job: 10, deadline=time.monotonic() + 0.5)
+    assert left == ["job"]
+
+
+def test_crashed_poll_finishes_the_job(pool):
+    scheduler = ExportScheduler(pool)
+    scheduler.schedule(0, "bad")
+    scheduler.schedule(0, "good")
+    polled = []
+
+    def poll(job):
+        polled.append(job)
+        if job == "bad":
+            raise RuntimeError("boom")
+
+    assert scheduler.run(poll) == []
+    assert sorted(polled) == ["bad", "good"]
+
+
+def test_a_job_scheduled_while_running_is_picked_up(pool):
+    scheduler = ExportScheduler(pool)
+    polled = []
+
+    def poll(job):
+        polled.append(job)
+        if job == "first":
+            scheduler.schedule(0, "second")
+
+    scheduler.schedule(0, "first")
+    scheduler.run(poll)
+    assert polled == ["first", "second"]
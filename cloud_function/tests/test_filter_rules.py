@@ -0,0 +1,182 @@
+# cloud_function/tests/test_filter_rules.py
+
+from datetime import datetime
+
+from filter_rules import PrefixTrie, VenueRules, Window, get_venue_rules, rules_fingerprint
+from menu_index import MenuIndex, select_restock_items
+
+# 2026-10-19 is a Monday
+MONDAY = datetime(2026, 10, 19)
+
+
+def at(day_offset, hour, minute=0):
+    return MONDAY.replace(day=MONDAY.day + day_offset, hour=hour, minute=minute)
+
+
+def item(gtin, sku=None, mode="FORCED_OUT_OF_STOCK", name=None, category=None):
+    return {"product": {"gtin": gtin, "sku": sku}, "inventory_mode": mode, "availability": "AVAILABLE",
+            "name": name, "category": category}
+
+
+# ─────────────────────────────────────────────────────
+# PrefixTrie
+def test_trie_matches_any_stored_prefix():
+    trie = PrefixTrie(["703", "7040", "12345"])
+    assert trie.match("7038010001")
+    assert trie.match("70401")
+    assert trie.match("12345")
+    assert not trie.match("704")
+    assert not trie.match("1234")
+    assert not trie.match("6703")
+
+
+def test_trie_shorter_prefix_wins_over_longer():
+    trie = PrefixTrie(["70", "7038"])
+    assert trie.match("7099")
+    assert trie.match("7038")
+
+
+def test_trie_empty_values():
+    trie = PrefixTrie(["70"])
+    assert not trie.match(None)
+    assert not trie.match("")
+    assert not PrefixTrie([])
+    assert not PrefixTrie([]).match("70")
+
+
+def test_trie_stringifies_numeric_prefixes():
+    assert PrefixTrie([703]).match("7031")
+
+
+# ─────────────────────────────────────────────────────
+# Scheduled windows
+def test_hours_window_without_wrap():
+    window = Window({"hours": "08:00-16:30"})
+    assert window.active(at(0, 8))
+    assert window.active(at(0, 16, 29))
+    assert not window.active(at(0, 16, 30))
+    assert not window.active(at(0, 7, 59))
+
+
+def test_hours_window_wrapping_midnight():
+    window = Window({"hours": "22:00-02:00"})
+    assert window.active(at(0, 22))
+    assert window.active(at(0, 23, 59))
+    assert window.active(at(1, 0, 0))
+    assert window.active(at(1, 1, 59))
+    assert not window.active(at(1, 2, 0))
+    assert not window.active(at(0, 21, 59))
+    assert not window.active(at(0, 12))
+
+
+def test_wrapped_window_after_midnight_belongs_to_the_starting_day():
+    window = Window({"days": ["fri"], "hours": "22:00-02:00"})
+    friday, saturday = 4, 5
+    assert window.active(at(friday, 23))
+    assert window.active(at(saturday, 1))
+    assert not window.active(at(saturday, 23))
+    assert not window.active(at(friday, 1))
+
+
+def test_date_bounds_are_inclusive_days():
+    window = Window({"from": "2026-10-19", "until": "2026-10-20"})
+    assert not window.active(at(-1, 23, 59))
+    assert window.active(at(0, 0))
+    assert window.active(at(1, 23, 59))
+    assert not window.active(at(2, 0))
+
+
+def test_datetime_bounds_compare_to_the_minute():
+    window = Window({"from": "2026-10-19T12:00", "until": "2026-10-19T13:00"})
+    assert not window.active(at(0, 11, 59))
+    assert window.active(at(0, 12))
+    assert window.active(at(0, 13))
+    assert not window.active(at(0, 13, 1))
+
+
+def test_unknown_weekday_is_ignored_with_the_rule():
+    rules = VenueRules({"venue_id": "v", "scheduled_rules": [{"days": ["someday"]}]}, "fp")
+    assert rules.scheduled == []
+
+
+def test_malformed_scheduled_rules_are_ignored():
+    rules = VenueRules({"venue_id": "v", "scheduled_rules": [
+        "22:00-02:00", {"days": "fri"}, {"days": [5]}, {"hours": "22:00-02:00", "excluded_gtins": ["1"]},
+    ]}, "fp")
+    assert len(rules.scheduled) == 1
+    assert rules.at(at(0, 23)).exclude("1", None, None, None)
+
+
+# ─────────────────────────────────────────────────────
+# Venue rules
+def test_scheduled_rule_merges_only_while_active():
+    venue = {
+        "venue_id": "v",
+        "excluded_gtins": ["1"],
+        "scheduled_rules": [{"hours": "22:00-02:00", "excluded_gtin_prefixes": ["70"]}],
+    }
+    rules = VenueRules(venue, rules_fingerprint(venue))
+    day, night = rules.at(at(0, 12)), rules.at(at(0, 23))
+    assert not day.exclude(None, None, None, None) and day.exclude("1", None, None, None)
+    assert not day.exclude("7001", None, None, None)
+    assert night.exclude("7001", None, None, None) and night.exclude("1", None, None, None)
+    assert day.fingerprint != night.fingerprint
+    assert rules.at(at(1, 1)) is night
+
+
+def test_fingerprint_ignores_unrelated_keys_and_caches():
+    a = {"venue_id": "a", "api_password": "x", "excluded_gtins": ["1"]}
+    b = {"venue_id": "b", "api_password": "y", "excluded_gtins": ["1"]}
+    assert rules_fingerprint(a) == rules_fingerprint(b)
+    assert get_venue_rules(a) is get_venue_rules(b)
+    assert rules_fingerprint(a) != rules_fingerprint({**a, "excluded_gtins": ["2"]})
+
+
+def test_patterns_are_case_insensitive_shell_style():
+    venue = {"excluded_name_patterns": ["*bolle*"], "excluded_category_patterns": ["drikke"]}
+    exclude = get_venue_rules(venue).at(MONDAY).exclude
+    assert exclude(None, None, ["Kanel BOLLE stor"], None)
+    assert exclude(None, None, None, ["Drikke"])
+    assert not exclude(None, None, ["Brød"], ["Drikker"])
+
+
+def test_rules_select_items_through_the_index():
+    index = MenuIndex.from_items([
+        item("7038010001"),
+        item("7040000002"),
+        item("1111", name=[{"lang": "nb", "value": "Boller"}]),
+        item("2222", mode="ENABLED"),
+        item(None, sku="S-1"),
+    ], "v")
+    venue = {"excluded_gtin_prefixes": ["7038"], "excluded_name_patterns": ["boll*"]}
+    selected = select_restock_items(index, rules=get_venue_rules(venue).at(MONDAY))
+    assert selected == [{"type": "gtin", "id": "7040000002"}, {"type": "sku", "id": "S-1"}]
+
+
+def test_exact_include_wins_over_exclusion():
+    index = MenuIndex.from_items([item("7038010001"), item("5555")], "v")
+    venue = {"included_gtins": ["7038010001"], "excluded_gtin_prefixes": ["70"]}
+    selected = select_restock_items(index, rules=get_venue_rules(venue).at(MONDAY))
+    assert [s["id"] for s in selected] == ["7038010001"]
+
+
+def test_exclusion_applies_to_include_prefixes_and_patterns():
+    index = MenuIndex.from_items([
+        item("7038010001"), item("7040000002"), item("7012000003"), item("5555"),
+        item("6666", name=[{"lang": "nb", "value": "Kanelbolle"}]),
+        item("6667", name=[{"lang": "nb", "value": "Kanelbolle glutenfri"}]),
+    ], "v")
+    venue = {"included_gtin_prefixes": ["70"], "included_name_patterns": ["kanelbolle*"],
+             "excluded_gtins": ["7040000002"], "excluded_gtin_prefixes": ["7012"],
+             "excluded_name_patterns": ["*glutenfri"]}
+    selected = select_restock_items(index, rules=get_venue_rules(venue).at(MONDAY))
+    assert [s["id"] for s in selected] == ["7038010001", "6666"]
+
+
+def test_scheduled_exclusion_narrows_an_include_prefix():
+    index = MenuIndex.from_items([item("7038010001"), item("7012000003")], "v")
+    venue = {"included_gtin_prefixes": ["70"],
+             "scheduled_rules": [{"days": ["sat", "sun"], "excluded_gtin_prefixes": ["7012"]}]}
+    rules = get_venue_rules(venue)
+    assert len(select_restock_items(index, rules=rules.at(MONDAY))) == 2
+    assert [s["id"] for s in select_restock_items(index, rules=rules.at(at(5, 12)))] == ["7038010001"]
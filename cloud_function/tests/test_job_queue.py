@@ -0,0 +1,138 @@
+# cloud_function/tests/test_job_queue.py
+
+import pytest
+
+import job_queue
+from job_queue import DEAD, DONE, LEASED, PENDING, SQLiteJobQueue, retry_delay
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3)
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    assert [retry_delay(n, 10, 60) for n in range(6)] == [10, 10, 20, 40, 60, 60]
+
+
+def test_create_dedupes_by_name_while_pending_or_leased(queue):
+    assert queue.create_task("restock-a", {"venue_id": "a"})
+    assert not queue.create_task("restock-a", {"venue_id": "a"})
+    [task] = queue.lease_tasks(10, 60)
+    assert not queue.create_task("restock-a", {"venue_id": "a"})
+    queue.acknowledge_task(task)
+    assert queue.create_task("restock-a", {"venue_id": "a"})
+
+
+def test_leased_task_is_hidden_until_the_lease_runs_out(queue, clock):
+    queue.create_task("t", {"n": 1})
+    [task] = queue.lease_tasks(10, 60)
+    assert task.payload == {"n": 1} and task.attempts == 0
+    clock.advance(59)
+    assert queue.lease_tasks(10, 60) == []
+    assert queue.stats() == {LEASED: 1}
+
+
+def test_expired_lease_counts_as_an_attempt_and_backs_off(queue, clock):
+    queue.create_task("t", {})
+    queue.lease_tasks(10, 60)
+    clock.advance(61)
+    # The lost lease is failed on this lease call; the retry waits out its backoff
+    assert queue.lease_tasks(10, 60) == []
+    assert queue.stats() == {PENDING: 1}
+    clock.advance(retry_delay(1))
+    [task] = queue.lease_tasks(10, 60)
+    assert task.attempts == 1
+    assert task.last_error == "lease expired"
+
+
+def test_stale_lease_cannot_ack_a_released_task(queue, clock):
+    queue.create_task("t", {})
+    [stale] = queue.lease_tasks(10, 60)
+    clock.advance(61)
+    queue.lease_tasks(10, 60)
+    clock.advance(retry_delay(1))
+    [fresh] = queue.lease_tasks(10, 60)
+    queue.acknowledge_task(stale)
+    assert queue.stats() == {LEASED: 1}
+    assert queue.fail_task(stale, "late") is None
+    queue.acknowledge_task(fresh)
+    assert queue.stats() == {DONE: 1}
+
+
+def test_cancel_lease_is_not_an_attempt(queue):
+    queue.create_task("t", {})
+    [task] = queue.lease_tasks(10, 60)
+    queue.cancel_lease(task)
+    [again] = queue.lease_tasks(10, 60)
+    assert again.attempts == 0
+
+
+def test_failures_dead_letter_after_max_attempts(queue, clock):
+    queue.create_task("t", {"venue_id": "v"})
+    statuses = []
+    for _ in range(3):
+        [task] = queue.lease_tasks(10, 60)
+        statuses.append(queue.fail_task(task, "HTTP 500"))
+        clock.advance(job_queue.MAX_BACKOFF)
+    assert statuses == [PENDING, PENDING, DEAD]
+    assert queue.lease_tasks(10, 60) == []
+    [dead] = queue.dead_letters()
+    assert (dead.name, dead.attempts, dead.last_error) == ("t", 3, "HTTP 500")
+    # A dead-lettered name can be queued again
+    assert queue.create_task("t", {"venue_id": "v"})
+
+
+def test_expired_leases_dead_letter_too(queue, clock):
+    queue.create_task("t", {})
+    for _ in range(3):
+        [task] = queue.lease_tasks(10, 60)
+        clock.advance(61)
+        # This lease call fails the lost lease
+        assert queue.lease_tasks(10, 60) == []
+        clock.advance(job_queue.MAX_BACKOFF)
+    assert queue.stats() == {DEAD: 1}
+    assert queue.dead_letters()[0].last_error == "lease expired"
+
+
+def test_fail_without_retry_dead_letters_at_once(queue):
+    queue.create_task("t", {})
+    [task] = queue.lease_tasks(10, 60)
+    assert queue.fail_task(task, "unknown action", retry=False) == DEAD
+
+
+def test_lease_respects_schedule_time_and_order(queue, clock):
+    queue.create_task("later", {}, schedule_time=clock.now + 30)
+    queue.create_task("first", {}, schedule_time=clock.now - 10)
+    queue.create_task("second", {})
+    assert [task.name for task in queue.lease_tasks(1, 60)] == ["first"]
+    assert [task.name for task in queue.lease_tasks(10, 60)] == ["second"]
+    clock.advance(30)
+    assert [task.name for task in queue.lease_tasks(10, 60)] == ["later"]
+
+
+def test_done_jobs_are_purged_after_retention(queue, clock):
+    queue.create_task("t", {})
+    [task] = queue.lease_tasks(10, 60)
+    queue.acknowledge_task(task)
+    clock.advance(job_queue.DONE_RETENTION + 1)
+    queue.lease_tasks(10, 60)
+    assert queue.stats() == {}
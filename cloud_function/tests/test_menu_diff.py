@@ -0,0 +1,123 @@
+# cloud_function/tests/test_menu_diff.py
+
+import os
+import random
+
+import pytest
+
+import menu_diff
+from menu_diff import (DELTA_KIND, RESTOCKED, STATE_KIND, apply_delta, changed_items, diff_states,
+                       index_items, keyframe_due, load_state, mark_restocked, save_state, summarize)
+from snapshot_store import SnapshotStore
+
+
+def item(gtin, mode="ENABLED", availability="AVAILABLE", price=1000, sku=None):
+    return {"product": {"gtin": gtin, "sku": sku}, "inventory_mode": mode,
+            "availability": availability, "price": price, "name": [{"lang": "nb", "value": gtin}]}
+
+
+def random_menu(rng, n=40):
+    return [item(str(rng.randrange(60)), rng.choice(["ENABLED", "FORCED_OUT_OF_STOCK"]),
+                 rng.choice(["AVAILABLE", "SOLD_OUT"]), rng.choice([1000, 1290])) for _ in range(n)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path), compression="gzip")
+
+
+@pytest.fixture
+def keyframe_every(monkeypatch):
+    monkeypatch.setattr(menu_diff, "KEYFRAME_EVERY", 3)
+    return 3
+
+
+def test_items_are_keyed_by_gtin_then_sku():
+    state = index_items([item("1"), item(None, sku="S"), item(None)])
+    assert set(state) == {"gtin:1", "sku:S"}
+    assert state["gtin:1"] == {"inventory_mode": "ENABLED", "availability": "AVAILABLE", "price": 1000}
+
+
+def test_diff_reports_added_removed_and_changed_fields():
+    previous = index_items([item("1"), item("2"), item("3", price=900)])
+    current = index_items([item("1", mode="FORCED_OUT_OF_STOCK"), item("3"), item("4")])
+    delta = diff_states(previous, current)
+    assert delta["removed"] == ["gtin:2"]
+    assert set(delta["added"]) == {"gtin:4"}
+    assert delta["changed"] == {"gtin:1": {"inventory_mode": "FORCED_OUT_OF_STOCK"}, "gtin:3": {"price": 1000}}
+    assert summarize(delta) == {"added": 1, "removed": 1, "inventory_mode_changed": 1,
+                                "availability_changed": 0, "price_changed": 1}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_applying_the_diff_rebuilds_the_new_state(seed):
+    rng = random.Random(seed)
+    previous, current = index_items(random_menu(rng)), index_items(random_menu(rng))
+    assert apply_delta(previous, diff_states(previous, current)) == current
+    assert apply_delta(current, diff_states(current, current)) == current
+
+
+def test_changed_items_skips_price_only_changes():
+    previous = index_items([item("1"), item("2"), item("3")])
+    menu = [item("1", availability="SOLD_OUT"), item("2", price=5), item("3"), item("4")]
+    delta = diff_states(previous, index_items(menu))
+    assert [i["product"]["gtin"] for i in changed_items(menu, delta)] == ["1", "4"]
+
+
+def test_restocked_item_forced_out_again_shows_as_a_change():
+    state = mark_restocked(index_items([item("1", mode="FORCED_OUT_OF_STOCK")]), ["gtin:1", "gtin:9"])
+    assert state == {"gtin:1": {"inventory_mode": RESTOCKED, "availability": "AVAILABLE", "price": 1000}}
+    menu = [item("1", mode="FORCED_OUT_OF_STOCK")]
+    assert changed_items(menu, diff_states(state, index_items(menu))) == menu
+
+
+def test_chain_stores_a_keyframe_every_n_runs_and_rebuilds_each_state(store, keyframe_every):
+    rng = random.Random(1)
+    kinds = []
+    for run in range(8):
+        state = index_items(random_menu(rng))
+        previous = load_state(store, "v")
+        kinds.append(save_state(store, "v", previous, state))
+        assert load_state(store, "v") == state
+    assert kinds == ["keyframe", "delta", "delta"] * 2 + ["keyframe", "delta"]
+    assert len(store.entries("v", STATE_KIND)) == 3
+    assert len(store.entries("v", DELTA_KIND)) == 5
+
+
+def test_keyframe_due_counts_deltas_since_the_last_keyframe(store, keyframe_every):
+    assert keyframe_due(store, "v")
+    state = index_items([item("1")])
+    save_state(store, "v", None, state)
+    assert not keyframe_due(store, "v")
+    save_state(store, "v", state, state)
+    assert not keyframe_due(store, "v")
+    save_state(store, "v", state, state)
+    # Keyframe plus KEYFRAME_EVERY - 1 deltas: the next save starts a new chain
+    assert keyframe_due(store, "v")
+
+
+def test_venues_have_separate_chains(store, keyframe_every):
+    a, b = index_items([item("1")]), index_items([item("2")])
+    save_state(store, "a", None, a)
+    save_state(store, "b", None, b)
+    save_state(store, "a", a, index_items([item("1", price=5)]))
+    assert load_state(store, "b") == b
+    assert load_state(store, "a")["gtin:1"]["price"] == 5
+
+
+def test_broken_delta_starts_over_with_a_keyframe(store, keyframe_every):
+    state = index_items([item("1")])
+    save_state(store, "v", None, state)
+    save_state(store, "v", state, index_items([item("1", price=5)]))
+    with open(store.latest("v", DELTA_KIND)["path"], "wb") as f:
+        f.write(b"not gzip")
+    assert load_state(store, "v") is None
+    assert save_state(store, "v", None, state) == "keyframe"
+    assert load_state(store, "v") == state
+
+
+def test_evicted_keyframe_means_no_previous_state(store):
+    state = index_items([item("1")])
+    save_state(store, "v", None, state)
+    os.remove(store.latest("v", STATE_KIND)["path"])
+    assert load_state(SnapshotStore(store.directory, compression="gzip"), "v") is None
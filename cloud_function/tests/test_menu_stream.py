@@ -0,0 +1,81 @@
+# cloud_function/tests/test_menu_stream.py
+
+import io
+import json
+
+import pytest
+
+import menu_stream
+from menu_index import MenuIndex, load_menu_index
+from menu_stream import parse_menu_stream
+
+MENU = {
+    "status": "READY",
+    "venue_id": "v",
+    "menu": {
+        "items": [
+            {"id": "1", "inventory_mode": "FORCED_OUT_OF_STOCK", "availability": "AVAILABLE",
+             "price": 1290, "product": {"gtin": "7038010001", "sku": None},
+             "name": [{"lang": "nb", "value": "Kanelbolle"}, {"lang": "en", "value": "Cinnamon bun"}],
+             "category": "Bakst", "options": [{"price": 10}]},
+            {"id": "2", "inventory_mode": "ENABLED", "availability": "SOLD_OUT", "price": 12.5,
+             "product": {"gtin": None, "sku": "S-2", "extra": {"price": 3}},
+             "name": ["Rundstykke", "Bread roll"], "category": [{"lang": "nb", "value": "Brød"}]},
+            {"id": "3", "inventory_mode": "ENABLED", "price": {"amount": 100}, "product": {},
+             "name": "Kaffe"},
+            "not an item",
+        ],
+    },
+}
+
+
+@pytest.fixture(params=["ijson", "json"])
+def parser(request, monkeypatch):
+    if request.param == "ijson":
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(menu_stream, "ijson", None)
+    return request.param
+
+
+def parse(menu=MENU):
+    return parse_menu_stream(io.BytesIO(json.dumps(menu).encode("utf-8")))
+
+
+def test_items_are_slimmed_to_the_fields_the_pipeline_uses(parser):
+    menu = parse()
+    assert menu["status"] == "READY"
+    assert menu["menu"]["items"] == [
+        {"inventory_mode": "FORCED_OUT_OF_STOCK", "availability": "AVAILABLE", "price": 1290,
+         "product": {"gtin": "7038010001"}, "name": ["Kanelbolle", "Cinnamon bun"], "category": ["Bakst"]},
+        {"inventory_mode": "ENABLED", "availability": "SOLD_OUT", "price": 12.5,
+         "product": {"sku": "S-2"}, "name": ["Rundstykke", "Bread roll"], "category": ["Brød"]},
+        {"inventory_mode": "ENABLED", "product": {}, "name": ["Kaffe"]},
+    ]
+
+
+def test_prices_are_plain_numbers(parser):
+    prices = [item.get("price") for item in parse()["menu"]["items"]]
+    assert [type(price) for price in prices] == [int, float, type(None)]
+
+
+def test_both_parsers_give_the_same_menu(monkeypatch):
+    pytest.importorskip("ijson")
+    streamed = parse()
+    monkeypatch.setattr(menu_stream, "ijson", None)
+    assert parse() == streamed
+
+
+def test_everything_read_is_copied_to_the_sink(parser):
+    raw = json.dumps(MENU).encode("utf-8")
+    sink = io.BytesIO()
+    menu = parse_menu_stream(io.BytesIO(raw), sink)
+    assert sink.getvalue() == raw and menu["size_bytes"] == len(raw)
+
+
+def test_parsed_menu_can_be_indexed_and_saved(parser, tmp_path):
+    menu = parse()
+    index = MenuIndex.from_items(menu["menu"]["items"], "v")
+    index.save(str(tmp_path))
+    loaded = load_menu_index("v", str(tmp_path))
+    assert loaded.prices == index.prices
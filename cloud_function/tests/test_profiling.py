@@ -0,0 +1,124 @@
+# cloud_function/tests/test_profiling.py
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import profiling
+from profiling import profile_call
+
+
+def busy_in_worker():
+    return sum(i * i for i in range(20000))
+
+
+def after_the_call():
+    return sum(range(1000))
+
+
+def functions(report):
+    return {row["function"].split("(")[-1].rstrip(")") for row in report["cpu_top"]}
+
+
+def test_report_covers_pool_threads():
+    def handler():
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            return sum(pool.map(lambda _: busy_in_worker(), range(4)))
+
+    result, report = profile_call(handler, top=200)
+    assert result == 4 * busy_in_worker()
+    assert "busy_in_worker" in functions(report)
+    assert report["wall_s"] >= 0 and report["memory"]["peak_mb"] >= 0
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="one profiler sees every thread from 3.12")
+def test_threads_outliving_the_call_stop_profiling_when_they_end():
+    started, gate, done = threading.Event(), threading.Event(), threading.Event()
+    profiled = {}
+
+    def background():
+        started.set()
+        gate.wait(5)
+        after_the_call()
+
+    def handler():
+        threading.Thread(target=background, daemon=True).start()
+        started.wait(5)
+        return "202"
+
+    _, report = profile_call(handler, top=200)
+    gate.set()
+    time.sleep(0.05)
+    # Work done after the call isn't in its report
+    assert "after_the_call" not in functions(report)
+
+    # A target-less thread (like a threading.Timer) is never profiled
+    class Timer(threading.Thread):
+        def run(self):
+            profiled["timer"] = sys.getprofile()
+            done.set()
+
+    def with_timer():
+        Timer(daemon=True).start()
+        done.wait(5)
+
+    profile_call(with_timer)
+    assert profiled["timer"] is None
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="one profiler sees every thread from 3.12")
+def test_pool_thread_profiler_is_disabled_when_its_thread_ends(monkeypatch):
+    created = []
+    real = profiling.cProfile.Profile
+
+    class Profile(real):
+        def __init__(self):
+            super().__init__()
+            self.disabled = 0
+            created.append(self)
+
+        def disable(self):
+            self.disabled += 1
+            return super().disable()
+    monkeypatch.setattr(profiling.cProfile, "Profile", Profile)
+
+    def handler():
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda _: busy_in_worker(), range(4)))
+
+    profile_call(handler)
+    workers = created[1:]
+    assert workers
+    # Each thread disables its own profiler on exit (stop() also disables them once when snapshotting)
+    assert all(profiler.disabled >= 2 for profiler in workers)
+
+
+def test_new_threads_are_not_profiled_after_the_call():
+    profile_call(lambda: None)
+    seen = {}
+    thread = threading.Thread(target=lambda: seen.setdefault("profile", sys.getprofile()))
+    thread.start()
+    thread.join()
+    assert seen["profile"] is None
+
+
+def test_repeated_calls_report_only_their_own_time():
+    def slow():
+        time.sleep(0.05)
+
+    walls = [profile_call(slow)[1]["wall_s"] for _ in range(3)]
+    assert all(wall < 0.5 for wall in walls)
+
+
+def test_a_concurrent_call_runs_unprofiled():
+    inner = {}
+
+    def outer():
+        inner["result"] = profile_call(lambda: "inner")
+
+    _, report = profile_call(outer)
+    assert report is not None
+    assert inner["result"] == ("inner", None)
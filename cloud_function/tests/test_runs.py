@@ -0,0 +1,194 @@
+# cloud_function/tests/test_runs.py
+
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+
+import runs  # noqa: E402
+from runs import (RUN_TTL, RUNS_KEY, checkpoint_venue, discard_run, load_run, prune_runs, run_status,  # noqa: E402
+                  start_async_run)
+
+pytestmark = pytest.mark.usefixtures("state")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(runs.time, "time", lambda: now[0])
+    return now
+
+
+def ok(message="Restocked 1 items."):
+    return {"result": message}
+
+
+def test_checkpoints_merge_per_venue_and_stamp_the_run(state, clock):
+    checkpoint_venue("r", "venues.json", "a", ok())
+    clock[0] += 10
+    checkpoint_venue("r", "venues.json", "b", ok())
+    run = load_run("r")
+    assert set(run["completed"]) == {"a", "b"}
+    assert run["updated_at"] == clock[0]
+    assert state.get(RUNS_KEY) == {"r": clock[0]}
+
+
+def test_discard_removes_the_run_and_its_index_entry(state, clock):
+    checkpoint_venue("r", "venues.json", "a", ok())
+    discard_run("r")
+    assert load_run("r") == {}
+    assert state.get(RUNS_KEY) == {}
+
+
+def test_prune_deletes_only_runs_past_the_ttl(state, clock):
+    checkpoint_venue("old", "venues.json", "a", ok())
+    clock[0] += RUN_TTL
+    checkpoint_venue("new", "venues.json", "a", ok())
+    clock[0] += 1
+    assert prune_runs() == 1
+    assert load_run("old") == {} and load_run("new")
+    assert list(state.get(RUNS_KEY)) == ["new"]
+    assert prune_runs() == 0
+
+
+def wait_for(run_id):
+    for thread in threading.enumerate():
+        if thread.name == f"run-{run_id}":
+            thread.join(5)
+
+
+def test_async_run_keeps_each_result_once(clock):
+    venues = [{"venue_id": "a"}, {"venue_id": "b"}]
+
+    def execute():
+        checkpoint_venue("r", "venues.json", "a", ok())
+        # "b" ran on a shard worker, so it has no checkpoint in this run
+        return {"a": ok(), "b": ok("Restocked 2 items.")}, []
+
+    body, code = start_async_run("r", "venues.json", venues, execute)
+    assert code == 202
+    wait_for("r")
+    run = load_run("r")
+    assert run["status"] == "complete"
+    assert run["results"] == {"b": ok("Restocked 2 items.")}
+    status = json.loads(run_status("r")[0])
+    assert status["results"] == {"a": ok(), "b": ok("Restocked 2 items.")}
+    assert (status["done"], status["total"]) == (1, 2)
+
+
+def test_async_run_is_not_started_twice(clock):
+    started = []
+    gate = threading.Event()
+
+    def execute():
+        started.append(1)
+        gate.wait(5)
+        return {}, []
+
+    assert start_async_run("r", "venues.json", [{"venue_id": "a"}], execute)[1] == 202
+    body, code = start_async_run("r", "venues.json", [{"venue_id": "a"}], execute)
+    assert code == 200 and json.loads(body)["status"] == "running"
+    gate.set()
+    wait_for("r")
+    assert start_async_run("r", "venues.json", [{"venue_id": "a"}], execute)[1] == 200
+    assert started == [1]
+
+
+def test_failed_async_run_reports_the_error(clock):
+    def execute():
+        raise RuntimeError("boom")
+
+    start_async_run("r", "venues.json", [{"venue_id": "a"}], execute)
+    wait_for("r")
+    status = json.loads(run_status("r")[0])
+    assert (status["status"], status["error"], status["pending"]) == ("failed", "boom", ["a"])
+
+
+def test_running_run_past_the_function_timeout_shows_as_stalled(clock):
+    gate = threading.Event()
+    start_async_run("r", "venues.json", [{"venue_id": "a"}], lambda: gate.wait(5) and ({}, []))
+    clock[0] += runs.FUNCTION_TIMEOUT + 1
+    assert json.loads(run_status("r")[0])["status"] == "stalled"
+    gate.set()
+    wait_for("r")
+
+
+def test_unknown_run():
+    assert run_status("nope")[1] == 404
+
+
+# ─────────────────────────────────────────────────────
+# Resuming: venues checkpointed by an earlier invocation are not run again
+def test_resumed_run_only_runs_unfinished_venues(monkeypatch):
+    import main
+    ran = []
+
+    def run_venues(venues, workers, deadline, on_result=None):
+        ran.extend(venue["venue_id"] for venue in venues)
+        # "c" doesn't fit before the deadline
+        results = {venue["venue_id"]: None if venue["venue_id"] == "c" else ok() for venue in venues}
+        for venue_id, result in results.items():
+            if result:
+                on_result(venue_id, result)
+        return results
+
+    monkeypatch.setattr(main, "run_venues", run_venues)
+    venues = [{"venue_id": v} for v in "abc"]
+    checkpoint_venue("r", "venues.json", "a", ok("Restocked 5 items."))
+    results, pending = main.run_resumable("r", "venues.json", venues, 1, None)
+    assert sorted(ran) == ["b", "c"]
+    assert pending == ["c"]
+    assert results["a"] == ok("Restocked 5 items.")
+    assert results["c"]["result"].startswith("⏸️ Deferred")
+    run = load_run("r")
+    assert set(run["completed"]) == {"a", "b"} and run["status"] == "resumable"
+
+
+# ─────────────────────────────────────────────────────
+# Async API: ?async=1 answers 202 at once, ?status=<run_id> follows the run
+class Request:
+    def __init__(self, args, headers=None):
+        self.args = args
+        self.headers = headers or {}
+
+    def get_json(self, silent=False):
+        return None
+
+
+def test_async_run_ids():
+    assert runs.async_run_id(Request({"run_id": "mine"}), "venues.json") == "mine"
+    tick = Request({}, {"X-CloudScheduler-ScheduleTime": "2026-10-19T07:00:00Z"})
+    assert runs.async_run_id(tick, "venues.json") == runs.async_run_id(tick, "venues.json")
+    assert runs.async_run_id(tick, "venues.json") != runs.async_run_id(tick, "other.json")
+    assert runs.async_run_id(Request({}), "venues.json") != runs.async_run_id(Request({}), "venues.json")
+
+
+def test_async_request_answers_202_and_status_follows_the_run(tmp_path, monkeypatch):
+    import main
+    (tmp_path / "venues.json").write_text(json.dumps(
+        [{"venue_id": v, "api_username": "u", "api_password": "p"} for v in "ab"]))
+    monkeypatch.chdir(tmp_path)
+    gate = threading.Event()
+
+    def run_venues(venues, workers, deadline, on_result=None):
+        for venue in venues:
+            on_result(venue["venue_id"], ok())
+            gate.wait(5)
+        return {venue["venue_id"]: ok() for venue in venues}
+    monkeypatch.setattr(main, "run_venues", run_venues)
+    monkeypatch.setattr(main, "queue_failed_venues", lambda groups, results: None)
+
+    body, code = main.handle_request(Request({"async": "1", "run_id": "r"}))
+    assert code == 202 and json.loads(body)["status_url"] == "?status=r"
+    status = json.loads(main.handle_request(Request({"status": "r"}))[0])
+    assert status["status"] == "running" and status["total"] == 2
+    # A repeated trigger doesn't start the run again
+    assert main.handle_request(Request({"async": "1", "run_id": "r"}))[1] == 200
+
+    gate.set()
+    wait_for("r")
+    status = json.loads(main.handle_request(Request({"status": "r"}))[0])
+    assert (status["status"], status["done"], status["pending"]) == ("complete", 2, [])
+    assert set(status["results"]) == {"a", "b"}
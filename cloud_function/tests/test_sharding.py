@@ -0,0 +1,94 @@
+# cloud_function/tests/test_sharding.py
+
+import json
+import random
+
+import pytest
+
+from sharding import InProcessDispatcher, ShardRequest, dispatch, hash_shard, partition
+
+
+def test_partition_places_every_venue_once():
+    costs = {f"v{i}": float(i % 7) for i in range(50)}
+    shards = partition(costs, 4)
+    assert sorted(v for shard in shards for v in shard) == sorted(costs)
+
+
+def test_partition_balances_by_cost():
+    rng = random.Random(3)
+    costs = {f"v{i}": rng.uniform(1, 60) for i in range(200)}
+    loads = [sum(costs[v] for v in shard) for shard in partition(costs, 8)]
+    # Longest-processing-time-first stays within one venue of the ideal split
+    assert max(loads) - min(loads) <= max(costs.values())
+
+
+def test_one_expensive_venue_gets_a_shard_of_its_own():
+    shards = partition({"big": 100.0, "a": 1.0, "b": 1.0, "c": 1.0}, 2)
+    assert ["big"] in shards
+
+
+def test_partition_is_deterministic():
+    costs = {"a": 1.0, "b": 1.0, "c": 1.0, "d": 1.0}
+    assert partition(costs, 3) == partition(dict(reversed(list(costs.items()))), 3)
+
+
+def test_hash_shard_is_stable_and_in_range():
+    assert hash_shard("venue-1", 4) == hash_shard("venue-1", 4)
+    assert {hash_shard(f"v{i}", 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_dispatch_reports_each_job_in_order():
+    def handler(request):
+        shard = request.args["shard"]
+        if shard == "1":
+            return "overloaded", 503
+        if shard == "2":
+            return "not json", 200
+        if shard == "3":
+            raise RuntimeError("crashed")
+        return json.dumps({v: "ok" for v in request.get_json()["venue_ids"]}), 200
+
+    jobs = [({"shard": str(i)}, {"venue_ids": [f"v{i}"]}) for i in range(4)]
+    results = dispatch(InProcessDispatcher(handler), jobs)
+    assert results[0] == ({"v0": "ok"}, None)
+    assert results[1] == (None, "HTTP 503: overloaded")
+    assert results[2][0] is None and results[2][1].startswith("unreadable response")
+    assert results[3] == (None, "crashed")
+
+
+# ─────────────────────────────────────────────────────
+# Coordinator and worker sides in main.py
+@pytest.fixture
+def main(state):
+    pytest.importorskip("flask")
+    import main
+    return main
+
+
+def test_worker_runs_the_venues_it_was_sent_or_its_hash_share(main):
+    venues = [{"venue_id": f"v{i}"} for i in range(20)]
+    assert [v["venue_id"] for v in main.select_shard(venues, (0, 2), {"venue_ids": ["v3", "v7"]})] == ["v3", "v7"]
+    hashed = [main.select_shard(venues, (i, 3), None) for i in range(3)]
+    assert sorted(v["venue_id"] for share in hashed for v in share) == sorted(v["venue_id"] for v in venues)
+
+
+@pytest.mark.parametrize("args", [{"shard": "2", "of": "2"}, {"shard": "x", "of": "2"}])
+def test_invalid_shard_is_rejected(main, args):
+    with pytest.raises(ValueError):
+        main.get_shard(ShardRequest(args))
+
+
+def test_coordinator_merges_shard_results_and_fails_a_lost_shard(main, monkeypatch):
+    def worker(request):
+        venue_ids = request.get_json()["venue_ids"]
+        if "v0" in venue_ids:
+            return "boom", 500
+        return json.dumps({v: {"result": f"Restocked {v}"} for v in venue_ids}), 200
+
+    monkeypatch.setattr(main, "get_dispatcher", lambda handler: InProcessDispatcher(worker))
+    venues = [{"venue_id": f"v{i}"} for i in range(6)]
+    results = main.run_shards("venues.json", venues, 3)
+    assert set(results) == {v["venue_id"] for v in venues}
+    failed = [v for v, result in results.items() if result["result"].startswith("❌ Shard")]
+    assert "v0" in failed and 0 < len(failed) < 6
+    assert all(results[v]["result"] == f"Restocked {v}" for v in results if v not in failed)
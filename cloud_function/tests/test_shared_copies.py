@@ -0,0 +1,19 @@
+# cloud_function/tests/test_shared_copies.py
+
+import importlib.util
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_sync_shared():
+    path = os.path.join(ROOT, "price_update_tests", "sync_shared.py")
+    spec = importlib.util.spec_from_file_location("sync_shared", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_price_updater_copies_match_cloud_function():
+    stale = load_sync_shared().stale_copies()
+    assert stale == [], f"run python price_update_tests/sync_shared.py to refresh {', '.join(stale)}"
@@ -0,0 +1,143 @@
+# cloud_function/tests/test_state_store.py
+
+import pytest
+
+from state_store import LocalBucket, ObjectStoreBackend, PreconditionFailed, StateStore, create_backend
+
+
+@pytest.fixture(params=["sqlite", "file", "bucket"])
+def backend(request, tmp_path):
+    path = tmp_path / ("state" if request.param == "bucket" else "state.db")
+    return lambda: create_backend(request.param, str(path))
+
+
+def instance(backend, cache_ttl=0):
+    """A store as one function instance sees it; instances share only the backend."""
+    return StateStore(backend(), flush_delay=60, cache_ttl=cache_ttl)
+
+
+def test_update_is_visible_before_and_after_flush(backend):
+    store = instance(backend)
+    store.update("k", lambda doc: {**doc, "a": 1})
+    assert store.get("k") == {"a": 1}
+    assert instance(backend).get("k") is None
+    store.flush()
+    assert instance(backend).get("k") == {"a": 1}
+
+
+def test_instances_writing_different_sections_merge(backend):
+    one, two = instance(backend), instance(backend)
+    one.update("venue:v", lambda doc: {**doc, "latency": {"n": 1}})
+    two.update("venue:v", lambda doc: {**doc, "circuit": {"state": "open"}})
+    one.flush()
+    two.flush()
+    assert instance(backend).get("venue:v") == {"latency": {"n": 1}, "circuit": {"state": "open"}}
+
+
+def test_depth_two_merges_nested_fields(backend):
+    one, two = instance(backend), instance(backend)
+
+    def checkpoint(venue_id):
+        def apply(run):
+            run.setdefault("completed", {})[venue_id] = "ok"
+            return run
+        return apply
+
+    one.update("run:r", checkpoint("a"), depth=2)
+    two.update("run:r", checkpoint("b"), depth=2)
+    one.flush()
+    two.flush()
+    assert instance(backend).get("run:r") == {"completed": {"a": "ok", "b": "ok"}}
+
+
+def test_the_same_section_is_last_writer_wins(backend):
+    one, two = instance(backend), instance(backend)
+    one.update("k", lambda doc: {"a": {"x": 1}})
+    two.update("k", lambda doc: {"a": {"y": 2}})
+    one.flush()
+    two.flush()
+    assert instance(backend).get("k") == {"a": {"y": 2}}
+
+
+def test_removed_section_is_deleted_and_delete_removes_the_key(backend):
+    store = instance(backend)
+    store.update("k", lambda doc: {"a": 1, "b": 2})
+    store.flush()
+    store.update("k", lambda doc: {"a": 1})
+    store.flush()
+    assert instance(backend).get("k") == {"a": 1}
+    store.delete("k")
+    assert store.get("k") is None
+    store.flush()
+    assert instance(backend).get("k") is None
+
+
+def test_cached_reads_pick_up_other_writers_after_the_ttl(backend):
+    reader = instance(backend, cache_ttl=3600)
+    assert reader.get("k") is None
+    writer = instance(backend)
+    writer.update("k", lambda doc: {"a": 1})
+    writer.flush()
+    assert reader.get("k") is None
+    reader.cache_ttl = 0
+    assert reader.get("k") == {"a": 1}
+
+
+def test_unflushed_changes_survive_a_cache_refresh(backend):
+    store = instance(backend)
+    store.update("k", lambda doc: {**doc, "mine": 1})
+    other = instance(backend)
+    other.update("k", lambda doc: {**doc, "theirs": 2})
+    other.flush()
+    assert store.get("k") == {"mine": 1, "theirs": 2}
+
+
+def test_sync_update_runs_against_the_stored_document(backend):
+    one, two = instance(backend), instance(backend)
+    one.update("k", lambda doc: {"claimed": False})
+    one.flush()
+    claims = []
+
+    def claim(doc):
+        claims.append(not doc.get("claimed"))
+        return {**doc, "claimed": True}
+    two.update("k", claim, sync=True)
+    one.update("k", claim, sync=True)
+    assert claims == [True, False]
+
+
+def test_failed_flush_keeps_the_changes_for_the_next_one(backend):
+    store = instance(backend)
+    real = store.backend.apply_many
+    store.backend.apply_many = lambda changes: (_ for _ in ()).throw(OSError("disk full"))
+    store.update("k", lambda doc: {**doc, "a": 1})
+    store.flush()
+    store.update("k", lambda doc: {**doc, "b": 2})
+    store.backend.apply_many = real
+    store.flush()
+    assert instance(backend).get("k") == {"a": 1, "b": 2}
+
+
+def test_bucket_writes_retry_when_another_writer_got_there_first(tmp_path):
+    bucket = LocalBucket(str(tmp_path))
+    backend = ObjectStoreBackend(bucket)
+    store = StateStore(backend, flush_delay=60, cache_ttl=0)
+    store.update("k", lambda doc: {"a": 1})
+    store.flush()
+
+    put = bucket.put
+    raced = []
+
+    def racing_put(name, data, if_generation=None):
+        if not raced:
+            raced.append(1)
+            # Another instance writes between our read and our conditional put
+            put(name, b'{"a": 1, "b": 2}', if_generation=if_generation)
+        return put(name, data, if_generation=if_generation)
+    bucket.put = racing_put
+    store.update("k", lambda doc: {**doc, "c": 3})
+    store.flush()
+    assert backend.read("k") == {"a": 1, "b": 2, "c": 3}
+
+    with pytest.raises(PreconditionFailed):
+        bucket.put(backend._name("k"), b"{}", if_generation="stale")
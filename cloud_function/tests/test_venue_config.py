@@ -0,0 +1,55 @@
+# cloud_function/tests/test_venue_config.py
+
+import json
+import os
+
+import pytest
+
+from venue_config import compile_venues, load_venue_config
+
+
+def venue(venue_id="v", **extra):
+    return {"venue_id": venue_id, "api_username": "u", "api_password": "p", **extra}
+
+
+def test_valid_entries_are_compiled_with_frozen_lists():
+    [compiled] = compile_venues([venue(excluded_gtins=["1", "2"])])
+    assert compiled["excluded_gtins"] == ("1", "2")
+    assert compiled.rules.at().exclude("1", None, None, None)
+
+
+@pytest.mark.parametrize("entry", [
+    "not an object",
+    {"venue_id": "v", "api_username": "u"},
+    venue(api_password=""),
+    venue(excluded_gtins="1"),
+    venue(scheduled_rules={"hours": "08:00-16:00"}),
+    venue(scheduled_rules=[{"hours": "08:00-16:00"}, "08:00-16:00"]),
+])
+def test_bad_entry_is_skipped_and_the_rest_load(entry):
+    venues = compile_venues([venue("a"), entry, venue("b")])
+    assert [v["venue_id"] for v in venues] == ["a", "b"]
+
+
+def test_duplicate_venue_keeps_the_first_entry():
+    venues = compile_venues([venue(excluded_gtins=["1"]), venue(excluded_gtins=["2"])])
+    assert len(venues) == 1 and venues[0]["excluded_gtins"] == ("1",)
+
+
+def test_config_must_be_a_list():
+    with pytest.raises(ValueError):
+        compile_venues({"venue_id": "v"})
+
+
+def test_unchanged_file_is_not_compiled_again(tmp_path):
+    path = tmp_path / "venues.json"
+    path.write_text(json.dumps([venue()]))
+    first = load_venue_config(str(path))
+    assert load_venue_config(str(path)) is first
+
+    # Same content under a new mtime: re-read, but the compiled venues are reused
+    os.utime(path, ns=(1, 1))
+    assert load_venue_config(str(path)) is first
+
+    path.write_text(json.dumps([venue("a"), venue("b")]))
+    assert [v["venue_id"] for v in load_venue_config(str(path))] == ["a", "b"]
@@ -0,0 +1,94 @@
+# cloud_function/tests/test_wolt_batches.py
+
+import json
+
+import pytest
+
+import wolt_client
+from fake_wolt import FakeClient, items
+from wolt_client import chunk_items, send_item_batches, summarize_batches
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(wolt_client.time, "sleep", lambda seconds: None)
+
+
+def body_size(chunk):
+    # What requests sends for json={"data": chunk}
+    return len(json.dumps({"data": chunk}).encode("utf-8"))
+
+
+def test_chunks_cap_item_count():
+    chunks = chunk_items(items(1201), max_items=500, max_bytes=10 ** 9)
+    assert [len(chunk) for chunk in chunks] == [500, 500, 201]
+
+
+@pytest.mark.parametrize("max_bytes", [200, 1000, 4096])
+def test_chunks_cap_body_bytes_exactly(max_bytes):
+    payload = items(300)
+    chunks = chunk_items(payload, max_items=10 ** 6, max_bytes=max_bytes)
+    assert [item for chunk in chunks for item in chunk] == payload
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert body_size(chunk) <= max_bytes
+        # Chunks are full: the next item would not have fit
+        assert body_size(chunk + following[:1]) > max_bytes
+    assert body_size(chunks[-1]) <= max_bytes
+
+
+def test_chunk_sizes_count_utf8_bytes():
+    payload = [{"sku": "ø" * 50, "in_stock": True}] * 10
+    for chunk in chunk_items(payload, max_items=100, max_bytes=600):
+        assert body_size(chunk) <= 600
+
+
+def test_oversized_item_gets_its_own_chunk():
+    payload = items(2) + [{"gtin": "x" * 500}] + items(2, start=2)
+    chunks = chunk_items(payload, max_items=100, max_bytes=300)
+    assert [{"gtin": "x" * 500}] in chunks
+    assert [item for chunk in chunks for item in chunk] == payload
+
+
+def test_no_items_no_requests():
+    client = FakeClient()
+    assert send_item_batches(client, "v", []) == []
+    assert client.calls == []
+
+
+def test_parallel_chunks_send_every_item_once_in_order():
+    client = FakeClient()
+    payload = items(95)
+    results = send_item_batches(client, "v", payload, max_items=10, workers=4)
+    assert [r["chunk"] for r in results] == list(range(10))
+    sent = sorted(item["gtin"] for _, data in client.calls for item in data)
+    assert sent == sorted(item["gtin"] for item in payload)
+    assert {url for url, _ in client.calls} == {"/venues/v/items"}
+    assert summarize_batches(results) == (95, 95, [])
+
+
+def test_server_errors_are_retried():
+    client = FakeClient(statuses=[503, 502])
+    [result] = send_item_batches(client, "v", items(3), retries=2)
+    assert result["ok"] and result["attempts"] == 3
+    assert len(client.calls) == 3
+
+
+def test_retries_give_up_with_the_last_status():
+    client = FakeClient(statuses=[503, 503, 503])
+    [result] = send_item_batches(client, "v", items(3), retries=2)
+    assert (result["ok"], result["status"], result["attempts"], result["applied"]) == (False, 503, 3, 0)
+    assert summarize_batches([result]) == (0, 3, [result])
+
+
+def test_client_errors_are_not_retried():
+    client = FakeClient(statuses=[401])
+    [result] = send_item_batches(client, "v", items(3), retries=2)
+    assert (result["status"], result["attempts"]) == (401, 1)
+
+
+def test_partial_failure_is_summarized_per_chunk():
+    client = FakeClient(bad=["7000000000012"])
+    results = send_item_batches(client, "v", items(20), max_items=10, workers=2, bisect=False)
+    sent, total, failed = summarize_batches(results)
+    assert (sent, total) == (10, 20)
+    assert [r["chunk"] for r in failed] == [1]
@@ -0,0 +1,117 @@
+# cloud_function/tests/test_wolt_bisect.py
+
+import pytest
+
+import wolt_client
+from fake_wolt import FakeClient, items
+from wolt_client import bisect_budget, poison_keys, send_item_batches, send_item_chunk
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(wolt_client.time, "sleep", lambda seconds: None)
+
+
+def gtin(i):
+    return str(7000000000000 + i)
+
+
+def test_budget_grows_with_log2_of_the_chunk():
+    assert bisect_budget(1, 4) == bisect_budget(2, 4) == 8
+    assert bisect_budget(16, 4) == 32
+    assert bisect_budget(17, 4) == 40
+    assert bisect_budget(500, 1) == 18
+
+
+def test_one_bad_item_costs_two_requests_per_level():
+    client = FakeClient(bad=[gtin(0)])
+    result = send_item_chunk(client, "v", 0, items(16))
+    assert result["rejected"] == [items(1)[0]]
+    assert result["applied"] == 15 and not result["ok"]
+    # 16 → 8 → 4 → 2 → 1: both halves at each of log2(16) levels
+    assert result["bisect_requests"] == 8
+    assert len(client.calls) == 1 + 8
+
+
+@pytest.mark.parametrize("bad", [[3], [0, 15], [1, 6, 9], [2, 5, 11, 14]])
+def test_bad_items_are_isolated_within_budget(bad):
+    client = FakeClient(bad=[gtin(i) for i in bad])
+    result = send_item_chunk(client, "v", 0, items(16))
+    assert sorted(item["gtin"] for item in result["rejected"]) == [gtin(i) for i in bad]
+    assert result["applied"] == 16 - len(bad)
+    assert "unresolved" not in result
+    assert result["bisect_requests"] <= bisect_budget(16)
+    assert len(client.calls) == 1 + result["bisect_requests"]
+
+
+def test_every_good_item_is_applied_exactly_once():
+    client = FakeClient(bad=[gtin(4), gtin(9)])
+    send_item_chunk(client, "v", 0, items(12))
+    applied = [item["gtin"] for _, data in client.calls[1:] for item in data
+               if not {gtin(4), gtin(9)} & {i["gtin"] for i in data}]
+    assert sorted(applied) == sorted(gtin(i) for i in range(12) if i not in (4, 9))
+
+
+def test_venue_level_rejection_stops_after_the_probe():
+    client = FakeClient(reject_all=True)
+    result = send_item_chunk(client, "v", 0, items(64))
+    assert result["venue_rejected"]
+    assert "rejected" not in result and result["applied"] == 0
+    # The chunk, both halves and one single item from each
+    assert len(client.calls) == 5 and result["bisect_requests"] == 4
+    assert [len(data) for _, data in client.calls] == [64, 32, 32, 1, 1]
+
+
+def test_a_bad_first_item_is_not_mistaken_for_a_venue_rejection():
+    client = FakeClient(bad=[gtin(0), gtin(12)])
+    result = send_item_chunk(client, "v", 0, items(16))
+    # Both halves and the first half's probe are rejected; the second probe goes through
+    assert not result.get("venue_rejected")
+    assert sorted(item["gtin"] for item in result["rejected"]) == [gtin(0), gtin(12)]
+    assert result["applied"] == 14
+
+
+def test_two_item_chunk_is_bisected_without_probes():
+    client = FakeClient(reject_all=True)
+    result = send_item_chunk(client, "v", 0, items(2))
+    assert not result.get("venue_rejected")
+    assert len(result["rejected"]) == 2 and len(client.calls) == 3
+
+
+def test_spent_budget_leaves_items_unresolved(monkeypatch):
+    monkeypatch.setattr(wolt_client, "bisect_budget", lambda n: 6)
+    client = FakeClient(bad=[gtin(i) for i in range(0, 32, 3)])
+    result = send_item_chunk(client, "v", 0, items(32))
+    assert result["bisect_requests"] <= 6
+    assert result["unresolved"] > 0
+    assert result["applied"] + len(result.get("rejected", [])) + result["unresolved"] == 32
+
+
+def test_retried_server_errors_count_against_the_budget():
+    client = FakeClient(bad=[gtin(0)], statuses=[400, 503])
+    result = send_item_chunk(client, "v", 0, items(4), retries=1)
+    # The first half got a 503 then its 400; the second half went through
+    assert result["rejected"] == [items(1)[0]]
+    assert result["bisect_requests"] == len(client.calls) - 1
+
+
+def test_no_bisect_for_statuses_items_cannot_cause():
+    client = FakeClient(statuses=[401])
+    result = send_item_chunk(client, "v", 0, items(8))
+    assert "bisect_requests" not in result and len(client.calls) == 1
+
+
+def test_rejected_items_are_poison_only_when_the_venue_took_others():
+    client = FakeClient(bad=[gtin(0)])
+    results = send_item_batches(client, "v", items(1) + items(3, start=1), max_items=1, workers=1)
+    assert poison_keys(results) == [f"gtin:{gtin(0)}"]
+
+    lone = send_item_batches(FakeClient(bad=[gtin(0)]), "v", items(1))
+    assert poison_keys(lone) == []
+    assert lone[0]["rejected"] == items(1)
+
+
+def test_venue_rejection_is_never_poison():
+    results = send_item_batches(FakeClient(reject_all=True), "v", items(20), max_items=10, workers=1)
+    assert all(r["venue_rejected"] for r in results)
+    assert poison_keys(results) == []
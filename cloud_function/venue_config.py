@@ -0,0 +1,92 @@
+# cloud_function/venue_config.py
+
+import hashlib
+import json
+import os
+import threading
+
+from filter_rules import FILTER_KEYS, SCHEDULE_KEY, get_venue_rules
+
+REQUIRED_FIELDS = ("venue_id", "api_username", "api_password")
+
+
+class Venue(dict):
+    """
+    A validated venue config entry. Still a plain dict to the rest of the code,
+    with list fields frozen to tuples (entries are shared between warm
+    invocations), plus the venue's compiled filter rules.
+    """
+
+    __slots__ = ("rules",)
+
+    def __init__(self, entry):
+        super().__init__({key: tuple(value) if isinstance(value, list) else value
+                          for key, value in entry.items()})
+        self.rules = get_venue_rules(self)
+
+
+def validate_venue(entry, position):
+    """Returns a Venue, or None (with a warning) for an unusable entry."""
+    if not isinstance(entry, dict):
+        print(f"⚠️ Skipping venue #{position}: not an object")
+        return None
+    missing = [field for field in REQUIRED_FIELDS if not isinstance(entry.get(field), str) or not entry[field]]
+    if missing:
+        print(f"⚠️ Skipping venue #{position} ({entry.get('venue_id', 'no venue_id')}): missing {', '.join(missing)}")
+        return None
+    bad = [key for key in FILTER_KEYS if not isinstance(entry.get(key, []), list)]
+    if bad:
+        print(f"[{entry['venue_id']}] ⚠️ Skipping venue: {', '.join(bad)} must be a list")
+        return None
+    rules = entry.get(SCHEDULE_KEY, [])
+    if not isinstance(rules, list) or not all(isinstance(rule, dict) for rule in rules):
+        print(f"[{entry['venue_id']}] ⚠️ Skipping venue: {SCHEDULE_KEY} must be a list of objects")
+        return None
+    return Venue(entry)
+
+
+def compile_venues(raw):
+    if not isinstance(raw, list):
+        raise ValueError("expected a list of venues")
+    venues = []
+    seen = set()
+    for position, entry in enumerate(raw, 1):
+        venue = validate_venue(entry, position)
+        if venue is None:
+            continue
+        if venue["venue_id"] in seen:
+            print(f"[{venue['venue_id']}] ⚠️ Duplicate venue entry #{position} ignored")
+            continue
+        seen.add(venue["venue_id"])
+        venues.append(venue)
+    return tuple(venues)
+
+
+# ─────────────────────────────────────────────────────
+# Per-file cache: a file is only re-read when its mtime/size change, and only
+# re-parsed when its content hash changes too
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_venue_config(config_name):
+    """Compiled venues for a config file (a tuple of Venue). Raises if it can't be loaded."""
+    path = os.path.abspath(config_name)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached and cached["signature"] == signature:
+        return cached["venues"]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if cached and cached["digest"] == digest:
+        venues = cached["venues"]
+    else:
+        venues = compile_venues(json.loads(data.decode("utf-8")))
+        print(f"📒 Loaded {len(venues)} venues from {config_name}")
+    with _cache_lock:
+        _cache[path] = {"signature": signature, "digest": digest, "venues": venues}
+    return venues
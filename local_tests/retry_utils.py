@@ -1,6 +1,12 @@
 import os
+import sys
 import json
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cloud_function"))
+
+import latency_model  # noqa: E402  (cloud_function/latency_model.py)
+
 RETRY_CONFIG_PATH = "/tmp/retry_delay_config.json"
 DEFAULT_WAIT = 15
 
@@ -20,17 +26,22 @@ def save_retry_config(config):
     except Exception as e:
         print(f"⚠️ Could not save retry config: {e}")
 
-def get_wait_time(venue_id):
-    config = load_retry_config()
-    return config.get(venue_id, DEFAULT_WAIT)
+def get_latency_record(venue_id):
+    return latency_model.coerce_record(load_retry_config().get(venue_id))
 
-def increase_wait_time(venue_id):
+def update_latency_record(venue_id, update):
     config = load_retry_config()
-    config[venue_id] = config.get(venue_id, DEFAULT_WAIT) + 5
+    config[venue_id] = update(latency_model.coerce_record(config.get(venue_id)))
     save_retry_config(config)
 
-def reset_wait_time(venue_id):
-    config = load_retry_config()
-    if venue_id in config:
-        del config[venue_id]
-        save_retry_config(config)
+def get_wait_time(venue_id):
+    return latency_model.first_poll_delay(get_latency_record(venue_id), DEFAULT_WAIT)
+
+def get_poll_delay(venue_id, attempt):
+    return latency_model.next_poll_delay(get_latency_record(venue_id), attempt)
+
+def record_export_ready(venue_id, lower, upper):
+    update_latency_record(venue_id, lambda r: latency_model.record_ready(r, lower, upper))
+
+def record_export_timeout(venue_id, elapsed):
+    update_latency_record(venue_id, lambda r: latency_model.record_timeout(r, elapsed))
@@ -1,10 +1,18 @@
+import os
+import sys
 import time
 import json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cloud_function"))
+
 from config_loader import load_venues
-from retry_utils import get_wait_time, reset_wait_time, increase_wait_time
 from menu_fetcher import fetch_menu
-from sold_out_extractor import get_sold_out_items, get_menu_items
+from sold_out_extractor import get_menu_items
 from restock_handler import restock
+# Selection shared with the Cloud Function (cloud_function/menu_index.py, filter_rules.py)
+from filter_rules import get_venue_rules
+from menu_index import MenuIndex, select_restock_items
 
 
 class MockRequest:
@@ -22,32 +30,14 @@ def reset_sold_out_items(request):
 
     for venue in venues:
         venue_id = venue.get("venue_id", "unknown")
-        excluded_gtins = set(venue.get("excluded_gtins", []))
-        excluded_skus = set(venue.get("excluded_skus", []))
-        included_gtins = set(venue.get("included_gtins", []))
-        included_skus = set(venue.get("included_skus", []))
 
-        menu = fetch_menu(venue, get_wait_time, increase_wait_time, reset_wait_time)
+        menu = fetch_menu(venue)
         if not menu:
             results[venue_id] = "❌ Failed to fetch menu"
             continue
 
-        if included_skus or included_gtins:
-            menu_items = get_menu_items(menu)
-            sold_out_items = []
-            for item in menu_items:
-                product = item.get("product", {})
-                sku = product.get("sku")
-                gtin = product.get("gtin")
-                inventory_mode = item.get("inventory_mode")
-                availability = item.get("availability")
-
-                if sku in included_skus and (availability == "SOLD_OUT" or inventory_mode == "FORCED_OUT_OF_STOCK"):
-                    sold_out_items.append({"type": "sku", "id": sku})
-                elif gtin in included_gtins and (availability == "SOLD_OUT" or inventory_mode == "FORCED_OUT_OF_STOCK"):
-                    sold_out_items.append({"type": "gtin", "id": gtin})
-        else:
-            sold_out_items = get_sold_out_items(menu, excluded_gtins, excluded_skus)
+        index = MenuIndex.from_items(get_menu_items(menu), venue_id)
+        sold_out_items = select_restock_items(index, rules=get_venue_rules(venue).at())
 
         if sold_out_items:
             print(f"[{venue_id}] 🔁 Restocking {len(sold_out_items)} items: {', '.join(item['id'] for item in sold_out_items)}")
@@ -9,7 +9,6 @@ import time
 from pathlib import Path
 from io import BytesIO
 
-import requests
 import pandas as pd
 from flask import jsonify, Request
 from google.auth.transport.requests import Request as GoogleRequest
@@ -18,10 +17,22 @@ from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 from googleapiclient.errors import HttpError
 
+import metrics
+import profiling
+from menu_index import MENU_INDEX_DIR, load_menu_index
+from wolt_client import (
+    connection_stats, get_client, log_connection_stats, poison_keys, prune_quarantine,
+    send_item_batches, summarize_batches
+)
+
 # --- Config ---
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 TMP_DIR = Path("/tmp")
 CONFIG_PATH = Path("config/venues.json")
+QUARANTINE_PATH = Path(os.environ.get("QUARANTINE_PATH", "/tmp/price_quarantine.json"))
+QUARANTINE_TTL = float(os.environ.get("QUARANTINE_TTL_DAYS", "14")) * 86400
+# A MenuIndex saved longer ago than this isn't trusted to say what's on the menu
+MENU_INDEX_MAX_AGE = float(os.environ.get("MENU_INDEX_MAX_AGE_H", "24")) * 3600
 
 # --- Gmail Authentication ---
 def authenticate_gmail():
@@ -116,6 +127,36 @@ def fetch_and_clean_from_gmail():
     print(f"📥 Total files prepared: {len(cleaned_files)}")
     return cleaned_files
 
+# --- Quarantine (items a venue rejected individually, skipped for that venue until TTL) ---
+def load_quarantine():
+    """{venue_id: {"gtin:<id>": quarantined_at}}"""
+    try:
+        with open(QUARANTINE_PATH) as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"⚠️ Could not read quarantine list: {e}")
+        return {}
+    # Entries from before the list was kept per venue can't be attributed; drop them
+    return {venue_id: prune_quarantine(keys, QUARANTINE_TTL)
+            for venue_id, keys in entries.items() if isinstance(keys, dict)}
+
+def save_quarantine(entries):
+    try:
+        tmp_path = QUARANTINE_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, QUARANTINE_PATH)
+    except Exception as e:
+        print(f"⚠️ Could not save quarantine list: {e}")
+
+def quarantine_items(venue_id, keys):
+    entries = load_quarantine()
+    now = time.time()
+    entries.setdefault(venue_id, {}).update({key: now for key in keys})
+    save_quarantine(entries)
+
 # --- Load Price Updates ---
 def load_all_price_updates(csv_files):
     all_items = {}
@@ -137,54 +178,99 @@ def load_all_price_updates(csv_files):
     return item_list
 
 # --- Update Venue ---
+_menu_filter_inactive = set()
+
+def log_menu_filter_inactive(venue):
+    """Says once per process (and venue) why items aren't filtered to the menu."""
+    if not os.path.isdir(MENU_INDEX_DIR):
+        key, message = None, (f"ℹ️ Menu filter inactive: MENU_INDEX_DIR {MENU_INDEX_DIR} doesn't exist "
+                              f"(mount the restock function's menu index storage there)")
+    else:
+        key, message = venue["id"], f"ℹ️ {venue['name']}: no recent menu index, not filtering to the menu"
+    if key in _menu_filter_inactive or None in _menu_filter_inactive:
+        return
+    _menu_filter_inactive.add(key)
+    print(message)
+
+def filter_to_menu(venue, items):
+    """
+    (items on the menu, GTINs dropped) using the venue's MenuIndex
+    (MENU_INDEX_DIR, which must be storage shared with the restock function).
+    Without an index saved in the last MENU_INDEX_MAX_AGE nothing is dropped.
+    """
+    index = load_menu_index(venue["id"], max_age=MENU_INDEX_MAX_AGE)
+    if index is None:
+        log_menu_filter_inactive(venue)
+        return items, []
+    on_menu = [item for item in items if index.contains(item["gtin"])]
+    dropped = [item["gtin"] for item in items if not index.contains(item["gtin"])]
+    if dropped:
+        print(f"⏭️ {venue['name']}: skipping {len(dropped)} item(s) not on the menu: {', '.join(dropped)}")
+    return on_menu, dropped
+
 def update_venue(venue, items):
-    url = f"https://pos-integration-service.wolt.com/venues/{venue['id']}/items"
-    payload = {"data": items}
+    client = get_client(venue["username"], venue["password"])
+    items, not_on_menu = filter_to_menu(venue, items)
+    quarantined = set(load_quarantine().get(venue["id"], {}))
+    skipped = [item["gtin"] for item in items if f"gtin:{item['gtin']}" in quarantined]
+    if skipped:
+        print(f"🚧 {venue['name']}: skipping quarantined GTINs {', '.join(skipped)}")
+        items = [item for item in items if f"gtin:{item['gtin']}" not in quarantined]
     print(f"📡 Updating {venue['name']} ({venue['id']}) with {len(items)} items...")
 
     for i, item in enumerate(items, 1):
         print(f"   🔢 {i}. GTIN: {item['gtin']} → {item['price']} cents")
 
-    try:
-        response = requests.patch(
-            url,
-            auth=(venue["username"], venue["password"]),
-            headers={"Content-Type": "application/json"},
-            json=payload
-        )
-        if response.status_code == 202:
-            print(f"✅ Successfully updated {len(items)} items at {venue['name']}")
-        elif response.status_code == 429:
-            print(f"🔁 Rate limited (429) by Wolt for {venue['name']}")
+    with metrics.span("update_venue", venue["id"], items=len(items),
+                      bytes=len(json.dumps({"data": items}).encode("utf-8"))) as span:
+        chunks = send_item_batches(client, venue["id"], items)
+        span.update(chunks=len(chunks), statuses=[chunk["status"] for chunk in chunks])
+    for chunk in chunks:
+        metrics.count("http_responses", phase="update_venue", venue=venue["id"], code=str(chunk["status"]))
+    sent, total, failed = summarize_batches(chunks)
+    poison = poison_keys(chunks)
+    if poison:
+        print(f"🚧 Quarantining items rejected by {venue['name']}: {', '.join(poison)}")
+        quarantine_items(venue["id"], poison)
+    for chunk in failed:
+        if chunk["status"] == 429:
+            print(f"🔁 Still rate limited (429) by Wolt for {venue['name']} (chunk {chunk['chunk']}) after retries")
+        elif chunk["status"] is None:
+            print(f"🚨 Network error with {venue['name']} (chunk {chunk['chunk']}): {chunk.get('error')}")
         else:
-            print(f"❌ Failed update for {venue['name']}: {response.status_code} — {response.text}")
-    except Exception as e:
-        print(f"🚨 Network error with {venue['name']}: {e}")
+            print(f"❌ Failed update for {venue['name']} (chunk {chunk['chunk']}): {chunk['status']} — {chunk.get('error')}")
+    if sent:
+        print(f"✅ Successfully updated {sent}/{total} items at {venue['name']} in {len(chunks)} chunk(s)")
+    return {"updated": sent, "total": total, "chunks": chunks, "quarantined": poison,
+            "skipped_quarantined": skipped, "skipped_not_on_menu": not_on_menu}
 
 
 # --- Core Logic ---
 def run_update_process():
+    """Returns {venue_id: update summary with per-chunk results}."""
     print("⚙️ Starting update process...")
+    results = {}
     try:
         with open(CONFIG_PATH) as f:
             config = json.load(f)
         venues = config["venues"]
     except Exception as e:
         print("❌ Failed to load config:", e)
-        return
+        return results
 
     try:
         relevant_files = fetch_and_clean_from_gmail()
         if not relevant_files:
             print("⚠️ No relevant CSVs found.")
-            return
+            return results
 
         items = load_all_price_updates(relevant_files)
         if not items:
             print("⚠️ No valid items found.")
-            return
+            return results
 
         print(f"🏪 Loaded {len(venues)} venues from config.")
+        http_before = connection_stats()
         for venue in venues:
             venue_name = venue.get("name", "Unnamed Venue")
             venue_id = venue.get("id")
@@ -192,21 +278,36 @@ def run_update_process():
                 print(f"⚠️ Skipping venue '{venue_name}' — missing credentials.")
                 continue
             print(f"➡️ Processing venue: {venue_name} ({venue_id})")
-            update_venue(venue, items)
-            time.sleep(1)
+            results[venue_id] = update_venue(venue, items)
 
+        log_connection_stats(http_before)
+        metrics.write_metrics_file()
         print(f"🎯 Update process completed for {len(venues)} venue(s).")
     except Exception as e:
         print("❌ Unexpected error in run_update_process():", e)
         import traceback
         print(traceback.format_exc())
+    return results
 
 # --- HTTP Entry Point ---
 def main(request: Request):
+    if request.args.get("metrics") == "1":
+        return metrics.render_openmetrics(), 200, {"Content-Type": metrics.CONTENT_TYPE}
     print("🚀 Function triggered at", datetime.datetime.utcnow().isoformat())
     try:
-        run_update_process()
-        return jsonify({"status": "success"}), 200
+        # ?profile=1 or PROFILE=1: the report goes to the logs as one JSON record
+        # (no snapshot store here), and with ?profile=1 into the response too
+        if profiling.profiling_requested(request):
+            results, report = profiling.profile_call(run_update_process)
+        else:
+            results, report = run_update_process(), None
+        payload = {"status": "success", "venues": results}
+        if report:
+            profiling.log_report(report, "price update")
+            print(json.dumps({"severity": "INFO", "message": "profile main", "profile": report}))
+            if request.args.get("profile") == "1":
+                payload["profile"] = report
+        return jsonify(payload), 200
     except Exception as e:
         import traceback
         print("🔥 Unhandled error in main():", e)
@@ -0,0 +1,143 @@
+# Copied from cloud_function/metrics.py by price_update_tests/sync_shared.py; edit the original.
+# metrics.py
+# Per-phase instrumentation: monotonic spans per venue, kept as latency
+# histograms and counters for the life of the process (a warm instance) and
+# logged as structured JSON records. Also used by the price updater
+# (price_update_tests/sync_shared.py copies it there).
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# One JSON line per span on stdout (Cloud Logging parses them as jsonPayload)
+STRUCTURED_LOGS = os.environ.get("METRICS_LOG", "1") == "1"
+# Written after every run in OpenMetrics text format when set (textfile-collector style)
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_PREFIX = os.environ.get("METRICS_PREFIX", "wolt")
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_lock = threading.Lock()
+_histograms = {}  # (phase, venue_id) -> {"buckets": [count per bound], "count", "sum"}
+_counters = {}    # (name, labels as sorted tuple) -> value
+
+
+def observe(phase, venue_id, seconds, **fields):
+    """
+    Records one timed phase. status (HTTP code) and bytes fields also feed the
+    http_responses and payload_bytes counters; every field goes into the log record.
+    """
+    with _lock:
+        histogram = _histograms.get((phase, venue_id))
+        if histogram is None:
+            histogram = _histograms[(phase, venue_id)] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+    if fields.get("status") is not None:
+        count("http_responses", phase=phase, venue=venue_id, code=str(fields["status"]))
+    if fields.get("bytes"):
+        count("payload_bytes", fields["bytes"], phase=phase, venue=venue_id)
+    if STRUCTURED_LOGS:
+        record = {"severity": "ERROR" if fields.get("error") else "INFO", "message": f"phase {phase}",
+                  "phase": phase, "venue_id": venue_id, "duration_ms": round(seconds * 1000, 3), **fields}
+        # One write per record so lines from concurrent venues don't interleave
+        print(json.dumps(record, ensure_ascii=False, default=str) + "\n", end="")
+
+
+@contextmanager
+def span(phase, venue_id, **fields):
+    """
+    Times the block with time.monotonic(). Yields the span's fields dict so
+    the block can add results (status, bytes, items, ...); an exception is
+    recorded as the error field and re-raised.
+    """
+    start = time.monotonic()
+    try:
+        yield fields
+    except Exception as e:
+        fields.setdefault("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        observe(phase, venue_id, time.monotonic() - start, **fields)
+
+
+def count(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def summary():
+    """{phase: {venue_id: {"count", "sum", "mean"}}} in seconds, for JSON responses."""
+    with _lock:
+        histograms = [(key, dict(h)) for key, h in _histograms.items()]
+    phases = {}
+    for (phase, venue_id), h in sorted(histograms):
+        phases.setdefault(phase, {})[venue_id] = {
+            "count": h["count"], "sum": round(h["sum"], 3), "mean": round(h["sum"] / h["count"], 3),
+        }
+    return phases
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# ─────────────────────────────────────────────────────
+# OpenMetrics text exposition
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_openmetrics(prefix=METRICS_PREFIX):
+    with _lock:
+        histograms = sorted((key, {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]})
+                            for key, h in _histograms.items())
+        counters = sorted(_counters.items())
+
+    name = f"{prefix}_phase_seconds"
+    lines = [f"# TYPE {name} histogram", f"# UNIT {name} seconds",
+             f"# HELP {name} Time spent per phase and venue."]
+    for (phase, venue_id), h in histograms:
+        labels = [("phase", phase), ("venue", venue_id)]
+        for bound, bucket_count in zip(BUCKETS, h["buckets"]):
+            lines.append(f"{name}_bucket{_labels(labels + [('le', _number(float(bound)))])} {bucket_count}")
+        lines.append(f"{name}_bucket{_labels(labels + [('le', '+Inf')])} {h['count']}")
+        lines.append(f"{name}_count{_labels(labels)} {h['count']}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(float(h['sum']))}")
+
+    declared = set()
+    for (counter, labels), value in counters:
+        name = f"{prefix}_{counter}"
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}_total{_labels(labels)} {_number(value)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=METRICS_FILE):
+    if not path:
+        return
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(render_openmetrics())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Could not write metrics to {path}: {e}")
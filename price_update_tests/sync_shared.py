@@ -0,0 +1,57 @@
+# price_update_tests/sync_shared.py
+#
+# The price updater deploys only its own directory, so the modules it shares
+# with the restock function are copied here from cloud_function/ (the one
+# source). Run before deploying; --check exits 1 when a copy has drifted.
+#
+#   python price_update_tests/sync_shared.py [--check]
+
+import argparse
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(HERE), "cloud_function")
+SHARED = ("wolt_client.py", "metrics.py", "profiling.py", "menu_index.py")
+BANNER = "# Copied from cloud_function/{name} by price_update_tests/sync_shared.py; edit the original.\n"
+
+
+def expected_copy(name):
+    with open(os.path.join(SOURCE_DIR, name), encoding="utf-8") as f:
+        return BANNER.format(name=name) + f.read()
+
+
+def current_copy(name):
+    try:
+        with open(os.path.join(HERE, name), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def stale_copies():
+    return [name for name in SHARED if current_copy(name) != expected_copy(name)]
+
+
+def sync():
+    for name in stale_copies():
+        with open(os.path.join(HERE, name), "w", encoding="utf-8") as f:
+            f.write(expected_copy(name))
+        print(f"🔄 Copied cloud_function/{name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the shared modules from cloud_function/")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ from cloud_function/")
+    args = parser.parse_args()
+    if not args.check:
+        sync()
+        return 0
+    stale = stale_copies()
+    for name in stale:
+        print(f"❌ price_update_tests/{name} differs from cloud_function/{name}; run sync_shared.py")
+    return 1 if stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
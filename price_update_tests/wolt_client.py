@@ -0,0 +1,415 @@
+# Copied from cloud_function/wolt_client.py by price_update_tests/sync_shared.py; edit the original.
+# wolt_client.py
+# Shared Wolt POS API client, also used by the price updater
+# (price_update_tests/sync_shared.py copies it there).
+
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WOLT_BASE_URL = "https://pos-integration-service.wolt.com"
+CONNECT_TIMEOUT = float(os.environ.get("WOLT_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("WOLT_READ_TIMEOUT", "60"))
+POOL_SIZE = int(os.environ.get("WOLT_POOL_SIZE", "16"))
+# Token buckets in front of every Wolt API call: one shared, one per API user
+GLOBAL_RATE = float(os.environ.get("WOLT_RATE_PER_SEC", "10"))
+GLOBAL_BURST = float(os.environ.get("WOLT_RATE_BURST", "20"))
+USER_RATE = float(os.environ.get("WOLT_USER_RATE_PER_SEC", "2"))
+USER_BURST = float(os.environ.get("WOLT_USER_RATE_BURST", "5"))
+MAX_THROTTLE_RETRIES = int(os.environ.get("WOLT_MAX_429_RETRIES", "4"))
+MAX_RETRY_AFTER = 120
+# PATCH /venues/{id}/items batching
+BATCH_MAX_ITEMS = int(os.environ.get("WOLT_BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_BYTES = int(os.environ.get("WOLT_BATCH_MAX_BYTES", str(256 * 1024)))
+BATCH_WORKERS = int(os.environ.get("WOLT_BATCH_WORKERS", "4"))
+BATCH_RETRIES = int(os.environ.get("WOLT_BATCH_RETRIES", "2"))
+# Rejections that may come from individual bad items; these get bisected
+BISECT_STATUSES = {400, 422}
+# Bad items a chunk's bisect budget is sized for (see bisect_budget)
+BISECT_MAX_POISON = int(os.environ.get("WOLT_BISECT_MAX_POISON", "4"))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller back for seconds, e.g. after a 429 Retry-After."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RateLimiter:
+    def __init__(self, rate=GLOBAL_RATE, burst=GLOBAL_BURST, key_rate=USER_RATE, key_burst=USER_BURST):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.key_rate, self.key_burst)
+            return bucket
+
+    def acquire(self, key):
+        # Per-key first so a throttled credential doesn't sit on a global token
+        self.bucket(key).acquire()
+        self.global_bucket.acquire()
+
+    def throttled(self, key, seconds):
+        self.bucket(key).pause(seconds)
+
+
+def retry_after_seconds(header, attempt):
+    """Seconds from a Retry-After header (delta or HTTP date), else exponential backoff."""
+    if header:
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(header)))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(header)
+            return min(MAX_RETRY_AFTER, max(0.0, (when - datetime.now(timezone.utc)).total_seconds()))
+        except (TypeError, ValueError):
+            pass
+    return min(MAX_RETRY_AFTER, 2 ** attempt)
+
+
+rate_limiter = RateLimiter()
+
+
+class WoltClient:
+    """
+    Keep-alive session for one set of credentials. Sessions are pooled per
+    host, so repeated calls reuse the TCP+TLS connection instead of paying a
+    new handshake each time. Calls to the Wolt API pass through the shared
+    rate limiter and are retried on 429.
+    """
+
+    def __init__(self, auth=None, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 limiter=None):
+        self.timeout = timeout
+        self.limiter = limiter or rate_limiter
+        self.key = auth[0] if auth else None
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method, url, **kwargs):
+        if not url.startswith("http"):
+            url = WOLT_BASE_URL + url
+        kwargs.setdefault("timeout", self.timeout)
+        if not url.startswith(WOLT_BASE_URL):
+            return self.session.request(method, url, **kwargs)
+
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            self.limiter.acquire(self.key)
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429 or attempt == MAX_THROTTLE_RETRIES:
+                return response
+            delay = retry_after_seconds(response.headers.get("Retry-After"), attempt)
+            print(f"🔁 Rate limited (429) on {method} {url}, retrying in {delay:.1f}s")
+            self.limiter.throttled(self.key, delay)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def stats(self):
+        requests_sent = 0
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections}
+
+
+# ─────────────────────────────────────────────────────
+# Batched item updates
+def chunk_items(items, max_items=BATCH_MAX_ITEMS, max_bytes=BATCH_MAX_BYTES):
+    """Split items into chunks capped by item count and serialized body size."""
+    # Sizes match requests' json= encoding (default separators)
+    envelope = len('{"data": []}')
+    chunks = []
+    current = []
+    size = envelope
+    for item in items:
+        item_size = len(json.dumps(item).encode("utf-8"))
+        # Every item after the first is preceded by ", "
+        if current and (len(current) >= max_items or size + 2 + item_size > max_bytes):
+            chunks.append(current)
+            current = []
+            size = envelope
+        current.append(item)
+        size += item_size + (2 if len(current) > 1 else 0)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _patch_items(client, venue_id, items, retries):
+    """PATCH items, retrying network errors and 5xx. Returns (status, error, attempts)."""
+    status, error = None, None
+    for attempt in range(retries + 1):
+        try:
+            response = client.patch(f"/venues/{venue_id}/items", json={"data": items})
+        except requests.RequestException as e:
+            status, error = None, str(e)
+        else:
+            status = response.status_code
+            if status == 202:
+                return status, None, attempt + 1
+            error = response.text[:300]
+            if 400 <= status < 500:
+                # Client errors won't fix themselves (429 is retried inside the client)
+                return status, error, attempt + 1
+        if attempt < retries:
+            time.sleep(2 ** attempt)
+    return status, error, retries + 1
+
+
+def bisect_budget(n_items, max_poison=BISECT_MAX_POISON):
+    """Extra PATCHes allowed to isolate up to max_poison bad items in a chunk of n_items."""
+    return 2 * max(1, math.ceil(math.log2(max(n_items, 2)))) * max_poison
+
+
+def _try_items(client, venue_id, items, retries, budget):
+    """PATCH items if the bisect budget allows it; None when the budget is spent."""
+    if budget["left"] <= 0:
+        return None
+    status, _, attempts = _patch_items(client, venue_id, items, retries)
+    budget["left"] -= attempts
+    budget["requests"] += attempts
+    return status
+
+
+def _resolve(client, venue_id, items, retries, budget, outcome):
+    """Send items; bisect them if Wolt rejects them. Sorts items into outcome's lists."""
+    status = _try_items(client, venue_id, items, retries, budget)
+    if status == 202:
+        outcome["applied"].extend(items)
+    elif status in BISECT_STATUSES:
+        _bisect(client, venue_id, items, retries, budget, outcome)
+    else:
+        outcome["unresolved"].extend(items)
+
+
+def _bisect(client, venue_id, items, retries, budget, outcome):
+    """items were rejected together: halve them until the rejected items stand alone."""
+    if len(items) == 1:
+        outcome["rejected"].extend(items)
+        return
+    mid = len(items) // 2
+    for half in (items[:mid], items[mid:]):
+        _resolve(client, venue_id, half, retries, budget, outcome)
+
+
+def send_item_chunk(client, venue_id, index, chunk, retries=BATCH_RETRIES, bisect=True):
+    """
+    PATCH one chunk; a 400/422 splits the chunk to find the items Wolt rejects.
+    Rejected items come back as "rejected": whether they are quarantined is
+    decided per venue in send_item_batches. When both halves and a single item
+    from each are rejected too, the venue rejects everything ("venue_rejected")
+    and nothing is bisected further. Extra requests are capped by bisect_budget.
+    """
+    status, error, attempts = _patch_items(client, venue_id, chunk, retries)
+    result = {"chunk": index, "items": len(chunk), "ok": status == 202, "status": status,
+              "attempts": attempts, "applied": len(chunk) if status == 202 else 0}
+    if status == 202:
+        return result
+    result["error"] = error
+    if not bisect or status not in BISECT_STATUSES:
+        return result
+    if len(chunk) == 1:
+        result["rejected"] = list(chunk)
+        return result
+
+    budget = {"left": bisect_budget(len(chunk)), "requests": 0}
+    outcome = {"applied": [], "rejected": [], "unresolved": []}
+    mid = len(chunk) // 2
+    first, second = chunk[:mid], chunk[mid:]
+    statuses = [_try_items(client, venue_id, half, retries, budget) for half in (first, second)]
+    if all(s in BISECT_STATUSES for s in statuses) and len(second) > 1:
+        # Both halves rejected: probe single items, one per half until one goes
+        # through, to tell bad items from a venue-level rejection
+        probes = []
+        for half, half_status in zip((first, second), statuses):
+            probes.append(half_status if len(half) == 1 else
+                          _try_items(client, venue_id, half[:1], retries, budget))
+            if probes[-1] == 202:
+                break
+        if 202 not in probes:
+            result["bisect_requests"] = budget["requests"]
+            result["venue_rejected"] = True
+            print(f"[{venue_id}] ⚠️ Chunk {index}: both halves and a single item from each were rejected; "
+                  f"treating it as a venue-level failure")
+            return result
+        for n, half in enumerate((first, second)):
+            if n >= len(probes):
+                _bisect(client, venue_id, half, retries, budget, outcome)
+                continue
+            probe, rest = half[:1], half[1:]
+            if probes[n] == 202:
+                # The rest of a rejected half holds the bad item(s)
+                outcome["applied"].extend(probe)
+                _bisect(client, venue_id, rest, retries, budget, outcome)
+            else:
+                outcome["rejected" if probes[n] in BISECT_STATUSES else "unresolved"].extend(probe)
+                if rest:
+                    _resolve(client, venue_id, rest, retries, budget, outcome)
+    else:
+        for half, half_status in zip((first, second), statuses):
+            if half_status == 202:
+                outcome["applied"].extend(half)
+            elif half_status in BISECT_STATUSES:
+                _bisect(client, venue_id, half, retries, budget, outcome)
+            else:
+                outcome["unresolved"].extend(half)
+
+    result["bisect_requests"] = budget["requests"]
+    result["applied"] = len(outcome["applied"])
+    result["ok"] = result["applied"] == len(chunk)
+    if outcome["rejected"]:
+        result["rejected"] = outcome["rejected"]
+    if outcome["unresolved"]:
+        result["unresolved"] = len(outcome["unresolved"])
+    print(f"[{venue_id}] 🧪 Chunk {index}: isolated {len(outcome['rejected'])} rejected item(s) "
+          f"in {budget['requests']} extra request(s)"
+          + (f", {len(outcome['unresolved'])} left unresolved (budget spent)" if outcome["unresolved"] else ""))
+    return result
+
+
+def item_key(item):
+    """'gtin:<id>' / 'sku:<id>' for an item payload, used for quarantine lists."""
+    for field in ("gtin", "sku"):
+        if item.get(field):
+            return f"{field}:{item[field]}"
+    return None
+
+
+def poison_keys(chunk_results):
+    return [key for r in chunk_results for key in map(item_key, r.get("poison", [])) if key]
+
+
+def prune_quarantine(entries, ttl_seconds, now=None):
+    """Drop quarantine entries ({key: quarantined_at}) older than ttl_seconds."""
+    now = now or time.time()
+    return {key: ts for key, ts in (entries or {}).items() if now - ts < ttl_seconds}
+
+
+def send_item_batches(client, venue_id, items, max_items=BATCH_MAX_ITEMS, max_bytes=BATCH_MAX_BYTES,
+                      workers=BATCH_WORKERS, retries=BATCH_RETRIES, bisect=True):
+    """Send items as chunked PATCHes with bounded concurrency; returns one result per chunk."""
+    chunks = chunk_items(items, max_items, max_bytes)
+    if not chunks:
+        return []
+    if len(chunks) == 1 or workers <= 1:
+        results = [send_item_chunk(client, venue_id, i, chunk, retries, bisect)
+                   for i, chunk in enumerate(chunks)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(send_item_chunk, client, venue_id, i, chunk, retries, bisect)
+                       for i, chunk in enumerate(chunks)]
+            results = [future.result() for future in futures]
+    # Items rejected on their own are poison only if the venue took other items
+    # in this call; otherwise the rejection may be about the venue, not the item
+    if any(r["applied"] for r in results):
+        for r in results:
+            if r.get("rejected"):
+                r["poison"] = r.pop("rejected")
+    return results
+
+
+def summarize_batches(chunk_results):
+    sent = sum(r["applied"] for r in chunk_results)
+    total = sum(r["items"] for r in chunk_results)
+    failed = [r for r in chunk_results if not r["ok"]]
+    return sent, total, failed
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(username=None, password=None):
+    """
+    One client per credential pair, kept at module level so warm invocations
+    reuse open connections. Call without credentials for pre-signed URLs such
+    as the menu export resource_url.
+    """
+    key = (username, password)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            auth = (username, password) if username else None
+            client = _clients[key] = WoltClient(auth=auth)
+        return client
+
+
+def connection_stats():
+    """Totals across every client since the instance started."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    totals = {"clients": len(clients), "requests": 0, "connections": 0}
+    for client in clients:
+        stats = client.stats()
+        totals["requests"] += stats["requests"]
+        totals["connections"] += stats["connections"]
+    totals["reused"] = max(0, totals["requests"] - totals["connections"])
+    return totals
+
+
+def log_connection_stats(before, label=""):
+    """Prints how many requests in this invocation reused a pooled connection."""
+    after = connection_stats()
+    sent = after["requests"] - before["requests"]
+    opened = after["connections"] - before["connections"]
+    print(f"🔌 {label}HTTP requests: {sent}, new connections: {opened}, reused: {max(0, sent - opened)}")
+    return {"requests": sent, "connections": opened, "reused": max(0, sent - opened)}